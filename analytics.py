@@ -0,0 +1,262 @@
+# analytics.py - Columnar (pandas) cache of the ledger tables and pivot queries
+
+import math
+import statistics
+import threading
+import time
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Every source is loaded once into a DataFrame and then topped up with rows
+# whose id is above the last one seen. Dimensions map the public pivot names to
+# frame columns; only these can be grouped on.
+SOURCES = {
+    'spendings': {
+        'query': """
+            SELECT s.id, v.vehicle_no AS vehicle, s.expense_month AS month_date,
+                   s.category, s.spended_by, s.mode, s.amount
+            FROM spendings s
+            LEFT JOIN vehicles v ON s.vehicle_id = v.id
+            WHERE s.id > %s
+            ORDER BY s.id
+        """,
+        'table': 'spendings',
+        'dimensions': ['vehicle', 'month', 'category', 'spended_by', 'mode'],
+    },
+    'payments': {
+        'query': """
+            SELECT p.id, v.vehicle_no AS vehicle, p.date AS month_date,
+                   COALESCE(c.name, p.received_from) AS company, p.amount
+            FROM payments p
+            LEFT JOIN vehicles v ON p.vehicle_id = v.id
+            LEFT JOIN companies c ON p.company_id = c.id
+            WHERE p.id > %s
+            ORDER BY p.id
+        """,
+        'table': 'payments',
+        'dimensions': ['vehicle', 'month', 'company'],
+    },
+    'advances': {
+        'query': """
+            SELECT id, employee_name AS employee, date AS month_date, amount
+            FROM employee_advances
+            WHERE id > %s
+            ORDER BY id
+        """,
+        'table': 'employee_advances',
+        'dimensions': ['employee', 'month'],
+    },
+}
+
+AGGREGATES = ('sum', 'count', 'mean')
+MISSING_LABEL = '(none)'
+
+
+class LedgerFrames:
+    """Holds one DataFrame per source and refreshes it incrementally.
+
+    New rows are appended by id. Deletes are detected by a row count mismatch
+    and edits by a periodic full reload, both of which rebuild the frame.
+    """
+
+    def __init__(self, conn_factory, min_refresh_interval=5, full_reload_interval=300):
+        self.conn_factory = conn_factory
+        self.min_refresh_interval = min_refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._frames = {}
+        self._checked_at = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, source=None):
+        """Force the next read of `source` (or every source) to reload fully."""
+        with self._lock:
+            for name in ([source] if source else list(self._frames)):
+                self._frames.pop(name, None)
+
+    def frame(self, source):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source '{source}'")
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at.get(source, 0) >= self.min_refresh_interval or source not in self._frames:
+                self._refresh(source, now)
+            return self._frames[source]
+
+    def _refresh(self, source, now):
+        spec = SOURCES[source]
+        current = self._frames.get(source)
+        if current is not None and now - self._loaded_at.get(source, 0) >= self.full_reload_interval:
+            current = None
+
+        conn = self.conn_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {spec['table']}")
+                row_count, max_id = cur.fetchone()
+
+                last_id = int(current['id'].max()) if current is not None and len(current) else 0
+                if current is not None and max_id == last_id and row_count == len(current):
+                    self._checked_at[source] = now
+                    return
+
+                cur.execute(spec['query'], (last_id if current is not None else 0,))
+                columns = [d[0] for d in cur.description]
+                new_rows = self._to_frame(cur.fetchall(), columns, spec)
+        finally:
+            conn.close()
+
+        if current is not None:
+            combined = pd.concat([current, new_rows], ignore_index=True)
+            if len(combined) == row_count:
+                self._frames[source] = self._categorize(combined, spec)
+                self._checked_at[source] = now
+                return
+            # Rows were deleted since the last load; start over.
+            self._frames.pop(source, None)
+            self._loaded_at[source] = 0
+            return self._refresh(source, now)
+
+        self._frames[source] = new_rows
+        self._checked_at[source] = now
+        self._loaded_at[source] = now
+        logger.info(f"Loaded {len(new_rows)} rows into the '{source}' analytics frame")
+
+    @staticmethod
+    def _to_frame(rows, columns, spec):
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').astype('float64')
+        df['month'] = pd.to_datetime(df.pop('month_date')).dt.strftime('%Y-%m')
+        return LedgerFrames._categorize(df, spec)
+
+    @staticmethod
+    def _categorize(df, spec):
+        for dim in spec['dimensions']:
+            df[dim] = df[dim].astype('object').fillna(MISSING_LABEL).astype('category')
+        return df
+
+    def pivot(self, source, rows, columns=(), agg='sum', month_from=None, month_to=None):
+        """Aggregate `amount` over any combination of the source's dimensions."""
+        spec = SOURCES.get(source)
+        if spec is None:
+            raise ValueError(f"Unknown source '{source}'")
+        return pivot_frame(self.frame(source), source, rows, columns, agg, month_from, month_to)
+
+
+def pivot_frame(df, source, rows, columns=(), agg='sum', month_from=None, month_to=None):
+    """LedgerFrames.pivot over an already loaded frame of `source`.
+
+    Cells with no rows are 0 for sum and count, and None for mean.
+    """
+    spec = SOURCES[source]
+    if agg not in AGGREGATES:
+        raise ValueError(f"Unsupported aggregate '{agg}'")
+    rows, columns = list(rows), list(columns)
+    unknown = [d for d in rows + columns if d not in spec['dimensions']]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s) for {source}: {', '.join(unknown)}")
+    if set(rows) & set(columns):
+        raise ValueError("A dimension cannot be used for both rows and columns")
+
+    if month_from or month_to:
+        # 'month' is an unordered categorical, so compare its 'YYYY-MM' labels;
+        # rows without a month fall outside any range
+        months = df['month'].astype(str)
+        keep = months != MISSING_LABEL
+        if month_from:
+            keep &= months >= month_from
+        if month_to:
+            keep &= months <= month_to
+        df = df[keep]
+
+    if not rows and not columns:
+        value = getattr(df['amount'], agg)() if len(df) else 0
+        return {'source': source, 'agg': agg, 'rows': [], 'columns': [], 'data': [{'value': float(value)}]}
+
+    grouped = df.groupby(rows + columns, observed=True)['amount'].agg(agg)
+    label = lambda c: '|'.join(map(str, c)) if isinstance(c, tuple) else str(c)
+    if columns and rows:
+        table = grouped.unstack(columns) if agg == 'mean' else grouped.unstack(columns, fill_value=0)
+        table.columns = [label(c) for c in table.columns]
+        data = table.reset_index().to_dict(orient='records')
+    elif columns:
+        data = [{label(c): v for c, v in grouped.items()}]
+    else:
+        data = grouped.reset_index(name='value').to_dict(orient='records')
+
+    for record in data:
+        for key, value in record.items():
+            if hasattr(value, 'item'):
+                value = value.item()
+            record[key] = None if isinstance(value, float) and math.isnan(value) else value
+
+    return {'source': source, 'agg': agg, 'rows': rows, 'columns': columns, 'data': data}
+
+
+# Pivots timed by benchmark(), as (rows, columns) over the spendings source
+BENCHMARK_PIVOTS = [
+    (['vehicle', 'month'], []),
+    (['category'], ['mode']),
+    (['vehicle', 'month'], ['category']),
+    (['spended_by', 'mode', 'category'], []),
+]
+
+BENCHMARK_SQL_DIMENSIONS = {
+    'vehicle': 'vehicle',
+    'month': "to_char(month_date, 'YYYY-MM')",
+    'category': 'category',
+    'spended_by': 'spended_by',
+    'mode': 'mode',
+}
+
+
+def benchmark(cur, row_count=200000, repeat=5, pivots=BENCHMARK_PIVOTS):
+    """Median milliseconds of each pivot as a GROUP BY query and as a pandas
+    pivot, over `row_count` generated spendings in a temporary table.
+
+    Must run inside a transaction: the table is dropped when it ends. Returns
+    {'load': ms to build the frame, 'rows': row_count, 'pivots': [(name, sql_ms, pandas_ms)]}.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE bench_spendings ON COMMIT DROP AS
+        SELECT g AS id,
+               'TS' || lpad((g % 200)::text, 3, '0') AS vehicle,
+               (DATE '2020-01-01' + (g % 60) * INTERVAL '1 month')::date AS month_date,
+               (ARRAY['diesel', 'salary', 'others'])[1 + g % 3] AS category,
+               (ARRAY['A', 'B', 'C', 'D', NULL])[1 + g % 5] AS spended_by,
+               (ARRAY['cash', 'bank', 'card', NULL])[1 + (g / 7) % 4] AS mode,
+               round((random() * 5000)::numeric, 2) AS amount
+        FROM generate_series(1, %s) g
+    """, (row_count,))
+    cur.execute("ANALYZE bench_spendings")
+
+    def timed(fn):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(samples), 2), result
+
+    def load():
+        cur.execute("SELECT id, vehicle, month_date, category, spended_by, mode, amount FROM bench_spendings")
+        columns = [d[0] for d in cur.description]
+        return LedgerFrames._to_frame(cur.fetchall(), columns, SOURCES['spendings'])
+
+    load_ms, df = timed(load)
+    results = []
+    for rows, columns in pivots:
+        dims = ', '.join(BENCHMARK_SQL_DIMENSIONS[d] for d in rows + columns)
+        sql = f"SELECT {dims}, SUM(amount) FROM bench_spendings GROUP BY {dims}"
+
+        def run_sql():
+            cur.execute(sql)
+            return cur.fetchall()
+
+        sql_ms, _ = timed(run_sql)
+        pandas_ms, _ = timed(lambda: pivot_frame(df, 'spendings', rows, columns))
+        results.append(('x'.join(rows) + ('/' + 'x'.join(columns) if columns else ''), sql_ms, pandas_ms))
+    return {'load': load_ms, 'rows': row_count, 'pivots': results}
@@ -0,0 +1,167 @@
+# anomalies.py - Outlier and duplicate flags on spendings
+#
+# Every inserted or edited spending is scored by the score_spending() trigger
+# (see create_anomaly_tables) against spend_stats, which keeps the count,
+# mean and sum of squared deviations (Welford) of ln(1 + amount) per vehicle
+# and category. Scoring and the stats update are O(1) per row; edits and
+# deletes take the old amount back out of the stats.
+#
+# A spending is flagged when
+#   * high / low  - its amount is ANOMALY_Z_THRESHOLD standard deviations
+#                   from its series mean (once the series has
+#                   ANOMALY_MIN_SAMPLES rows); on the log scale an extra zero
+#                   is a shift of ln(10) whatever the usual amount;
+#   * duplicate   - a spending written before it (lower id) has the same
+#                   vehicle, category and amount, dated within
+#                   ANOMALY_DUPLICATE_DAYS days either side.
+# Flags live in spending_anomalies until reviewed; editing the spending scores
+# it again.
+#
+# backfill() rebuilds the stats and the unreviewed flags from the full history
+# in one vectorized pass (`flask --app app score-anomalies`). It replays the
+# rows in id order, so each row gets the flag the trigger gave it when it was
+# inserted (edits and deletes since then aside).
+
+import numpy as np
+import pandas as pd
+from psycopg2 import extras
+
+
+def _log_amount(amounts):
+    return np.log1p(np.abs(amounts.astype(float)))
+
+
+def _window_min(values, lo, hi):
+    """min(values[lo[i]:hi[i]]) for every i (all ranges non-empty), from a
+    sparse table of power-of-two range minima."""
+    levels = [values]
+    while 2 ** len(levels) <= len(values):
+        prev, half = levels[-1], 2 ** (len(levels) - 1)
+        levels.append(np.minimum(prev[:-half], prev[half:]))
+    level = np.floor(np.log2(hi - lo)).astype(int)
+    result = np.empty(len(lo), dtype=values.dtype)
+    for k in np.unique(level):
+        rows = level == k
+        table = levels[k]
+        result[rows] = np.minimum(table[lo[rows]], table[hi[rows] - 2 ** k])
+    return result
+
+
+def score_history(df, z_threshold, min_samples, min_stddev, duplicate_days):
+    """Score every row of `df` (id, vehicle_id, category, date, amount) as the
+    score_spending() trigger did when it was inserted: against the rows of its
+    series with a lower id. Returns (flags, stats): flags has spending_id,
+    reason, score and expected_amount; stats has vehicle_id, category, n, mean
+    and m2 over the whole history."""
+    df = df.dropna(subset=['vehicle_id', 'category']).sort_values('id', kind='stable')
+    df = df.assign(x=_log_amount(df['amount']))
+    df['x2'] = df['x'] ** 2
+    groups = df.groupby(['vehicle_id', 'category'], sort=False)
+
+    # Running totals over the earlier rows of each series
+    n = groups.cumcount().to_numpy()
+    sum_x = groups['x'].cumsum().to_numpy() - df['x'].to_numpy()
+    sum_x2 = groups['x2'].cumsum().to_numpy() - df['x2'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sum_x / n
+        variance = (sum_x2 - n * mean ** 2) / (n - 1)
+        z = (df['x'].to_numpy() - mean) / np.maximum(np.sqrt(np.clip(variance, 0, None)), min_stddev)
+    scored = n >= min_samples
+    outlier = scored & (np.abs(z) >= z_threshold)
+
+    # A duplicate has a lower id among the same vehicle/category/amount rows
+    # dated within the window: sort by (series, date) so each row's window is
+    # a slice, and compare its id with the smallest id in that slice
+    by_amount = df.sort_values(['vehicle_id', 'category', 'amount', 'date', 'id'])
+    series = by_amount.groupby(['vehicle_id', 'category', 'amount'], sort=False).ngroup().to_numpy()
+    days = (by_amount['date'] - by_amount['date'].min()).dt.days.to_numpy()
+    key = series.astype(np.int64) * (days.max(initial=0) + 2 * duplicate_days + 1) + days
+    lo = np.searchsorted(key, key - duplicate_days, side='left')
+    hi = np.searchsorted(key, key + duplicate_days, side='right')
+    ids = by_amount['id'].to_numpy()
+    duplicate_ids = ids[_window_min(ids, lo, hi) < ids] if len(ids) else ids
+    duplicate = df['id'].isin(duplicate_ids).to_numpy()
+
+    flagged = outlier | duplicate
+    flags = pd.DataFrame({
+        'spending_id': df['id'].to_numpy()[flagged],
+        'reason': np.where(duplicate, 'duplicate', np.where(z > 0, 'high', 'low'))[flagged],
+        'score': np.where(scored, z, np.nan)[flagged],
+        'expected_amount': np.where(scored, np.expm1(mean), np.nan)[flagged].round(2),
+    })
+
+    stats = groups.agg(n=('x', 'count'), sum_x=('x', 'sum'), sum_x2=('x2', 'sum')).reset_index()
+    stats['mean'] = stats['sum_x'] / stats['n']
+    stats['m2'] = (stats['sum_x2'] - stats['sum_x'] * stats['mean']).clip(lower=0)
+    return flags, stats[['vehicle_id', 'category', 'n', 'mean', 'm2']]
+
+
+def backfill(cur, z_threshold, min_samples, min_stddev, duplicate_days):
+    """Rebuild spend_stats and the unreviewed flags from all spendings; must
+    run inside a transaction. Returns (series, flagged)."""
+    # Block writers so the live trigger and the rebuilt stats agree
+    cur.execute("LOCK TABLE spendings IN SHARE MODE")
+    cur.execute("SELECT id, vehicle_id, category, date, amount FROM spendings")
+    df = pd.DataFrame(cur.fetchall(), columns=['id', 'vehicle_id', 'category', 'date', 'amount'])
+    df['date'] = pd.to_datetime(df['date'])
+    flags, stats = score_history(df, z_threshold, min_samples, min_stddev, duplicate_days)
+
+    cur.execute("DELETE FROM spend_stats")
+    extras.execute_values(cur, """
+        INSERT INTO spend_stats (vehicle_id, category, n, mean, m2) VALUES %s
+    """, [(int(r.vehicle_id), r.category, int(r.n), float(r.mean), float(r.m2))
+          for r in stats.itertuples(index=False)])
+
+    cur.execute("DELETE FROM spending_anomalies WHERE reviewed_at IS NULL")
+    extras.execute_values(cur, """
+        INSERT INTO spending_anomalies (spending_id, reason, score, expected_amount) VALUES %s
+        ON CONFLICT (spending_id) DO NOTHING
+    """, [(int(r.spending_id), r.reason,
+           None if np.isnan(r.score) else float(r.score),
+           None if np.isnan(r.expected_amount) else float(r.expected_amount))
+          for r in flags.itertuples(index=False)])
+    return len(stats), len(flags)
+
+
+def flagged(cur, month=None, include_reviewed=False, limit=500):
+    """Flagged spendings, newest first; `month` is the first day of an expense month."""
+    cur.execute("""
+        SELECT s.id, s.date, s.expense_month, v.vehicle_no, s.category, s.reason AS description,
+               s.amount, s.spended_by, s.mode,
+               a.reason, a.score, a.expected_amount, a.flagged_at, a.reviewed_at, a.reviewed_by
+        FROM spending_anomalies a
+        JOIN spendings s ON s.id = a.spending_id
+        LEFT JOIN vehicles v ON v.id = s.vehicle_id
+        WHERE (%(month)s::date IS NULL OR s.expense_month = %(month)s)
+        AND (%(reviewed)s OR a.reviewed_at IS NULL)
+        ORDER BY s.date DESC, s.id DESC
+        LIMIT %(limit)s
+    """, {'month': month, 'reviewed': include_reviewed, 'limit': limit})
+    return [{
+        'id': row['id'],
+        'date': row['date'].strftime('%Y-%m-%d'),
+        'expense_month': row['expense_month'].strftime('%Y-%m') if row['expense_month'] else None,
+        'vehicle_no': row['vehicle_no'],
+        'category': row['category'],
+        'description': row['description'],
+        'amount': float(row['amount']),
+        'spended_by': row['spended_by'],
+        'mode': row['mode'],
+        'flag': row['reason'],
+        'score': round(row['score'], 2) if row['score'] is not None else None,
+        'expected_amount': float(row['expected_amount']) if row['expected_amount'] is not None else None,
+        'flagged_at': row['flagged_at'].isoformat() if row['flagged_at'] else None,
+        'reviewed_at': row['reviewed_at'].isoformat() if row['reviewed_at'] else None,
+        'reviewed_by': row['reviewed_by'],
+    } for row in cur.fetchall()]
+
+
+def review(cur, spending_id, reviewed_by=None):
+    """Mark a flag as reviewed so it stops showing; raises ValueError if none."""
+    cur.execute("""
+        UPDATE spending_anomalies
+        SET reviewed_at = CURRENT_TIMESTAMP, reviewed_by = %s
+        WHERE spending_id = %s AND reviewed_at IS NULL
+    """, (reviewed_by, spending_id))
+    if cur.rowcount == 0:
+        raise ValueError(f"Spending {spending_id} has no open anomaly flag")
@@ -1,20 +1,56 @@
 # app_postgresql.py - Complete, Corrected Version with PostgreSQL, SSL, and all Routes
 
 from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from flask import stream_template, get_flashed_messages, has_request_context, g
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from flask_bcrypt import Bcrypt
 import psycopg2 # CHANGED: PostgreSQL connector
-from psycopg2 import extras # ADDED: For DictCursor to fetch results as dictionaries
+import psycopg2.errors
 import logging
+import mimetypes
+import click
+import functools
+import os
+import threading
+import time
 from logging.handlers import RotatingFileHandler
 import config
 from datetime import datetime, timedelta
 from decimal import Decimal
 import csv
 from io import StringIO
-from flask import make_response
+from flask import make_response, send_from_directory
+from werkzeug.utils import secure_filename
+import analytics
+import listener
+import replica
+import search
+import spending_filters
+import reports
+import assets
+import fragments
+import db
+import ingest
+import reconcile
+import jobs
+import month_close
+import journal
+import changes
+import forecast
+import anomalies
+import fuel
+import tenants
 
 app = Flask(__name__)
+if config.MISSING_SECRETS and not (app.debug or __name__ == '__main__'):
+    raise RuntimeError(f"Set {', '.join(config.MISSING_SECRETS)} in the environment "
+                       f"(the built-in values are for local development with FLASK_DEBUG=1 only)")
 app.secret_key = config.SECRET_KEY
+
+# Reuse compiled templates across restarts
+os.makedirs(config.JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(config.JINJA_CACHE_DIR)
 bcrypt = Bcrypt(app)
 
 # Set up logging
@@ -36,30 +72,541 @@ def login_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
-def get_db_conn():
-    """Establishes a PostgreSQL database connection with SSL."""
+db_router = db.DatabaseRouter(config.DB_PRIMARY_DSN, config.DB_REPLICA_DSNS,
+                              max_lag=config.DB_REPLICA_MAX_LAG,
+                              max_idle=config.DB_POOL_MAX_IDLE)
+
+def _reads_from_replica():
+    """GET/HEAD requests read from a replica unless this session wrote recently."""
+    return (has_request_context()
+            and request.method in ('GET', 'HEAD')
+            and session.get('db_pinned_until', 0) < time.time())
+
+def get_db_conn(primary=False, tenant_id=None):
+    """Establishes a PostgreSQL connection: a replica for plain reads, otherwise the primary.
+
+    The connection acts for `tenant_id`, by default the request's tenant (none
+    before login, which sees no tenant rows) or, outside a request (schema
+    setup, background threads), the default tenant.
+    """
     try:
-        conn = psycopg2.connect(
-            host=config.DB_HOST,
-            port=config.DB_PORT,
-            user=config.DB_USER,
-            password=config.DB_PASS,
-            dbname=config.DB_NAME,
-            sslmode='prefer'  # FIXED: Changed to 'prefer' for better compatibility
-        )
-        conn.autocommit = True
+        if not primary and _reads_from_replica():
+            conn = db_router.replica()
+        else:
+            conn = db_router.primary()
+        if has_request_context():
+            limits = g.get('db_limits', {})
+            db.apply_limits(conn,
+                            limits.get('statement_timeout', config.DB_STATEMENT_TIMEOUT_MS),
+                            limits.get('lock_timeout', config.DB_LOCK_TIMEOUT_MS))
+            conn.budget = g.get('db_budget')
+            if tenant_id is None:
+                tenant_id = g.get('tenant_id')
+        elif tenant_id is None:
+            tenant_id = tenants.DEFAULT_TENANT_ID
+        if tenant_id is not None:
+            db.set_tenant(conn, tenant_id)
         logger.info("Database connection established successfully.")
         return conn
     except Exception as e:
         logger.error(f"Database connection failed: {e}")
         raise
 
+# Query limits
+# ----------------------------------------------------
+@app.before_request
+def start_query_budget():
+    g.db_budget = db.QueryBudget(config.DB_REQUEST_BUDGET_SECONDS, config.DB_REQUEST_BUDGET_ROWS)
+
+# Tenant (depot) a request acts for: the logged-in user's (see tenants.py).
+# Routes authenticated by API key set g.tenant_id from the key instead.
+@app.before_request
+def resolve_tenant():
+    g.tenant_id = session.get('tenant_id')
+    if g.tenant_id is None and 'user_id' in session:
+        # Sessions started before tenants existed
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT tenant_id FROM users WHERE id = %s", (session['user_id'],))
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            session.clear()
+        else:
+            session['tenant_id'] = g.tenant_id = row[0]
+
+# Tenant codes never change, so their ids are cached per process
+_tenant_ids = {}
+
+def tenant_id_for(code):
+    """Id of the tenant with `code` (the default tenant for None); raises
+    ValueError for an unknown code."""
+    if code is None:
+        return tenants.DEFAULT_TENANT_ID
+    if code not in _tenant_ids:
+        conn = db_router.primary()
+        try:
+            with conn.cursor() as cur:
+                _tenant_ids[code] = tenants.by_code(cur, code)
+        finally:
+            conn.close()
+    return _tenant_ids[code]
+
+def query_limits(statement_timeout=None, lock_timeout=None, max_seconds=None, max_rows=None):
+    """Override the default timeouts (ms) and request budget for one route.
+
+    Must wrap the view directly (below @login_required) so it runs before the
+    view opens its connection.
+    """
+    def decorator(f):
+        def limited_function(*args, **kwargs):
+            limits = {}
+            if statement_timeout is not None:
+                limits['statement_timeout'] = statement_timeout
+            if lock_timeout is not None:
+                limits['lock_timeout'] = lock_timeout
+            g.db_limits = limits
+            g.db_budget = db.QueryBudget(
+                max_seconds if max_seconds is not None else config.DB_REQUEST_BUDGET_SECONDS,
+                max_rows if max_rows is not None else config.DB_REQUEST_BUDGET_ROWS)
+            return f(*args, **kwargs)
+        limited_function.__name__ = f.__name__
+        return limited_function
+    return decorator
+
+@app.errorhandler(db.QueryBudgetExceeded)
+@app.errorhandler(psycopg2.errors.QueryCanceled)
+@app.errorhandler(psycopg2.errors.LockNotAvailable)
+def query_limit_exceeded(e):
+    if isinstance(e, db.QueryBudgetExceeded):
+        message = str(e)
+    elif isinstance(e, psycopg2.errors.LockNotAvailable):
+        message = 'The data is being changed by another request; please retry.'
+    else:
+        message = 'The query took too long and was cancelled; narrow the date range or filters.'
+    app.logger.warning(f"Query limit hit on {request.endpoint}: {e}")
+    if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': message}), 503
+    return message, 503
+
+@app.after_request
+def pin_session_to_primary(response):
+    # Read-your-writes: the redirect after a POST must not hit a lagging replica
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        session['db_pinned_until'] = time.time() + config.DB_PIN_SECONDS
+    return response
+
 # Helper function to get a cursor that returns dictionaries
 def get_dict_cursor(conn):
-    return conn.cursor(cursor_factory=extras.DictCursor)
+    return conn.cursor(cursor_factory=db.BudgetedDictCursor)
+
+# In-process DataFrame caches used by the pivot API, one per tenant (each is
+# refreshed from the requesting tenant's connections)
+ledger_frames = {}
+_ledger_frames_lock = threading.Lock()
+
+def tenant_ledger_frames():
+    with _ledger_frames_lock:
+        frames = ledger_frames.get(g.tenant_id)
+        if frames is None:
+            frames = ledger_frames[g.tenant_id] = analytics.LedgerFrames(get_db_conn)
+    return frames
+
+# Row-level change notifications and the in-memory ledger replicas they feed,
+# one per tenant, created when the tenant is first served by this worker
+ledger_listener = listener.ChangeListener(get_db_conn)
+ledger_replicas = {}
+_ledger_replicas_lock = threading.Lock()
+
+def ledger_replica_for(tenant_id):
+    with _ledger_replicas_lock:
+        ledger_replica = ledger_replicas.get(tenant_id)
+        if ledger_replica is None:
+            # Always the primary: notifications come from it, and verify()
+            # runs inside GET requests that would otherwise read a lagging replica
+            ledger_replica = ledger_replicas[tenant_id] = replica.LedgerReplica(
+                functools.partial(get_db_conn, primary=True, tenant_id=tenant_id), ledger_listener, tenant_id)
+    return ledger_replica
+
+# Fan-out of change notifications to Server-Sent Events clients
+event_broadcaster = listener.EventBroadcaster()
+ledger_listener.subscribe(event_broadcaster.publish, on_reconnect=event_broadcaster.resync)
+
+# Fingerprinted static bundles (see assets.py); asset_url() is used by the templates
+asset_manifest = assets.AssetManifest(app.static_folder)
+
+@app.template_global()
+def asset_url(name):
+    hashed = asset_manifest.get(name)
+    if hashed is None:
+        return url_for('static', filename=asset_manifest.source_path(name))
+    return url_for('built_asset', filename=hashed)
+
+@app.route('/assets/<path:filename>')
+def built_asset(filename):
+    dist = os.path.join(app.static_folder, assets.DIST_DIR)
+    suffix, encoding = assets.pick_encoding(request.headers.get('Accept-Encoding'),
+                                            os.path.join(dist, filename))
+    # Hashed names never change content, so they can be cached forever
+    response = send_from_directory(dist, filename + suffix, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return response
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Bundle, minify and fingerprint static assets into static/dist."""
+    manifest = assets.build(app.static_folder)
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f"{name} -> {hashed}")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the schema (tables, triggers, policies)."""
+    started = time.monotonic()
+    initialize_database()
+    click.echo(f"Database initialized in {time.monotonic() - started:.3f}s")
+
+def job_conn(tenant_id=None):
+    """Primary connection for job workers, with the (longer) job statement
+    timeout, acting for `tenant_id` (with none, only the tenants table is visible)."""
+    conn = db_router.primary()
+    db.apply_limits(conn, config.JOB_STATEMENT_TIMEOUT_MS, config.DB_LOCK_TIMEOUT_MS)
+    if tenant_id is not None:
+        db.set_tenant(conn, tenant_id)
+    return conn
+
+def tenant_conn(tenant_id):
+    """Primary connection acting for one tenant, for maintenance commands."""
+    conn = db_router.primary()
+    db.set_tenant(conn, tenant_id)
+    return conn
+
+def each_tenant():
+    """[(id, code)] of every tenant; maintenance commands run once per tenant."""
+    conn = db_router.primary()
+    try:
+        with conn.cursor() as cur:
+            return tenants.all_tenants(cur)
+    finally:
+        conn.close()
+
+@app.cli.command('run-jobs')
+@click.option('--processes', default=config.JOB_WORKER_PROCESSES, show_default=True,
+              help='Number of worker processes.')
+def run_jobs_command(processes):
+    """Run background report/export jobs until interrupted."""
+    db_router.dispose()
+    jobs.run_pool(job_conn, config.JOB_RESULTS_DIR, processes, config.JOB_RESULT_TTL_HOURS)
+
+@app.cli.command('add-tenant')
+@click.argument('code')
+@click.argument('name')
+@click.option('--admin', 'admin_username', required=True, help="Username of the tenant's first user.")
+@click.password_option(help="Password of the tenant's first user.")
+def add_tenant_command(code, name, admin_username, password):
+    """Add a tenant (depot) and its first user."""
+    conn = db_router.primary()
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            tenant_id = tenants.add(cur, code, name)
+            cur.execute("INSERT INTO users (username, password_hash, tenant_id) VALUES (%s, %s, %s)",
+                        (admin_username, bcrypt.generate_password_hash(password).decode('utf-8'), tenant_id))
+        conn.commit()
+        click.echo(f"Added tenant {code} (id {tenant_id}) with user {admin_username}")
+    except ValueError as e:
+        conn.rollback()
+        raise click.ClickException(str(e))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.cli.command('bench-tenants')
+@click.option('--repeat', default=5, show_default=True, help='Runs per query; the median is reported.')
+def bench_tenants_command(repeat):
+    """Time representative reads (ms) as each tenant; read-only. Per-tenant
+    times should track the tenant's own row count, not the number of tenants."""
+    names = ['spendings'] + list(tenants.BENCHMARK_QUERIES)
+    click.echo('\t'.join(['tenant'] + names))
+    for tenant_id, code in each_tenant():
+        conn = tenant_conn(tenant_id)
+        try:
+            with conn.cursor() as cur:
+                timings = tenants.benchmark(cur, repeat)
+        finally:
+            conn.close()
+        click.echo('\t'.join([code] + [str(timings[name]) for name in names]))
+
+@app.cli.command('bench-pivot')
+@click.option('--rows', 'row_count', default=200000, show_default=True, help='Generated spendings rows.')
+@click.option('--repeat', default=5, show_default=True, help='Runs per pivot; the median is reported.')
+def bench_pivot_command(row_count, repeat):
+    """Time pivots (ms) as GROUP BY queries and as pandas pivots over the same
+    generated rows. Uses a temporary table; nothing is written to the ledger."""
+    conn = db_router.primary()
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            timings = analytics.benchmark(cur, row_count, repeat)
+        conn.rollback()
+    finally:
+        conn.close()
+    click.echo(f"{timings['rows']} rows, frame loaded in {timings['load']} ms")
+    click.echo('\t'.join(['pivot', 'sql', 'pandas']))
+    for name, sql_ms, pandas_ms in timings['pivots']:
+        click.echo(f"{name}\t{sql_ms}\t{pandas_ms}")
+
+@app.cli.command('checkpoint-journal')
+def checkpoint_journal_command():
+    """Add the missing monthly balance checkpoints (run after each month starts)."""
+    for tenant_id, code in each_tenant():
+        conn = tenant_conn(tenant_id)
+        try:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                created = journal.create_checkpoints(cur)
+            conn.commit()
+            click.echo(f"{code}: created {len(created)} checkpoints"
+                       + (f" ({created[0]:%Y-%m} to {created[-1]:%Y-%m})" if created else ''))
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+@app.cli.command('export-changes')
+@click.option('--tenant', 'tenant_code', default=None, help='Tenant code (default: the default tenant).')
+@click.option('--since', default=0, show_default=True, help='Last change seq already processed.')
+@click.option('--table', 'tables', multiple=True, help='Only changes to this table (repeatable).')
+@click.option('--limit', default=None, type=int, help='Stop after this many changes.')
+def export_changes_command(tenant_code, since, tables, limit):
+    """Write a tenant's changes after --since to stdout as NDJSON, one change per line."""
+    conn = tenant_conn(tenant_id_for(tenant_code))
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            head = changes.publish(cur)
+            changes.check_since(cur, since)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+    for chunk in changes.iter_changes_ndjson(conn, since, tables, limit):
+        click.echo(chunk, nl=False)
+    click.echo(f"Published up to seq {head}", err=True)
+
+@app.cli.command('prune-changes')
+@click.option('--days', default=config.CHANGE_LOG_RETENTION_DAYS, show_default=True,
+              help='Keep changes from the last this many days.')
+def prune_changes_command(days):
+    """Delete old published changes from the change log."""
+    for tenant_id, code in each_tenant():
+        conn = tenant_conn(tenant_id)
+        try:
+            with conn.cursor() as cur:
+                click.echo(f"{code}: pruned {changes.prune(cur, days)} changes")
+        finally:
+            conn.close()
+
+@app.cli.command('forecast-spend')
+def forecast_spend_command():
+    """Recompute this month's spend forecasts (run nightly)."""
+    for tenant_id, code in each_tenant():
+        conn = job_conn(tenant_id)
+        try:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                count = forecast.run(cur)
+            conn.commit()
+            click.echo(f"{code}: forecast {count} vehicle/category series")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+@app.cli.command('score-anomalies')
+def score_anomalies_command():
+    """Rebuild the anomaly statistics and flags from the full spending history."""
+    for tenant_id, code in each_tenant():
+        conn = job_conn(tenant_id)
+        try:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                series, flagged = anomalies.backfill(cur, *anomaly_settings())
+            conn.commit()
+            click.echo(f"{code}: scored {series} vehicle/category series, {flagged} spendings flagged")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+# Streamed pages
+# ----------------------------------------------------
+STREAM_CHUNK_SIZE = 8192
+STREAM_ERROR_MARKER = ('<div class="alert alert-error" role="alert">This page stopped loading '
+                       'because of an error; the list above is incomplete. Please reload.</div>')
+
+def stream_page(template_name, conn=None, **context):
+    """Render a template as a streamed response, closing `conn` (used by any
+    lazy row sets in the context) after the last chunk is sent.
+
+    Flashed messages are read before streaming starts: the session cookie goes
+    out with the headers, so popping them mid-stream would never be saved.
+    """
+    get_flashed_messages(with_categories=True)
+    chunks = stream_template(template_name, **context)
+
+    def generate():
+        buffer = []
+        size = 0
+        try:
+            for chunk in chunks:
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield ''.join(buffer)
+                    buffer = []
+                    size = 0
+            yield ''.join(buffer)
+        except Exception as e:
+            app.logger.error(f"Error streaming {template_name}: {str(e)}")
+            # The status line has gone out already; leave a visible marker
+            # instead of a page that silently ends mid-table
+            yield ''.join(buffer) + STREAM_ERROR_MARKER
+        finally:
+            if conn is not None:
+                conn.close()
+
+    return app.response_class(generate(), mimetype='text/html')
+
+# Rendered settled-history rows for closed months, keyed by tenant and the month's periods.updated_at
+settled_fragments = fragments.FragmentCache()
+
+SETTLED_ROWS_SQL = """
+    SELECT s.*, v.vehicle_no
+    FROM spendings s
+    JOIN vehicles v ON s.vehicle_id = v.id
+    WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
+    AND s.date < %s AND {month_filter}
+    ORDER BY s.date DESC
+"""
+
+def _settled_sections(conn):
+    """Settled-history table body, one HTML chunk per expense month (newest first)."""
+    settled_rows = app.jinja_env.get_template('_spending_rows.html').module.settled_rows
+    cutoff = datetime.now().date() - timedelta(days=30)
+
+    def render(month_filter, *params):
+        with get_dict_cursor(conn) as cur:
+            cur.execute(SETTLED_ROWS_SQL.format(month_filter=month_filter), (cutoff,) + params)
+            return str(settled_rows(cur.fetchall()))
+
+    with get_dict_cursor(conn) as cur:
+        cur.execute("SELECT month, status, updated_at FROM periods WHERE spendings_count > 0 ORDER BY month DESC")
+        periods = cur.fetchall()
+    for period in periods:
+        month = period['month']
+        if period['status'] == 'closed':
+            key = ('settled', g.tenant_id, month, period['updated_at'], cutoff)
+            html = settled_fragments.get_or_render(key, lambda: render("s.expense_month = %s", month))
+        else:
+            html = render("s.expense_month = %s", month)
+        if html.strip():
+            yield Markup(html)
+    html = render("s.expense_month IS NULL")
+    if html.strip():
+        yield Markup(html)
+
+@app.before_request
+def start_background_services():
+    if config.LEDGER_REPLICA_ENABLED and g.tenant_id is not None:
+        ledger_replica_for(g.tenant_id).start()
+
+# Startup: app factory for the WSGI entry point and per-worker warmup
+# ----------------------------------------------------
+_boot = {'started': time.monotonic(), 'first_request_logged': False}
+
+@app.before_request
+def log_first_request():
+    if not _boot['first_request_logged']:
+        _boot['first_request_logged'] = True
+        logger.info(f"Worker {os.getpid()} serving its first request "
+                    f"{time.monotonic() - _boot['started']:.3f}s after start")
+
+def precompile_templates():
+    """Load every template so the compiled code is in memory (and in the
+    bytecode cache) before workers are forked."""
+    started = time.monotonic()
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    logger.info(f"Compiled {len(names)} templates in {time.monotonic() - started:.3f}s")
+
+def create_app(init_db=True):
+    """Set the application up once, in the process that imports it (the
+    gunicorn master when preloading): schema checks and template compilation."""
+    started = time.monotonic()
+    if init_db:
+        initialize_database()
+    precompile_templates()
+    logger.info(f"Application ready in {time.monotonic() - started:.3f}s")
+    return app
+
+def warm_worker():
+    """Per-worker warmup, run right after fork: open pooled connections and
+    start loading the in-memory ledger replica before traffic arrives."""
+    _boot['started'] = time.monotonic()
+    _boot['first_request_logged'] = False
+    db_router.warm(config.DB_POOL_WARM)
+    if config.LEDGER_REPLICA_ENABLED:
+        ledger_replica_for(tenants.DEFAULT_TENANT_ID).start()
+    asset_manifest.get('app.js')
+    logger.info(f"Worker {os.getpid()} warmed in {time.monotonic() - _boot['started']:.3f}s")
 
 # Create tables functions
 # ----------------------------------------------------
+def create_tenants_table():
+    """Tenants (depots) and current_tenant_id(), which the tenant_id column
+    defaults and row-level security policies read (see tenants.py). Runs
+    first: every other table refers to it."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS tenants (
+                    id SERIAL PRIMARY KEY,
+                    code VARCHAR(50) UNIQUE NOT NULL,
+                    name VARCHAR(255) NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+
+                -- The tenant the session acts for (db.set_tenant), NULL if none
+                CREATE OR REPLACE FUNCTION current_tenant_id() RETURNS INTEGER AS $$
+                    SELECT NULLIF(current_setting('app.tenant_id', true), '')::integer
+                $$ LANGUAGE sql STABLE;
+            """)
+            # Rows that existed before tenants belong to the default tenant
+            cur.execute("""
+                INSERT INTO tenants (id, code, name) VALUES (%s, %s, 'Main depot')
+                ON CONFLICT (id) DO NOTHING
+            """, (tenants.DEFAULT_TENANT_ID, tenants.DEFAULT_TENANT_CODE))
+            cur.execute("SELECT setval(pg_get_serial_sequence('tenants', 'id'), MAX(id)) FROM tenants")
+    except Exception as e:
+        logger.error(f"Error creating tenants table: {e}")
+    finally:
+        conn.close()
+
 def create_auth_tables():
     conn = get_db_conn()
     try:
@@ -69,7 +616,8 @@ def create_auth_tables():
                     id SERIAL PRIMARY KEY,
                     username VARCHAR(80) UNIQUE NOT NULL,
                     password_hash VARCHAR(120) NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 )
             """)
 
@@ -93,10 +641,12 @@ def create_vehicles_table():
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS vehicles (
                     id SERIAL PRIMARY KEY,
-                    vehicle_no VARCHAR(50) UNIQUE NOT NULL,
+                    vehicle_no VARCHAR(50) NOT NULL,
                     owner_name VARCHAR(100),
                     contact_number VARCHAR(20),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    UNIQUE (tenant_id, vehicle_no)
                 );
             """)
     except Exception as e:
@@ -120,7 +670,8 @@ def create_spendings_table():
                     spended_by VARCHAR(50),
                     mode VARCHAR(50),
                     marked BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -139,7 +690,8 @@ def create_payments_table():
                     amount NUMERIC(10, 2) NOT NULL,
                     received_from VARCHAR(100),
                     reason TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -154,8 +706,10 @@ def create_companies_table():
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS companies (
                     id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) UNIQUE NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    name VARCHAR(255) NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    UNIQUE (tenant_id, name)
                 );
             """)
     except Exception as e:
@@ -174,7 +728,8 @@ def create_employee_advances_table():
                     date DATE NOT NULL,
                     amount NUMERIC(10, 2) NOT NULL,
                     purpose TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -216,10 +771,12 @@ def create_hired_vehicles_table():
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS hired_vehicles (
                     id SERIAL PRIMARY KEY,
-                    vehicle_no VARCHAR(50) UNIQUE NOT NULL,
+                    vehicle_no VARCHAR(50) NOT NULL,
                     owner_name VARCHAR(255),
                     contact_number VARCHAR(20),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    UNIQUE (tenant_id, vehicle_no)
                 );
             """)
     except Exception as e:
@@ -241,7 +798,8 @@ def create_hired_vehicle_transactions_table():
                     amount NUMERIC(10, 2) NOT NULL,
                     description TEXT,
                     reference_no VARCHAR(100),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -262,7 +820,8 @@ def create_company_sales_table():
                     sale_amount NUMERIC(12,2) NOT NULL,
                     description TEXT,
                     month_year DATE NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -284,7 +843,8 @@ def create_company_payments_table():
                     reference_number VARCHAR(100),
                     description TEXT,
                     month_year DATE NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
                 );
             """)
     except Exception as e:
@@ -292,719 +852,2095 @@ def create_company_payments_table():
     finally:
         conn.close()
 
-def initialize_database():
-    """Initialize all database tables and views"""
-    create_auth_tables()
-    create_vehicles_table()
-    create_spendings_table()
-    create_payments_table()
-    create_companies_table()
-    create_employee_advances_table()
-    create_employee_balance_view()
-    create_hired_vehicles_table()
-    create_hired_vehicle_transactions_table()
-    create_company_sales_table()
-    create_company_payments_table()
-    logger.info("All database tables initialized successfully")
-
-# ----------------------------------------------------
+# Tables whose row changes are broadcast on the ledger_changes channel
+LEDGER_NOTIFY_TABLES = ['spendings', 'payments', 'employee_advances', 'company_sales',
+                        'company_payments', 'hired_vehicle_transactions', 'vehicles', 'companies']
 
-# Home / Dashboard with monthly expense tracking
-@app.route('/')
-@login_required
-def index():
+def create_change_notify_triggers():
     conn = get_db_conn()
-    vehicles = []
-    monthly_vehicle_expenses = []
-    monthly_trend = []
-    totals = {
-        'vehicles': 0,
-        'credited': 0,
-        'debited': 0,
-        'balance': 0,
-        'current_month': 0,
-        'prev_month': 0
-    }
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION notify_ledger_change() RETURNS trigger AS $$
+                DECLARE
+                    row_id INTEGER;
+                    row_tenant INTEGER;
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        row_id := OLD.id;
+                        row_tenant := OLD.tenant_id;
+                    ELSE
+                        row_id := NEW.id;
+                        row_tenant := NEW.tenant_id;
+                    END IF;
+                    PERFORM pg_notify('ledger_changes',
+                        json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', row_id,
+                                          'tenant', row_tenant)::text);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            for table in LEDGER_NOTIFY_TABLES:
+                cur.execute(f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table}")
+                cur.execute(f"""
+                    CREATE TRIGGER {table}_notify_change
+                    AFTER INSERT OR UPDATE OR DELETE ON {table}
+                    FOR EACH ROW EXECUTE FUNCTION notify_ledger_change()
+                """)
+    except Exception as e:
+        logger.error(f"Error creating change notification triggers: {e}")
+    finally:
+        conn.close()
 
+def create_search_indexes():
+    conn = get_db_conn()
     try:
-        with get_dict_cursor(conn) as cur:
-            cur.execute("SELECT v.id, v.vehicle_no, COALESCE(SUM(s.amount),0) AS total_spent FROM vehicles v LEFT JOIN spendings s ON v.id=s.vehicle_id GROUP BY v.id, v.vehicle_no")
-            vehicles = cur.fetchall()
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            # Expressions must match the ones used in search.ENTITY_QUERIES
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_spendings_reason_fts
+                    ON spendings USING gin (to_tsvector('simple', COALESCE(reason, '')));
+                CREATE INDEX IF NOT EXISTS idx_spendings_reason_trgm
+                    ON spendings USING gin (reason gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_hired_transactions_description_fts
+                    ON hired_vehicle_transactions USING gin (to_tsvector('simple', COALESCE(description, '')));
+                CREATE INDEX IF NOT EXISTS idx_hired_transactions_description_trgm
+                    ON hired_vehicle_transactions USING gin (description gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_hired_transactions_reference_trgm
+                    ON hired_vehicle_transactions USING gin (reference_no gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_company_sales_description_fts
+                    ON company_sales USING gin (to_tsvector('simple', COALESCE(description, '')));
+                CREATE INDEX IF NOT EXISTS idx_company_sales_description_trgm
+                    ON company_sales USING gin (description gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_company_sales_invoice_trgm
+                    ON company_sales USING gin (invoice_number gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_company_payments_reference_trgm
+                    ON company_payments USING gin (reference_number gin_trgm_ops);
+            """)
+    except Exception as e:
+        logger.error(f"Error creating search indexes: {e}")
+    finally:
+        conn.close()
 
-            cur.execute("SELECT COUNT(*) AS c FROM vehicles")
-            total_vehicles = cur.fetchone()['c']
+def create_spendings_indexes():
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            # Every query is scoped to one tenant, so tenant_id leads (vehicle ids
+            # already belong to a single tenant). Next come the filters in
+            # spending_filters, then date so the default newest-first sort can
+            # read the index in order.
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_spendings_tenant_date ON spendings (tenant_id, date DESC, id DESC);
+                CREATE INDEX IF NOT EXISTS idx_spendings_vehicle_date ON spendings (vehicle_id, date DESC);
+                CREATE INDEX IF NOT EXISTS idx_spendings_tenant_category_date
+                    ON spendings (tenant_id, category, date DESC);
+                CREATE INDEX IF NOT EXISTS idx_spendings_tenant_spended_by_date
+                    ON spendings (tenant_id, spended_by, date DESC);
+                CREATE INDEX IF NOT EXISTS idx_spendings_tenant_month_vehicle
+                    ON spendings (tenant_id, expense_month, vehicle_id);
+                CREATE INDEX IF NOT EXISTS idx_spendings_tenant_unpaid_date ON spendings (tenant_id, date DESC)
+                    WHERE spended_by IS NULL OR mode IS NULL;
+                CREATE INDEX IF NOT EXISTS idx_employee_advances_tenant_employee_date
+                    ON employee_advances (tenant_id, employee_name, date);
+            """)
+    except Exception as e:
+        logger.error(f"Error creating spendings indexes: {e}")
+    finally:
+        conn.close()
 
-            cur.execute("SELECT COALESCE(SUM(amount),0) AS total_credited FROM payments")
-            total_credited = cur.fetchone()['total_credited'] or 0
+def create_spendings_ingest_columns():
+    """Source and external reference for spendings posted by external feeds;
+    the unique index makes re-sent items no-ops (per tenant, as each tenant's
+    feeds are configured separately). Form entries leave both NULL, which
+    never conflict."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                ALTER TABLE spendings ADD COLUMN IF NOT EXISTS source VARCHAR(50);
+                ALTER TABLE spendings ADD COLUMN IF NOT EXISTS external_ref VARCHAR(100);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_spendings_tenant_source_external_ref
+                    ON spendings (tenant_id, source, external_ref);
+            """)
+    except Exception as e:
+        logger.error(f"Error creating spendings ingest columns: {e}")
+    finally:
+        conn.close()
 
-            # FIXED: Removed incorrect table alias 's'
-            cur.execute("SELECT COALESCE(SUM(amount),0) AS total_debited FROM spendings WHERE spended_by IS NOT NULL OR mode IS NOT NULL")
-            total_debited = cur.fetchone()['total_debited'] or 0
+def create_vehicle_monthly_rollup():
+    """Per-vehicle, per-month revenue and cost buckets kept current by triggers,
+    so the P&L report never has to scan spendings or payments."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            # incoming() records company/vehicle on payments; older schemas lack the columns
+            cur.execute("""
+                ALTER TABLE payments ADD COLUMN IF NOT EXISTS company_id INTEGER REFERENCES companies(id);
+                ALTER TABLE payments ADD COLUMN IF NOT EXISTS vehicle_id INTEGER REFERENCES vehicles(id);
+                CREATE INDEX IF NOT EXISTS idx_payments_vehicle_date ON payments (vehicle_id, date);
 
-            balance = Decimal(total_credited) - Decimal(total_debited)
+                CREATE TABLE IF NOT EXISTS vehicle_monthly_rollup (
+                    vehicle_id INTEGER NOT NULL,
+                    month DATE NOT NULL,
+                    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                    diesel NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                    salary NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                    other NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, vehicle_id, month)
+                );
 
-            current_month = datetime.now().strftime('%Y-%m-01')
-            cur.execute("SELECT COALESCE(SUM(amount),0) as current_month_total FROM spendings WHERE expense_month = %s", (current_month,))
-            current_month_total = cur.fetchone()['current_month_total'] or 0
+                CREATE OR REPLACE FUNCTION rollup_add(p_vehicle INTEGER, p_month DATE, p_revenue NUMERIC,
+                                                      p_cost NUMERIC, p_category TEXT) RETURNS void AS $$
+                BEGIN
+                    IF p_vehicle IS NULL OR p_month IS NULL THEN
+                        RETURN;
+                    END IF;
+                    INSERT INTO vehicle_monthly_rollup AS r (vehicle_id, month, revenue, diesel, salary, other)
+                    VALUES (p_vehicle, date_trunc('month', p_month)::date, p_revenue,
+                            CASE WHEN p_category = 'diesel' THEN p_cost ELSE 0 END,
+                            CASE WHEN p_category = 'salary' THEN p_cost ELSE 0 END,
+                            CASE WHEN p_category IN ('diesel', 'salary') THEN 0 ELSE p_cost END)
+                    ON CONFLICT (tenant_id, vehicle_id, month) DO UPDATE SET
+                        revenue = r.revenue + EXCLUDED.revenue,
+                        diesel = r.diesel + EXCLUDED.diesel,
+                        salary = r.salary + EXCLUDED.salary,
+                        other = r.other + EXCLUDED.other;
+                END;
+                $$ LANGUAGE plpgsql;
 
-            prev_month = (datetime.now().replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-01')
-            cur.execute("SELECT COALESCE(SUM(amount),0) as prev_month_total FROM spendings WHERE expense_month = %s", (prev_month,))
-            prev_month_total = cur.fetchone()['prev_month_total'] or 0
+                CREATE OR REPLACE FUNCTION rollup_spending_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        PERFORM rollup_add(OLD.vehicle_id, COALESCE(OLD.expense_month, OLD.date), 0,
+                                           -OLD.amount, OLD.category);
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        PERFORM rollup_add(NEW.vehicle_id, COALESCE(NEW.expense_month, NEW.date), 0,
+                                           NEW.amount, NEW.category);
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
 
+                CREATE OR REPLACE FUNCTION rollup_payment_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        PERFORM rollup_add(OLD.vehicle_id, OLD.date, -OLD.amount, 0, NULL);
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        PERFORM rollup_add(NEW.vehicle_id, NEW.date, NEW.amount, 0, NULL);
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            # Triggers and the one-off backfill go in one locked transaction so
+            # no write is either missed or counted twice.
             cur.execute("""
-                SELECT
-                    v.vehicle_no,
-                    SUM(s.amount) as monthly_total
-                FROM spendings s
-                JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.expense_month = %s
-                GROUP BY v.vehicle_no
-                ORDER BY monthly_total DESC
-            """, (current_month,))
-            monthly_vehicle_expenses = cur.fetchall()
+                BEGIN;
+                LOCK TABLE spendings, payments IN SHARE ROW EXCLUSIVE MODE;
+                DROP TRIGGER IF EXISTS spendings_rollup ON spendings;
+                CREATE TRIGGER spendings_rollup
+                    AFTER INSERT OR UPDATE OF vehicle_id, date, expense_month, category, amount OR DELETE ON spendings
+                    FOR EACH ROW EXECUTE FUNCTION rollup_spending_change();
+                DROP TRIGGER IF EXISTS payments_rollup ON payments;
+                CREATE TRIGGER payments_rollup
+                    AFTER INSERT OR UPDATE OF vehicle_id, date, amount OR DELETE ON payments
+                    FOR EACH ROW EXECUTE FUNCTION rollup_payment_change();
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM vehicle_monthly_rollup) THEN
+                        INSERT INTO vehicle_monthly_rollup (vehicle_id, month, revenue, diesel, salary, other)
+                        SELECT vehicle_id, month, SUM(revenue), SUM(diesel), SUM(salary), SUM(other)
+                        FROM (
+                            SELECT vehicle_id, date_trunc('month', COALESCE(expense_month, date))::date AS month,
+                                   0 AS revenue,
+                                   CASE WHEN category = 'diesel' THEN amount ELSE 0 END AS diesel,
+                                   CASE WHEN category = 'salary' THEN amount ELSE 0 END AS salary,
+                                   CASE WHEN category IN ('diesel', 'salary') THEN 0 ELSE amount END AS other
+                            FROM spendings WHERE vehicle_id IS NOT NULL
+                            UNION ALL
+                            SELECT vehicle_id, date_trunc('month', date)::date, amount, 0, 0, 0
+                            FROM payments WHERE vehicle_id IS NOT NULL
+                        ) t
+                        GROUP BY vehicle_id, month;
+                    END IF;
+                END;
+                $$;
+                COMMIT;
+            """)
+    except Exception as e:
+        logger.error(f"Error creating vehicle monthly rollup: {e}")
+    finally:
+        conn.close()
 
+def create_receivables_tables():
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            # Open items per company, rebuilt by reports.refresh_receivables()
+            # only for companies the triggers below mark dirty.
             cur.execute("""
-                SELECT
-                    TO_CHAR(expense_month, 'YYYY-MM') as month,
-                    SUM(amount) as total_expense
-                FROM spendings
-                WHERE expense_month >= (CURRENT_DATE - INTERVAL '6 months')
-                GROUP BY expense_month
-                ORDER BY expense_month DESC
-            """)
-            monthly_trend = cur.fetchall()
+                CREATE TABLE IF NOT EXISTS receivable_open_items (
+                    sale_id INTEGER NOT NULL,
+                    company_name VARCHAR(255) NOT NULL,
+                    sale_date DATE NOT NULL,
+                    invoice_number VARCHAR(100),
+                    sale_amount NUMERIC(12,2) NOT NULL,
+                    outstanding NUMERIC(12,2) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_receivable_open_items_tenant_company
+                    ON receivable_open_items (tenant_id, company_name, sale_date);
+                CREATE TABLE IF NOT EXISTS receivables_dirty (
+                    company_name VARCHAR(255) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, company_name)
+                );
+                ALTER TABLE receivables_dirty ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
+                CREATE INDEX IF NOT EXISTS idx_company_sales_tenant_company_date
+                    ON company_sales (tenant_id, company_name, sale_date, id);
+                CREATE INDEX IF NOT EXISTS idx_company_payments_tenant_company
+                    ON company_payments (tenant_id, company_name);
 
-            totals = {
-                'vehicles': total_vehicles,
-                'credited': float(total_credited or 0),
-                'debited': float(total_debited or 0),
-                'balance': float(balance),
-                'current_month': float(current_month_total),
-                'prev_month': float(prev_month_total)
-            }
+                -- Always updates (never DO NOTHING), so the marking transaction
+                -- holds the dirty row's lock until it commits and a concurrent
+                -- refresh skips the company instead of clearing it from a
+                -- snapshot without this change (see reports.refresh_receivables)
+                CREATE OR REPLACE FUNCTION mark_receivables_dirty() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        INSERT INTO receivables_dirty AS d (company_name) VALUES (OLD.company_name)
+                        ON CONFLICT (tenant_id, company_name) DO UPDATE SET version = d.version + 1;
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        INSERT INTO receivables_dirty AS d (company_name) VALUES (NEW.company_name)
+                        ON CONFLICT (tenant_id, company_name) DO UPDATE SET version = d.version + 1;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
 
+                DROP TRIGGER IF EXISTS company_sales_receivables ON company_sales;
+                CREATE TRIGGER company_sales_receivables
+                    AFTER INSERT OR UPDATE OR DELETE ON company_sales
+                    FOR EACH ROW EXECUTE FUNCTION mark_receivables_dirty();
+                DROP TRIGGER IF EXISTS company_payments_receivables ON company_payments;
+                CREATE TRIGGER company_payments_receivables
+                    AFTER INSERT OR UPDATE OR DELETE ON company_payments
+                    FOR EACH ROW EXECUTE FUNCTION mark_receivables_dirty();
+            """)
+        # Re-allocate everything once per start-up, in case rows changed
+        # while the triggers were missing; per tenant, since a connection
+        # only sees its own tenant's rows.
+        for tenant_id, _ in each_tenant():
+            tenant = get_db_conn(tenant_id=tenant_id)
+            try:
+                with tenant.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO receivables_dirty (company_name)
+                            SELECT company_name FROM company_sales
+                            UNION SELECT company_name FROM company_payments
+                            UNION SELECT company_name FROM receivable_open_items
+                        ON CONFLICT DO NOTHING
+                    """)
+            finally:
+                tenant.close()
     except Exception as e:
-        app.logger.error(f"Error in index route: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error creating receivables tables: {e}")
     finally:
         conn.close()
 
-    return render_template('index.html',
-                         vehicles=vehicles,
-                         monthly_vehicle_expenses=monthly_vehicle_expenses,
-                         monthly_trend=monthly_trend,
-                         totals=totals)
-
-# Login route
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if 'user_id' in session:
-        return redirect(url_for('index'))
-    
-    if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
-        conn = get_db_conn()
-        try:
-            with get_dict_cursor(conn) as cur:
-                cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-                user = cur.fetchone()
-                if user and bcrypt.check_password_hash(user['password_hash'], password):
-                    session['user_id'] = user['id']
-                    session['username'] = user['username']
-                    flash('Login successful!', 'success')
-                    return redirect(url_for('index'))
-                else:
-                    flash('Invalid username or password.', 'error')
-        except Exception as e:
-            logger.error(f"Login error: {str(e)}")
-            flash('An error occurred during login', 'error')
-        finally:
-            conn.close()
-    return render_template('login.html')
-
-# Logout route
-@app.route('/logout')
-def logout():
-    session.clear()
-    flash('You have been logged out.', 'success')
-    return redirect(url_for('login'))
+# Month column and periods counter for each table tracked in the periods table
+PERIOD_TABLES = {
+    'spendings': ('expense_month', 'spendings_count'),
+    'payments': ('date', 'payments_count'),
+    'employee_advances': ('date', 'advances_count'),
+    'hired_vehicle_transactions': ('month_year', 'hired_transactions_count'),
+    'company_sales': ('month_year', 'company_sales_count'),
+    'company_payments': ('month_year', 'company_payments_count'),
+}
 
-# Vehicles page & add vehicle
-@app.route('/vehicles', methods=['GET','POST'])
-@login_required
-def vehicles_page():
+def create_periods_tables():
+    """Months dimension (row counts per table, open/closed status) and the
+    per-vehicle/category monthly totals behind the month comparison report,
+    both kept current by triggers instead of DISTINCT scans."""
     conn = get_db_conn()
-    vehicles = []
     try:
-        if request.method == 'POST':
-            vehicle_no = request.form.get('vehicle_no').strip()
-            owner_name = request.form.get('owner_name', '').strip()
-            contact_number = request.form.get('contact_number', '').strip()
-
-            if not vehicle_no:
-                flash('Vehicle number cannot be empty.', 'error')
-            else:
-                with get_dict_cursor(conn) as cur:
-                    cur.execute("SELECT id FROM vehicles WHERE vehicle_no = %s", (vehicle_no,))
-                    if cur.fetchone():
-                        flash(f'Vehicle {vehicle_no} already exists.', 'error')
-                    else:
-                        cur.execute("INSERT INTO vehicles (vehicle_no, owner_name, contact_number) VALUES (%s, %s, %s)",
-                                   (vehicle_no, owner_name, contact_number))
-                        flash('Vehicle added successfully!', 'success')
-                        return redirect(url_for('vehicles_page'))
+        with conn.cursor() as cur:
+            counters = ',\n'.join(
+                f"                    {count_col} INTEGER NOT NULL DEFAULT 0"
+                for _, count_col in PERIOD_TABLES.values()
+            )
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS periods (
+                    month DATE NOT NULL,
+{counters},
+                    status VARCHAR(10) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'closed')),
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month)
+                );
+                CREATE TABLE IF NOT EXISTS spending_category_monthly (
+                    month DATE NOT NULL,
+                    vehicle_id INTEGER NOT NULL,
+                    category VARCHAR(100) NOT NULL,
+                    amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                    entries INTEGER NOT NULL DEFAULT 0,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, vehicle_id, category)
+                );
+            """)
+            cur.execute("""
+                -- TG_ARGV: month column, periods counter column
+                CREATE OR REPLACE FUNCTION period_count_change() RETURNS trigger AS $$
+                DECLARE
+                    old_month DATE;
+                    new_month DATE;
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        old_month := date_trunc('month', (to_jsonb(OLD) ->> TG_ARGV[0])::date)::date;
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        new_month := date_trunc('month', (to_jsonb(NEW) ->> TG_ARGV[0])::date)::date;
+                    END IF;
+                    IF old_month IS NOT DISTINCT FROM new_month THEN
+                        UPDATE periods SET updated_at = CURRENT_TIMESTAMP WHERE month = new_month;
+                        RETURN NULL;
+                    END IF;
+                    IF old_month IS NOT NULL THEN
+                        EXECUTE format('UPDATE periods SET %1$I = %1$I - 1, updated_at = CURRENT_TIMESTAMP
+                                        WHERE month = $1', TG_ARGV[1]) USING old_month;
+                    END IF;
+                    IF new_month IS NOT NULL THEN
+                        EXECUTE format('INSERT INTO periods (month, %1$I) VALUES ($1, 1)
+                                        ON CONFLICT (tenant_id, month) DO UPDATE
+                                        SET %1$I = periods.%1$I + 1, updated_at = CURRENT_TIMESTAMP',
+                                       TG_ARGV[1]) USING new_month;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
 
-        with get_dict_cursor(conn) as cur:
-            cur.execute("SELECT * FROM vehicles ORDER BY vehicle_no")
-            vehicles = cur.fetchall()
+                CREATE OR REPLACE FUNCTION spending_category_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.vehicle_id IS NOT NULL AND OLD.expense_month IS NOT NULL THEN
+                        UPDATE spending_category_monthly
+                        SET amount = amount - OLD.amount, entries = entries - 1
+                        WHERE month = date_trunc('month', OLD.expense_month)::date
+                          AND vehicle_id = OLD.vehicle_id AND category = OLD.category;
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.vehicle_id IS NOT NULL AND NEW.expense_month IS NOT NULL THEN
+                        INSERT INTO spending_category_monthly AS t (month, vehicle_id, category, amount, entries)
+                        VALUES (date_trunc('month', NEW.expense_month)::date, NEW.vehicle_id, NEW.category, NEW.amount, 1)
+                        ON CONFLICT (tenant_id, month, vehicle_id, category) DO UPDATE
+                        SET amount = t.amount + EXCLUDED.amount, entries = t.entries + 1;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            # Triggers and the one-off backfill share one locked transaction,
+            # as in create_vehicle_monthly_rollup()
+            statements = ["BEGIN",
+                          f"LOCK TABLE {', '.join(PERIOD_TABLES)} IN SHARE ROW EXCLUSIVE MODE"]
+            for table, (month_col, count_col) in PERIOD_TABLES.items():
+                statements += [
+                    f"DROP TRIGGER IF EXISTS {table}_period_count ON {table}",
+                    f"""CREATE TRIGGER {table}_period_count
+                        AFTER INSERT OR UPDATE OR DELETE ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION period_count_change('{month_col}', '{count_col}')""",
+                ]
+            statements += [
+                "DROP TRIGGER IF EXISTS spendings_category_monthly ON spendings",
+                """CREATE TRIGGER spendings_category_monthly
+                   AFTER INSERT OR UPDATE OF vehicle_id, expense_month, category, amount OR DELETE ON spendings
+                   FOR EACH ROW EXECUTE FUNCTION spending_category_change()""",
+            ]
+            backfill = ';\n'.join(
+                f"""INSERT INTO periods (month, {count_col})
+                        SELECT date_trunc('month', {month_col})::date, COUNT(*) FROM {table}
+                        WHERE {month_col} IS NOT NULL GROUP BY 1
+                        ON CONFLICT (tenant_id, month) DO UPDATE SET {count_col} = EXCLUDED.{count_col}"""
+                for table, (month_col, count_col) in PERIOD_TABLES.items()
+            )
+            statements += [f"""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM periods) THEN
+                        {backfill};
+                        INSERT INTO spending_category_monthly (month, vehicle_id, category, amount, entries)
+                        SELECT date_trunc('month', expense_month)::date, vehicle_id, category, SUM(amount), COUNT(*)
+                        FROM spendings
+                        WHERE vehicle_id IS NOT NULL AND expense_month IS NOT NULL
+                        GROUP BY 1, 2, 3;
+                    END IF;
+                END;
+                $$""", "COMMIT"]
+            cur.execute(';\n'.join(statements))
     except Exception as e:
-        app.logger.error(f"Error in vehicles_page route: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error creating periods tables: {e}")
     finally:
         conn.close()
-    return render_template('vehicles.html', vehicles=vehicles)
 
-# Delete Vehicle
-@app.route('/delete_vehicle/<int:id>', methods=['POST'])
-@login_required
-def delete_vehicle(id):
+def create_month_close_tables():
+    """Snapshot totals written when a month is closed (see month_close.py) and
+    the triggers that keep closed months, and their snapshots, unchanged."""
     conn = get_db_conn()
     try:
-        with get_dict_cursor(conn) as cur:
-            cur.execute("SELECT COUNT(*) as count FROM spendings WHERE vehicle_id = %s", (id,))
-            if cur.fetchone()['count'] > 0:
-                flash('Cannot delete vehicle. Delete all associated spendings first.', 'error')
-            else:
-                cur.execute("DELETE FROM vehicles WHERE id = %s", (id,))
-                flash('Vehicle deleted successfully!', 'success')
+        with conn.cursor() as cur:
+            cur.execute("""
+                ALTER TABLE periods ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP WITH TIME ZONE;
+                ALTER TABLE periods ADD COLUMN IF NOT EXISTS closed_by VARCHAR(100);
+
+                CREATE TABLE IF NOT EXISTS period_vehicle_totals (
+                    month DATE NOT NULL,
+                    vehicle_id INTEGER NOT NULL,
+                    vehicle_no VARCHAR(50) NOT NULL,
+                    paid_amount NUMERIC(14, 2) NOT NULL,
+                    unpaid_amount NUMERIC(14, 2) NOT NULL,
+                    entries INTEGER NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, vehicle_id)
+                );
+                CREATE TABLE IF NOT EXISTS period_category_totals (
+                    month DATE NOT NULL,
+                    category VARCHAR(100) NOT NULL,
+                    amount NUMERIC(14, 2) NOT NULL,
+                    entries INTEGER NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, category)
+                );
+                CREATE TABLE IF NOT EXISTS period_employee_totals (
+                    month DATE NOT NULL,
+                    employee_name VARCHAR(100) NOT NULL,
+                    advances NUMERIC(14, 2) NOT NULL,
+                    expenses NUMERIC(14, 2) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, employee_name)
+                );
+                CREATE TABLE IF NOT EXISTS period_company_totals (
+                    month DATE NOT NULL,
+                    company_name VARCHAR(255) NOT NULL,
+                    sales_amount NUMERIC(14, 2) NOT NULL,
+                    received_amount NUMERIC(14, 2) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, company_name)
+                );
+                CREATE TABLE IF NOT EXISTS period_hired_vehicle_totals (
+                    month DATE NOT NULL,
+                    hired_vehicle_id INTEGER NOT NULL,
+                    vehicle_no VARCHAR(50) NOT NULL,
+                    owner_name VARCHAR(255),
+                    total_sales NUMERIC(14, 2) NOT NULL,
+                    total_payments NUMERIC(14, 2) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, month, hired_vehicle_id)
+                );
+
+                -- TG_ARGV: month column. Rejects any change touching a closed month.
+                CREATE OR REPLACE FUNCTION reject_closed_period_change() RETURNS trigger AS $$
+                DECLARE
+                    changed_month DATE;
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        changed_month := date_trunc('month', (to_jsonb(OLD) ->> TG_ARGV[0])::date)::date;
+                        IF EXISTS (SELECT 1 FROM periods WHERE month = changed_month AND status = 'closed') THEN
+                            RAISE EXCEPTION 'Month % is closed; reopen it before changing its entries',
+                                to_char(changed_month, 'YYYY-MM') USING ERRCODE = 'object_not_in_prerequisite_state';
+                        END IF;
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        changed_month := date_trunc('month', (to_jsonb(NEW) ->> TG_ARGV[0])::date)::date;
+                        IF EXISTS (SELECT 1 FROM periods WHERE month = changed_month AND status = 'closed') THEN
+                            RAISE EXCEPTION 'Month % is closed; reopen it before changing its entries',
+                                to_char(changed_month, 'YYYY-MM') USING ERRCODE = 'object_not_in_prerequisite_state';
+                        END IF;
+                    END IF;
+                    IF TG_OP = 'DELETE' THEN
+                        RETURN OLD;
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            guarded = dict((table, month_col) for table, (month_col, _) in PERIOD_TABLES.items())
+            guarded.update((table, 'month') for table in month_close.SNAPSHOTS)
+            statements = []
+            for table, month_col in guarded.items():
+                statements += [
+                    f"DROP TRIGGER IF EXISTS {table}_closed_period ON {table}",
+                    f"""CREATE TRIGGER {table}_closed_period
+                        BEFORE INSERT OR UPDATE OR DELETE ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION reject_closed_period_change('{month_col}')""",
+                ]
+            cur.execute(';\n'.join(["BEGIN"] + statements + ["COMMIT"]))
     except Exception as e:
-        app.logger.error(f"Error deleting vehicle: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error creating month close tables: {e}")
     finally:
         conn.close()
-    return redirect(url_for('vehicles_page'))
 
-# Spendings list & add spending
-@app.route('/spendings', methods=['GET','POST'])
-@login_required
-def spendings():
-    conn = get_db_conn()
-    vehicles = []
-    paid_rows = []
-    unpaid_rows = []
-    settled_rows = []
-    monthly_totals = []
-    total_spent = 0
-    total_unpaid = 0
+# Ledger tables that post to the journal (see journal.py)
+JOURNAL_TABLES = ('spendings', 'payments', 'employee_advances', 'company_sales',
+                  'company_payments', 'hired_vehicle_transactions')
 
+def create_journal_tables():
+    """Double-entry journal posted by triggers on every ledger table, with
+    per-account running totals updated in the same transaction."""
+    conn = get_db_conn()
     try:
-        with get_dict_cursor(conn) as cur:
-            cur.execute("SELECT id, vehicle_no FROM vehicles ORDER BY vehicle_no")
-            vehicles = cur.fetchall()
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS journal_entries (
+                    id BIGSERIAL PRIMARY KEY,
+                    source_table VARCHAR(50) NOT NULL,
+                    source_id INTEGER NOT NULL,
+                    entry_date DATE NOT NULL,
+                    posted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    UNIQUE (source_table, source_id)
+                );
+                -- amount: debit positive, credit negative
+                CREATE TABLE IF NOT EXISTS journal_postings (
+                    entry_id BIGINT NOT NULL REFERENCES journal_entries(id) ON DELETE CASCADE,
+                    account VARCHAR(300) NOT NULL,
+                    entry_date DATE NOT NULL,
+                    amount NUMERIC(14, 2) NOT NULL,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_journal_postings_entry ON journal_postings (entry_id);
+                CREATE INDEX IF NOT EXISTS idx_journal_postings_tenant_account_date
+                    ON journal_postings (tenant_id, account, entry_date);
 
-            if request.method == 'POST':
-                vehicle_id = request.form.get('vehicle_id')
-                date_str = request.form.get('date')
-                expense_month_str = request.form.get('expense_month')
-                category = request.form.get('category').strip()
-                reason = request.form.get('reason', '').strip()
-                amount = request.form.get('amount')
-                spended_by = request.form.get('spended_by', '').strip()
-                mode = request.form.get('mode', '').strip()
+                CREATE TABLE IF NOT EXISTS account_balances (
+                    account VARCHAR(300) NOT NULL,
+                    debits NUMERIC(16, 2) NOT NULL DEFAULT 0,
+                    credits NUMERIC(16, 2) NOT NULL DEFAULT 0,
+                    balance NUMERIC(16, 2) GENERATED ALWAYS AS (debits - credits) STORED,
+                    postings INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, account)
+                );
 
-                if not all([vehicle_id, date_str, expense_month_str, category, amount]):
-                    flash('Missing required fields.', 'error')
-                    return redirect(url_for('spendings'))
+                -- Postings for one source row (as jsonb): entry date, accounts, signed amounts
+                CREATE OR REPLACE FUNCTION journal_lines(p_table TEXT, r JSONB,
+                                                         OUT entry_date DATE, OUT accounts TEXT[], OUT amounts NUMERIC[]) AS $$
+                DECLARE
+                    amt NUMERIC;
+                BEGIN
+                    IF p_table = 'spendings' THEN
+                        amt := (r ->> 'amount')::numeric;
+                        entry_date := (r ->> 'date')::date;
+                        accounts := ARRAY['expense:' || COALESCE(r ->> 'category', 'uncategorised'),
+                                          CASE WHEN r ->> 'spended_by' IS NOT NULL AND r ->> 'mode' IS NOT NULL
+                                               THEN 'cash' ELSE 'payable:unpaid' END];
+                        amounts := ARRAY[amt, -amt];
+                        IF r ->> 'spended_by' IS NOT NULL THEN
+                            accounts := accounts || ARRAY['clearing:employee', 'employee:' || (r ->> 'spended_by')];
+                            amounts := amounts || ARRAY[amt, -amt];
+                        END IF;
+                    ELSIF p_table = 'payments' THEN
+                        amt := (r ->> 'amount')::numeric;
+                        entry_date := (r ->> 'date')::date;
+                        accounts := ARRAY['cash', 'income:payments'];
+                        amounts := ARRAY[amt, -amt];
+                    ELSIF p_table = 'employee_advances' THEN
+                        amt := (r ->> 'amount')::numeric;
+                        entry_date := (r ->> 'date')::date;
+                        accounts := ARRAY['employee:' || (r ->> 'employee_name'), 'clearing:employee'];
+                        amounts := ARRAY[amt, -amt];
+                    ELSIF p_table = 'company_sales' THEN
+                        amt := (r ->> 'sale_amount')::numeric;
+                        entry_date := (r ->> 'sale_date')::date;
+                        accounts := ARRAY['receivable:' || (r ->> 'company_name'), 'income:company_sales'];
+                        amounts := ARRAY[amt, -amt];
+                    ELSIF p_table = 'company_payments' THEN
+                        amt := (r ->> 'received_amount')::numeric;
+                        entry_date := (r ->> 'payment_date')::date;
+                        accounts := ARRAY['cash:company_receipts', 'receivable:' || (r ->> 'company_name')];
+                        amounts := ARRAY[amt, -amt];
+                    ELSIF p_table = 'hired_vehicle_transactions' THEN
+                        amt := (r ->> 'amount')::numeric;
+                        entry_date := (r ->> 'transaction_date')::date;
+                        IF r ->> 'transaction_type' = 'sale' THEN
+                            accounts := ARRAY['hired:' || COALESCE(r ->> 'hired_vehicle_id', 'unknown'), 'income:hired_vehicles'];
+                        ELSIF r ->> 'transaction_type' = 'payment' THEN
+                            accounts := ARRAY['cash:hired_receipts', 'hired:' || COALESCE(r ->> 'hired_vehicle_id', 'unknown')];
+                        END IF;
+                        amounts := ARRAY[amt, -amt];
+                    END IF;
+                END;
+                $$ LANGUAGE plpgsql IMMUTABLE;
 
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                expense_month = datetime.strptime(expense_month_str, '%Y-%m').date().replace(day=1)
-                amount_decimal = Decimal(amount)
+                -- Replace whatever a source row posted before with the given postings
+                -- (none when p_accounts is NULL), keeping account_balances in step
+                CREATE OR REPLACE FUNCTION journal_post(p_source TEXT, p_source_id INTEGER, p_date DATE,
+                                                        p_accounts TEXT[], p_amounts NUMERIC[]) RETURNS void AS $$
+                DECLARE
+                    v_entry BIGINT;
+                BEGIN
+                    UPDATE account_balances b
+                    SET debits = b.debits - p.debits, credits = b.credits - p.credits,
+                        postings = b.postings - p.n, updated_at = CURRENT_TIMESTAMP
+                    FROM (
+                        SELECT jp.account, SUM(GREATEST(jp.amount, 0)) AS debits,
+                               SUM(GREATEST(-jp.amount, 0)) AS credits, COUNT(*) AS n
+                        FROM journal_entries e
+                        JOIN journal_postings jp ON jp.entry_id = e.id
+                        WHERE e.source_table = p_source AND e.source_id = p_source_id
+                        GROUP BY jp.account
+                    ) p
+                    WHERE b.account = p.account;
+                    DELETE FROM journal_entries WHERE source_table = p_source AND source_id = p_source_id;
 
-                spended_by = spended_by if spended_by else None
-                mode = mode if mode else None
+                    IF p_accounts IS NULL THEN
+                        RETURN;
+                    END IF;
+                    IF (SELECT SUM(m) FROM unnest(p_amounts) AS m) <> 0 THEN
+                        RAISE EXCEPTION 'Unbalanced journal entry for %.%', p_source, p_source_id;
+                    END IF;
 
-                cur.execute("""
-                    INSERT INTO spendings (vehicle_id, date, expense_month, category, reason, amount, spended_by, mode)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (vehicle_id, date_obj, expense_month, category, reason, amount_decimal, spended_by, mode))
-                flash('Spending recorded successfully!', 'success')
-                return redirect(url_for('spendings'))
+                    INSERT INTO journal_entries (source_table, source_id, entry_date)
+                    VALUES (p_source, p_source_id, p_date)
+                    RETURNING id INTO v_entry;
+                    INSERT INTO journal_postings (entry_id, account, entry_date, amount)
+                    SELECT v_entry, a, p_date, m FROM unnest(p_accounts, p_amounts) AS t(a, m) WHERE m <> 0;
+                    INSERT INTO account_balances AS b (account, debits, credits, postings)
+                    SELECT a, SUM(GREATEST(m, 0)), SUM(GREATEST(-m, 0)), COUNT(*)
+                    FROM unnest(p_accounts, p_amounts) AS t(a, m)
+                    WHERE m <> 0
+                    GROUP BY a
+                    ON CONFLICT (tenant_id, account) DO UPDATE
+                    SET debits = b.debits + EXCLUDED.debits, credits = b.credits + EXCLUDED.credits,
+                        postings = b.postings + EXCLUDED.postings, updated_at = CURRENT_TIMESTAMP;
+                END;
+                $$ LANGUAGE plpgsql;
 
-            # Fetch unpaid payments
-            cur.execute("""
-                SELECT s.*, v.vehicle_no FROM spendings s
-                JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.spended_by IS NULL OR s.mode IS NULL
-                ORDER BY s.date DESC
+                CREATE OR REPLACE FUNCTION journal_change() RETURNS trigger AS $$
+                DECLARE
+                    l RECORD;
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        PERFORM journal_post(TG_TABLE_NAME, OLD.id, NULL, NULL, NULL);
+                        RETURN NULL;
+                    END IF;
+                    SELECT * INTO l FROM journal_lines(TG_TABLE_NAME, to_jsonb(NEW));
+                    PERFORM journal_post(TG_TABLE_NAME, NEW.id, l.entry_date, l.accounts, l.amounts);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
             """)
-            unpaid_rows = cur.fetchall()
+            # Triggers and the one-off backfill share one locked transaction,
+            # as in create_vehicle_monthly_rollup()
+            statements = ["BEGIN", f"LOCK TABLE {', '.join(JOURNAL_TABLES)} IN SHARE ROW EXCLUSIVE MODE"]
+            for table in JOURNAL_TABLES:
+                statements += [
+                    f"DROP TRIGGER IF EXISTS {table}_journal ON {table}",
+                    f"""CREATE TRIGGER {table}_journal
+                        AFTER INSERT OR UPDATE OR DELETE ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION journal_change()""",
+                ]
+            backfill = ';\n'.join(
+                f"""PERFORM journal_post('{table}', x.id, l.entry_date, l.accounts, l.amounts)
+                        FROM {table} x, LATERAL journal_lines('{table}', to_jsonb(x)) l"""
+                for table in JOURNAL_TABLES
+            )
+            statements += [f"""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM journal_entries) THEN
+                        {backfill};
+                    END IF;
+                END;
+                $$""", "COMMIT"]
+            cur.execute(';\n'.join(statements))
+    except Exception as e:
+        logger.error(f"Error creating journal tables: {e}")
+    finally:
+        conn.close()
 
-            # Fetch paid payments for the last 30 days
+def create_journal_checkpoints():
+    """Monthly per-account balance checkpoints for as-of queries (see journal.py)."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT s.*, v.vehicle_no FROM spendings s
-                JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
-                AND s.date >= (CURRENT_DATE - INTERVAL '30 days')
-                ORDER BY s.date DESC
-            """)
-            paid_rows = cur.fetchall()
+                -- Totals over postings dated before `month` (first day of a month)
+                CREATE TABLE IF NOT EXISTS account_balance_checkpoints (
+                    month DATE NOT NULL,
+                    account VARCHAR(300) NOT NULL,
+                    debits NUMERIC(16, 2) NOT NULL DEFAULT 0,
+                    credits NUMERIC(16, 2) NOT NULL DEFAULT 0,
+                    postings INTEGER NOT NULL DEFAULT 0,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, account, month)
+                );
+                CREATE INDEX IF NOT EXISTS idx_account_balance_checkpoints_tenant_month
+                    ON account_balance_checkpoints (tenant_id, month);
 
-            # Fetch settled payments (historical - older than 30 days)
-            cur.execute("""
-                SELECT s.*, v.vehicle_no
-                FROM spendings s
-                JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
-                AND s.date < (CURRENT_DATE - INTERVAL '30 days')
-                ORDER BY s.date DESC
+                -- Postings dated before existing checkpoints (back-dated entries,
+                -- edits and deletes) move those checkpoints along with them
+                CREATE OR REPLACE FUNCTION journal_checkpoint_adjust() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        UPDATE account_balance_checkpoints
+                        SET debits = debits + GREATEST(NEW.amount, 0),
+                            credits = credits + GREATEST(-NEW.amount, 0),
+                            postings = postings + 1
+                        WHERE account = NEW.account AND month > NEW.entry_date;
+                    ELSE
+                        UPDATE account_balance_checkpoints
+                        SET debits = debits - GREATEST(OLD.amount, 0),
+                            credits = credits - GREATEST(-OLD.amount, 0),
+                            postings = postings - 1
+                        WHERE account = OLD.account AND month > OLD.entry_date;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS journal_postings_checkpoint ON journal_postings;
+                CREATE TRIGGER journal_postings_checkpoint
+                    AFTER INSERT OR DELETE ON journal_postings
+                    FOR EACH ROW EXECUTE FUNCTION journal_checkpoint_adjust();
             """)
-            settled_rows = cur.fetchall()
+        # Checkpoints are per tenant, like the postings they sum
+        for tenant_id, code in each_tenant():
+            tenant = get_db_conn(tenant_id=tenant_id)
+            try:
+                tenant.autocommit = False
+                with tenant.cursor() as cur:
+                    created = journal.create_checkpoints(cur)
+                tenant.commit()
+                if created:
+                    logger.info(f"Created {len(created)} monthly balance checkpoints for {code}")
+            except Exception:
+                tenant.rollback()
+                raise
+            finally:
+                tenant.close()
+    except Exception as e:
+        logger.error(f"Error creating journal checkpoints: {e}")
+    finally:
+        conn.close()
 
-            # FIXED: Removed incorrect table alias 's'
-            cur.execute("SELECT COALESCE(SUM(amount),0) as total_spent FROM spendings WHERE spended_by IS NOT NULL AND mode IS NOT NULL")
-            total_spent = cur.fetchone()['total_spent'] or 0
-            
-            cur.execute("SELECT COALESCE(SUM(amount),0) as total_unpaid FROM spendings WHERE spended_by IS NULL OR mode IS NULL")
-            total_unpaid = cur.fetchone()['total_unpaid'] or 0
+# Tables whose row changes are captured for incremental sync (see changes.py)
+CHANGE_TABLES = JOURNAL_TABLES + ('vehicles', 'companies', 'hired_vehicles')
 
-            # Monthly totals by expense month
+def create_change_log():
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT expense_month, COALESCE(SUM(amount),0) as monthly_total
-                FROM spendings
-                WHERE spended_by IS NOT NULL AND mode IS NOT NULL
-                GROUP BY expense_month
-                ORDER BY expense_month DESC
+                -- seq is assigned when the change is published (changes.publish),
+                -- counting per tenant
+                CREATE TABLE IF NOT EXISTS change_log (
+                    id BIGSERIAL PRIMARY KEY,
+                    seq BIGINT,
+                    table_name VARCHAR(50) NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    op CHAR(1) NOT NULL CHECK (op IN ('I', 'U', 'D')),
+                    changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    data JSONB,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    UNIQUE (tenant_id, seq)
+                );
+                CREATE INDEX IF NOT EXISTS idx_change_log_tenant_unpublished
+                    ON change_log (tenant_id, id) WHERE seq IS NULL;
+
+                CREATE OR REPLACE FUNCTION capture_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        INSERT INTO change_log (table_name, row_id, op) VALUES (TG_TABLE_NAME, OLD.id, 'D');
+                    ELSE
+                        INSERT INTO change_log (table_name, row_id, op, data)
+                        VALUES (TG_TABLE_NAME, NEW.id, LEFT(TG_OP, 1), to_jsonb(NEW));
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
             """)
-            monthly_totals = cur.fetchall()
+            for table in CHANGE_TABLES:
+                cur.execute(f"""
+                    DROP TRIGGER IF EXISTS {table}_capture ON {table};
+                    CREATE TRIGGER {table}_capture
+                        AFTER INSERT OR DELETE ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION capture_change();
+                    -- Updates that change nothing are not worth a sync
+                    DROP TRIGGER IF EXISTS {table}_capture_update ON {table};
+                    CREATE TRIGGER {table}_capture_update
+                        AFTER UPDATE ON {table}
+                        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+                        EXECUTE FUNCTION capture_change();
+                """)
+    except Exception as e:
+        logger.error(f"Error creating change log: {e}")
+    finally:
+        conn.close()
 
+def create_spend_forecasts_table():
+    """Nightly per-vehicle, per-category forecasts (see forecast.py)."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS spend_forecasts (
+                    run_month DATE NOT NULL,
+                    vehicle_id INTEGER NOT NULL REFERENCES vehicles(id) ON DELETE CASCADE,
+                    category VARCHAR(100) NOT NULL,
+                    next_month NUMERIC(12, 2) NOT NULL,
+                    next_quarter NUMERIC(12, 2) NOT NULL,
+                    method VARCHAR(20) NOT NULL,
+                    history_months INTEGER NOT NULL,
+                    generated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, run_month, vehicle_id, category)
+                );
+            """)
     except Exception as e:
-        app.logger.error(f"Error in spendings route: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error creating spend_forecasts table: {e}")
     finally:
         conn.close()
 
-    today = datetime.now().strftime('%Y-%m-%d')
-    current_month = datetime.now().strftime('%Y-%m')
-    
-    return render_template('spendings.html',
-                           vehicles=vehicles,
-                           paid_rows=paid_rows,
-                           unpaid_rows=unpaid_rows,
-                           settled_rows=settled_rows,
-                           monthly_totals=monthly_totals,
-                           total_spent=float(total_spent),
-                           total_unpaid=float(total_unpaid),
-                           today=today,
-                           current_month=current_month)
+def anomaly_settings():
+    return (config.ANOMALY_Z_THRESHOLD, config.ANOMALY_MIN_SAMPLES,
+            config.ANOMALY_MIN_STDDEV, config.ANOMALY_DUPLICATE_DAYS)
 
-# Delete Spending
-@app.route('/delete_spending/<int:id>', methods=['POST'])
-@login_required
-def delete_spending(id):
+def create_anomaly_tables():
+    """Per vehicle/category amount statistics and the spending flags scored
+    against them on every write (see anomalies.py)."""
+    z_threshold, min_samples, min_stddev, duplicate_days = anomaly_settings()
     conn = get_db_conn()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM spendings WHERE id = %s", (id,))
-            flash('Spending deleted successfully!', 'success')
+            cur.execute(f"""
+                -- Welford accumulators over ln(1 + |amount|)
+                CREATE TABLE IF NOT EXISTS spend_stats (
+                    vehicle_id INTEGER NOT NULL,
+                    category VARCHAR(100) NOT NULL,
+                    n BIGINT NOT NULL DEFAULT 0,
+                    mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id),
+                    PRIMARY KEY (tenant_id, vehicle_id, category)
+                );
+                CREATE TABLE IF NOT EXISTS spending_anomalies (
+                    spending_id INTEGER PRIMARY KEY REFERENCES spendings(id) ON DELETE CASCADE,
+                    reason VARCHAR(20) NOT NULL,
+                    score DOUBLE PRECISION,
+                    expected_amount NUMERIC(12, 2),
+                    flagged_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    reviewed_at TIMESTAMP WITH TIME ZONE,
+                    reviewed_by VARCHAR(100),
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_spending_anomalies_tenant_open
+                    ON spending_anomalies (tenant_id, spending_id) WHERE reviewed_at IS NULL;
+
+                CREATE OR REPLACE FUNCTION spend_stats_apply(p_vehicle INTEGER, p_category TEXT,
+                                                             p_x DOUBLE PRECISION, p_sign INTEGER) RETURNS void AS $$
+                BEGIN
+                    IF p_sign > 0 THEN
+                        INSERT INTO spend_stats AS s (vehicle_id, category, n, mean, m2)
+                        VALUES (p_vehicle, p_category, 1, p_x, 0)
+                        ON CONFLICT (tenant_id, vehicle_id, category) DO UPDATE
+                        SET n = s.n + 1,
+                            mean = s.mean + (p_x - s.mean) / (s.n + 1),
+                            m2 = s.m2 + (p_x - s.mean) * (p_x - (s.mean + (p_x - s.mean) / (s.n + 1)));
+                    ELSE
+                        UPDATE spend_stats
+                        SET n = n - 1,
+                            mean = CASE WHEN n > 1 THEN (n * mean - p_x) / (n - 1) ELSE 0 END,
+                            m2 = CASE WHEN n > 1
+                                      THEN GREATEST(m2 - (p_x - mean) * (p_x - (n * mean - p_x) / (n - 1)), 0)
+                                      ELSE 0 END
+                        WHERE vehicle_id = p_vehicle AND category = p_category;
+                    END IF;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE OR REPLACE FUNCTION score_spending() RETURNS trigger AS $$
+                DECLARE
+                    x DOUBLE PRECISION;
+                    st RECORD;
+                    z DOUBLE PRECISION;
+                    v_reason TEXT;
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.vehicle_id IS NOT NULL AND OLD.category IS NOT NULL THEN
+                        PERFORM spend_stats_apply(OLD.vehicle_id, OLD.category, ln(1 + abs(OLD.amount::double precision)), -1);
+                    END IF;
+                    IF TG_OP = 'DELETE' THEN
+                        RETURN NULL;
+                    END IF;
+                    -- An edited spending is scored afresh, review included
+                    DELETE FROM spending_anomalies WHERE spending_id = NEW.id;
+                    IF NEW.vehicle_id IS NULL OR NEW.category IS NULL THEN
+                        RETURN NULL;
+                    END IF;
+
+                    x := ln(1 + abs(NEW.amount::double precision));
+                    SELECT n, mean, m2 INTO st FROM spend_stats
+                    WHERE vehicle_id = NEW.vehicle_id AND category = NEW.category;
+                    IF st.n >= {min_samples} THEN
+                        z := (x - st.mean) / GREATEST(sqrt(st.m2 / (st.n - 1)), {min_stddev});
+                        IF abs(z) >= {z_threshold} THEN
+                            v_reason := CASE WHEN z > 0 THEN 'high' ELSE 'low' END;
+                        END IF;
+                    END IF;
+                    -- The same rules as anomalies.score_history: scored against the
+                    -- rows written before this one, duplicate of a lower id
+                    IF EXISTS (
+                        SELECT 1 FROM spendings
+                        WHERE vehicle_id = NEW.vehicle_id AND category = NEW.category
+                        AND amount = NEW.amount AND id < NEW.id
+                        AND date BETWEEN NEW.date - {duplicate_days} AND NEW.date + {duplicate_days}
+                    ) THEN
+                        v_reason := 'duplicate';
+                    END IF;
+                    IF v_reason IS NOT NULL THEN
+                        INSERT INTO spending_anomalies (spending_id, reason, score, expected_amount)
+                        VALUES (NEW.id, v_reason, z,
+                                CASE WHEN st.n >= {min_samples} THEN round((exp(st.mean) - 1)::numeric, 2) END);
+                    END IF;
+
+                    PERFORM spend_stats_apply(NEW.vehicle_id, NEW.category, x, 1);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS spendings_anomaly_score ON spendings;
+                CREATE TRIGGER spendings_anomaly_score
+                    AFTER INSERT OR UPDATE OF vehicle_id, category, amount, date OR DELETE ON spendings
+                    FOR EACH ROW EXECUTE FUNCTION score_spending();
+            """)
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM spend_stats) AND EXISTS (SELECT 1 FROM spendings)")
+            needs_backfill = cur.fetchone()[0]
+        if needs_backfill:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                series, flagged = anomalies.backfill(cur, *anomaly_settings())
+            conn.commit()
+            logger.info(f"Scored spending history: {series} series, {flagged} flagged")
     except Exception as e:
-        app.logger.error(f"Error deleting spending: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        conn.rollback()
+        logger.error(f"Error creating anomaly tables: {e}")
     finally:
         conn.close()
-    return redirect(url_for('spendings'))
 
-# Mark unpaid payment as paid
-@app.route('/mark_paid/<int:id>', methods=['POST'])
-@login_required
-def mark_paid(id):
+def create_fuel_efficiency():
+    """Litres and odometer on diesel spendings, and the per-fill efficiency
+    table kept current by trigger (see fuel.py)."""
     conn = get_db_conn()
     try:
-        data = request.get_json()
-        spended_by = data.get('spended_by', 'MSR')
-        mode = data.get('mode', 'UPI')
-        
         with conn.cursor() as cur:
-            update_reason = f" - Marked Paid on {datetime.now().strftime('%Y-%m-%d')}"
             cur.execute("""
-                UPDATE spendings
-                SET spended_by=%s, mode=%s,
-                reason=COALESCE(reason, '') || %s
-                WHERE id=%s
-            """, (spended_by, mode, update_reason, id))
-            conn.commit()
-            return jsonify({'success': True})
+                ALTER TABLE spendings ADD COLUMN IF NOT EXISTS litres NUMERIC(10, 2)
+                    CHECK (litres > 0);
+                ALTER TABLE spendings ADD COLUMN IF NOT EXISTS odometer_km INTEGER
+                    CHECK (odometer_km >= 0);
+                CREATE INDEX IF NOT EXISTS idx_spendings_fuel_fills ON spendings (vehicle_id, date)
+                    WHERE category = 'diesel' AND litres IS NOT NULL AND odometer_km IS NOT NULL;
+
+                CREATE TABLE IF NOT EXISTS fuel_efficiency (
+                    spending_id INTEGER PRIMARY KEY REFERENCES spendings(id) ON DELETE CASCADE,
+                    vehicle_id INTEGER NOT NULL,
+                    date DATE NOT NULL,
+                    odometer_km INTEGER NOT NULL,
+                    litres NUMERIC(10, 2) NOT NULL,
+                    distance_km INTEGER,
+                    km_per_litre NUMERIC(8, 2),
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_fuel_efficiency_vehicle_date
+                    ON fuel_efficiency (vehicle_id, date DESC);
+
+                -- Recompute a vehicle's fills dated p_from or later, each against
+                -- the fill before it (the last one before p_from included)
+                CREATE OR REPLACE FUNCTION fuel_efficiency_refresh(p_vehicle INTEGER, p_from DATE) RETURNS void AS $$
+                DECLARE
+                    v_start DATE;
+                BEGIN
+                    IF p_vehicle IS NULL OR p_from IS NULL THEN
+                        RETURN;
+                    END IF;
+                    SELECT MAX(date) INTO v_start FROM spendings
+                    WHERE vehicle_id = p_vehicle AND date < p_from
+                    AND category = 'diesel' AND litres IS NOT NULL AND odometer_km IS NOT NULL;
+
+                    DELETE FROM fuel_efficiency WHERE vehicle_id = p_vehicle AND date >= p_from;
+                    INSERT INTO fuel_efficiency (spending_id, vehicle_id, date, odometer_km, litres,
+                                                 distance_km, km_per_litre)
+                    SELECT id, vehicle_id, date, odometer_km, litres, distance,
+                           CASE WHEN distance > 0 THEN ROUND(distance / litres, 2) END
+                    FROM (
+                        SELECT id, vehicle_id, date, odometer_km, litres,
+                               odometer_km - LAG(odometer_km) OVER (ORDER BY date, odometer_km, id) AS distance
+                        FROM spendings
+                        WHERE vehicle_id = p_vehicle AND date >= COALESCE(v_start, p_from)
+                        AND category = 'diesel' AND litres IS NOT NULL AND odometer_km IS NOT NULL
+                    ) fills
+                    WHERE date >= p_from;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE OR REPLACE FUNCTION fuel_efficiency_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' AND OLD.category = 'diesel'
+                       AND OLD.litres IS NOT NULL AND OLD.odometer_km IS NOT NULL THEN
+                        PERFORM fuel_efficiency_refresh(OLD.vehicle_id, OLD.date);
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.category = 'diesel'
+                       AND NEW.litres IS NOT NULL AND NEW.odometer_km IS NOT NULL THEN
+                        PERFORM fuel_efficiency_refresh(NEW.vehicle_id, NEW.date);
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS spendings_fuel_efficiency ON spendings;
+                CREATE TRIGGER spendings_fuel_efficiency
+                    AFTER INSERT OR UPDATE OF vehicle_id, category, date, litres, odometer_km OR DELETE ON spendings
+                    FOR EACH ROW EXECUTE FUNCTION fuel_efficiency_change();
+
+                -- One-off backfill
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM fuel_efficiency) THEN
+                        PERFORM fuel_efficiency_refresh(vehicle_id, '-infinity'::date)
+                        FROM (
+                            SELECT DISTINCT vehicle_id FROM spendings
+                            WHERE category = 'diesel' AND litres IS NOT NULL AND odometer_km IS NOT NULL
+                        ) v;
+                    END IF;
+                END;
+                $$;
+            """)
     except Exception as e:
-        conn.rollback()
-        app.logger.error(f"Error marking paid: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error(f"Error creating fuel efficiency table: {e}")
     finally:
         conn.close()
 
-# Process settlement for multiple unpaid payments
-@app.route('/process_settlement', methods=['POST'])
-@login_required
-def process_settlement():
+def create_reconciliation_tables():
+    """Imported bank / fuel-card statements and their proposed or confirmed
+    matches to spendings (see reconcile.py)."""
     conn = get_db_conn()
     try:
-        data = request.get_json()
-        spending_ids = data.get('spending_ids', [])
-        spended_by = data.get('spended_by', 'MSR')
-        mode = data.get('mode', 'UPI')
-        
-        if not spending_ids:
-            return jsonify({'success': False, 'message': 'No spendings selected'})
-        
-        spending_ids = [int(id) for id in spending_ids]
-        
-        with get_dict_cursor(conn) as cur:
-            placeholders = ','.join(['%s'] * len(spending_ids))
-            cur.execute(f"SELECT SUM(amount) as total FROM spendings WHERE id IN ({placeholders})", spending_ids)
-            total_amount = cur.fetchone()['total'] or 0
-            
-            update_query = f"""
-                UPDATE spendings 
-                SET spended_by=%s, mode=%s, 
-                reason=COALESCE(reason, '') || %s 
-                WHERE id IN ({placeholders})
-            """
-            update_params = [spended_by, mode, f" - Settled on {datetime.now().strftime('%Y-%m-%d')}"] + spending_ids
-            cur.execute(update_query, update_params)
-            
-            conn.commit()
-            
-            return jsonify({
-                'success': True, 
-                'message': f'Settlement processed for {len(spending_ids)} payments totaling ₹{total_amount}'
-            })
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS statement_imports (
+                    id SERIAL PRIMARY KEY,
+                    source VARCHAR(50) NOT NULL,
+                    filename VARCHAR(255),
+                    mode VARCHAR(50),
+                    line_count INTEGER NOT NULL DEFAULT 0,
+                    imported_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+
+                CREATE TABLE IF NOT EXISTS statement_lines (
+                    id SERIAL PRIMARY KEY,
+                    import_id INTEGER NOT NULL REFERENCES statement_imports(id) ON DELETE CASCADE,
+                    line_no INTEGER NOT NULL,
+                    date DATE NOT NULL,
+                    amount NUMERIC(12, 2) NOT NULL,
+                    description TEXT,
+                    reference VARCHAR(100),
+                    status VARCHAR(20) NOT NULL DEFAULT 'unmatched',
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_statement_lines_import ON statement_lines (import_id, status);
+
+                CREATE TABLE IF NOT EXISTS reconciliation_matches (
+                    id SERIAL PRIMARY KEY,
+                    import_id INTEGER NOT NULL REFERENCES statement_imports(id) ON DELETE CASCADE,
+                    line_id INTEGER NOT NULL REFERENCES statement_lines(id) ON DELETE CASCADE,
+                    spending_ids INTEGER[] NOT NULL,
+                    confidence NUMERIC(3, 2) NOT NULL,
+                    kind VARCHAR(20) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'proposed',
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    confirmed_at TIMESTAMP WITH TIME ZONE,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_reconciliation_matches_import
+                    ON reconciliation_matches (import_id, status);
+                CREATE INDEX IF NOT EXISTS idx_reconciliation_matches_confirmed_spendings
+                    ON reconciliation_matches USING GIN (spending_ids) WHERE status = 'confirmed';
+            """)
     except Exception as e:
-        conn.rollback()
-        app.logger.error(f"Error in process_settlement: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
+        logger.error(f"Error creating reconciliation tables: {e}")
     finally:
         conn.close()
 
-# Payments list & add payment (Credit)
-@app.route('/payments', methods=['GET', 'POST'])
-@login_required
-def payments():
+def create_jobs_table():
+    """Background job queue (see jobs.py). The partial unique index lets only
+    one queued/running job exist per tenant, kind and parameters."""
     conn = get_db_conn()
-    payment_rows = []
-    total_credited = 0
     try:
-        with get_dict_cursor(conn) as cur:
-            if request.method == 'POST':
-                date_str = request.form.get('date')
-                amount = request.form.get('amount')
-                received_from = request.form.get('received_from', '').strip()
-                reason = request.form.get('reason', '').strip()
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id SERIAL PRIMARY KEY,
+                    kind VARCHAR(50) NOT NULL,
+                    params JSONB NOT NULL DEFAULT '{}',
+                    params_hash CHAR(64) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    submitted_by VARCHAR(100),
+                    worker VARCHAR(100),
+                    rows_done INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    result_name VARCHAR(255),
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP WITH TIME ZONE,
+                    heartbeat_at TIMESTAMP WITH TIME ZONE,
+                    finished_at TIMESTAMP WITH TIME ZONE,
+                    tenant_id INTEGER NOT NULL DEFAULT current_tenant_id() REFERENCES tenants(id)
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_tenant_in_flight
+                    ON jobs (tenant_id, kind, params_hash) WHERE status IN ('queued', 'running');
+                CREATE INDEX IF NOT EXISTS idx_jobs_tenant_queued ON jobs (tenant_id, id) WHERE status = 'queued';
+            """)
+    except Exception as e:
+        logger.error(f"Error creating jobs table: {e}")
+    finally:
+        conn.close()
 
-                if not all([date_str, amount]):
-                    flash('Missing required fields.', 'error')
-                    return redirect(url_for('payments'))
+# Every table that carries a tenant_id; all but users (read at login, before
+# a tenant is known) are filtered by the tenant_isolation policy
+TENANT_TABLES = (
+    'users', 'vehicles', 'spendings', 'payments', 'companies', 'employee_advances',
+    'hired_vehicles', 'hired_vehicle_transactions', 'company_sales', 'company_payments',
+    'vehicle_monthly_rollup', 'receivable_open_items', 'receivables_dirty',
+    'periods', 'spending_category_monthly', 'period_vehicle_totals', 'period_category_totals',
+    'period_employee_totals', 'period_company_totals', 'period_hired_vehicle_totals',
+    'journal_entries', 'journal_postings', 'account_balances', 'account_balance_checkpoints',
+    'change_log', 'spend_forecasts', 'spend_stats', 'spending_anomalies', 'fuel_efficiency',
+    'statement_imports', 'statement_lines', 'reconciliation_matches', 'jobs',
+)
 
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                amount_decimal = Decimal(amount)
+# Keys that were database-wide before tenants: (old constraint, new key)
+TENANT_KEYS = {
+    'vehicles': ('vehicles_vehicle_no_key', 'UNIQUE (tenant_id, vehicle_no)'),
+    'companies': ('companies_name_key', 'UNIQUE (tenant_id, name)'),
+    'hired_vehicles': ('hired_vehicles_vehicle_no_key', 'UNIQUE (tenant_id, vehicle_no)'),
+    'vehicle_monthly_rollup': ('vehicle_monthly_rollup_pkey', 'PRIMARY KEY (tenant_id, vehicle_id, month)'),
+    'receivables_dirty': ('receivables_dirty_pkey', 'PRIMARY KEY (tenant_id, company_name)'),
+    'periods': ('periods_pkey', 'PRIMARY KEY (tenant_id, month)'),
+    'spending_category_monthly': ('spending_category_monthly_pkey',
+                                  'PRIMARY KEY (tenant_id, month, vehicle_id, category)'),
+    'period_vehicle_totals': ('period_vehicle_totals_pkey', 'PRIMARY KEY (tenant_id, month, vehicle_id)'),
+    'period_category_totals': ('period_category_totals_pkey', 'PRIMARY KEY (tenant_id, month, category)'),
+    'period_employee_totals': ('period_employee_totals_pkey', 'PRIMARY KEY (tenant_id, month, employee_name)'),
+    'period_company_totals': ('period_company_totals_pkey', 'PRIMARY KEY (tenant_id, month, company_name)'),
+    'period_hired_vehicle_totals': ('period_hired_vehicle_totals_pkey',
+                                    'PRIMARY KEY (tenant_id, month, hired_vehicle_id)'),
+    'account_balances': ('account_balances_pkey', 'PRIMARY KEY (tenant_id, account)'),
+    'account_balance_checkpoints': ('account_balance_checkpoints_pkey',
+                                    'PRIMARY KEY (tenant_id, account, month)'),
+    'change_log': ('change_log_seq_key', 'UNIQUE (tenant_id, seq)'),
+    'spend_forecasts': ('spend_forecasts_pkey', 'PRIMARY KEY (tenant_id, run_month, vehicle_id, category)'),
+    'spend_stats': ('spend_stats_pkey', 'PRIMARY KEY (tenant_id, vehicle_id, category)'),
+}
 
-                received_from = received_from if received_from else None
-                reason = reason if reason else None
+# Indexes replaced by tenant-leading ones, dropped once those exist
+PRE_TENANT_INDEXES = (
+    'idx_spendings_date', 'idx_spendings_category_date', 'idx_spendings_spended_by_date',
+    'idx_spendings_month_vehicle', 'idx_spendings_unpaid_date', 'idx_employee_advances_employee_date',
+    'idx_spendings_source_external_ref', 'idx_receivable_open_items_company',
+    'idx_company_sales_company_date', 'idx_company_payments_company',
+    'idx_journal_postings_account_date', 'idx_account_balance_checkpoints_month',
+    'idx_change_log_unpublished', 'idx_spending_anomalies_open', 'idx_jobs_in_flight', 'idx_jobs_queued',
+)
 
+def migrate_tenant_columns():
+    """Give tables created before tenants a tenant_id (existing rows go to the
+    default tenant) and make their keys per tenant, one transaction per table,
+    before the create_* functions install triggers that rely on both."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            for table in TENANT_TABLES:
                 cur.execute("""
-                    INSERT INTO payments (date, amount, received_from, reason)
-                    VALUES (%s, %s, %s, %s)
-                """, (date_obj, amount_decimal, received_from, reason))
-                flash('Payment recorded successfully!', 'success')
-                return redirect(url_for('payments'))
-
-            cur.execute("SELECT * FROM payments ORDER BY date DESC")
-            payment_rows = cur.fetchall()
-
-            cur.execute("SELECT COALESCE(SUM(amount),0) AS total_credited FROM payments")
-            total_credited = cur.fetchone()['total_credited'] or 0
+                    SELECT to_regclass(%s) IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'tenant_id')
+                """, (table, table))
+                if not cur.fetchone()[0]:
+                    continue
+                statements = [
+                    "BEGIN",
+                    f"""ALTER TABLE {table} ADD COLUMN tenant_id INTEGER NOT NULL
+                        DEFAULT {int(tenants.DEFAULT_TENANT_ID)} REFERENCES tenants(id)""",
+                    f"ALTER TABLE {table} ALTER COLUMN tenant_id SET DEFAULT current_tenant_id()",
+                ]
+                if table in TENANT_KEYS:
+                    old_key, new_key = TENANT_KEYS[table]
+                    statements.append(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {old_key}, ADD {new_key}")
+                statements.append("COMMIT")
+                cur.execute(';\n'.join(statements))
+                logger.info(f"Added tenant_id to {table}")
+    except Exception as e:
+        logger.error(f"Error adding tenant columns: {e}")
+    finally:
+        conn.close()
 
+def create_tenancy():
+    """Tenant-leading indexes for the remaining per-tenant listings, the
+    tenant_isolation policies, and removal of the indexes they superseded.
+    Runs last, once every table exists."""
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_payments_tenant_date ON payments (tenant_id, date DESC);
+                CREATE INDEX IF NOT EXISTS idx_hired_vehicle_transactions_tenant_month
+                    ON hired_vehicle_transactions (tenant_id, month_year);
+                CREATE INDEX IF NOT EXISTS idx_company_sales_tenant_month ON company_sales (tenant_id, month_year);
+                CREATE INDEX IF NOT EXISTS idx_company_payments_tenant_month
+                    ON company_payments (tenant_id, month_year);
+                CREATE INDEX IF NOT EXISTS idx_fuel_efficiency_tenant_date ON fuel_efficiency (tenant_id, date);
+                CREATE INDEX IF NOT EXISTS idx_statement_imports_tenant ON statement_imports (tenant_id, id);
+            """)
+            # FORCE so the policies also bind the tables' owner, which is
+            # normally the application role. A plain equality on tenant_id
+            # lets the planner use the tenant-leading indexes.
+            for table in TENANT_TABLES:
+                if table == 'users':
+                    continue
+                cur.execute("""
+                    SELECT c.relrowsecurity AND c.relforcerowsecurity,
+                           EXISTS (SELECT 1 FROM pg_policy p
+                                   WHERE p.polrelid = c.oid AND p.polname = 'tenant_isolation')
+                    FROM pg_class c WHERE c.oid = %s::regclass
+                """, (table,))
+                enabled, has_policy = cur.fetchone()
+                if not has_policy:
+                    cur.execute(f"""
+                        CREATE POLICY tenant_isolation ON {table}
+                        USING (tenant_id = current_tenant_id())
+                    """)
+                if not enabled:
+                    cur.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY, FORCE ROW LEVEL SECURITY")
+            cur.execute(';\n'.join(f"DROP INDEX IF EXISTS {name}" for name in PRE_TENANT_INDEXES))
+            if tenants.bypasses_rls(cur):
+                logger.warning("The database role bypasses row-level security (superuser or BYPASSRLS); "
+                               "tenants are only kept apart once the app connects as an ordinary role")
     except Exception as e:
-        app.logger.error(f"Error in payments route: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error setting up tenancy: {e}")
     finally:
         conn.close()
 
-    today = datetime.now().strftime('%Y-%m-%d')
-    return render_template('payments.html',
-                           payment_rows=payment_rows,
-                           total_credited=float(total_credited),
-                           today=today)
+# Foreign keys between tenant tables, as (table, column, referenced table,
+# ON DELETE action). Constraint checks ignore row-level security, so a plain
+# REFERENCES vehicles(id) accepts another tenant's vehicle; these are keyed on
+# (tenant_id, id) instead.
+TENANT_REFERENCES = (
+    ('spendings', 'vehicle_id', 'vehicles', None),
+    ('payments', 'company_id', 'companies', None),
+    ('payments', 'vehicle_id', 'vehicles', None),
+    ('hired_vehicle_transactions', 'hired_vehicle_id', 'hired_vehicles', None),
+    ('journal_postings', 'entry_id', 'journal_entries', 'CASCADE'),
+    ('spend_forecasts', 'vehicle_id', 'vehicles', 'CASCADE'),
+    ('spending_anomalies', 'spending_id', 'spendings', 'CASCADE'),
+    ('fuel_efficiency', 'spending_id', 'spendings', 'CASCADE'),
+    ('statement_lines', 'import_id', 'statement_imports', 'CASCADE'),
+    ('reconciliation_matches', 'import_id', 'statement_imports', 'CASCADE'),
+    ('reconciliation_matches', 'line_id', 'statement_lines', 'CASCADE'),
+)
 
-# Delete Payment
-@app.route('/delete_payment/<int:id>', methods=['POST'])
-@login_required
-def delete_payment(id):
+def create_tenant_foreign_keys():
+    """Replace each single-column foreign key in TENANT_REFERENCES with one on
+    (tenant_id, column), one transaction per key. The new key is added NOT
+    VALID, so it binds new writes at once, and then validated; rows that
+    already point at another tenant are logged and left for review."""
     conn = get_db_conn()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM payments WHERE id = %s", (id,))
-            flash('Payment deleted successfully!', 'success')
+            for table, column, parent, on_delete in TENANT_REFERENCES:
+                name = f"{table}_{column}_tenant_fkey"
+                cur.execute("SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                            (table, name))
+                if cur.fetchone():
+                    continue
+                cur.execute("""
+                    SELECT c.conname FROM pg_constraint c
+                    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+                    WHERE c.conrelid = %s::regclass AND c.confrelid = %s::regclass
+                    AND c.contype = 'f' AND cardinality(c.conkey) = 1 AND a.attname = %s
+                """, (table, parent, column))
+                old_keys = [row[0] for row in cur.fetchall()]
+                cur.execute("""
+                    SELECT 1 FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND conname = %s
+                """, (parent, f"{parent}_tenant_id_id_key"))
+                statements = ["BEGIN"]
+                if not cur.fetchone():
+                    statements.append(f"ALTER TABLE {parent} ADD CONSTRAINT {parent}_tenant_id_id_key UNIQUE (tenant_id, id)")
+                statements.append(f"""
+                    ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY (tenant_id, {column})
+                        REFERENCES {parent} (tenant_id, id){f' ON DELETE {on_delete}' if on_delete else ''} NOT VALID
+                """)
+                statements += [f"ALTER TABLE {table} DROP CONSTRAINT {old_key}" for old_key in old_keys]
+                statements.append("COMMIT")
+                cur.execute(';\n'.join(statements))
+                try:
+                    cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+                    logger.info(f"Scoped {table}.{column} to the tenant")
+                except psycopg2.Error as e:
+                    logger.error(f"{table}.{column} has rows pointing at another tenant's {parent} "
+                                 f"(new writes are checked, existing rows are not): {e}")
     except Exception as e:
-        app.logger.error(f"Error deleting payment: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        logger.error(f"Error scoping foreign keys to tenants: {e}")
     finally:
         conn.close()
-    return redirect(url_for('payments'))
 
-# Employee Advances
-@app.route('/employee_advances', methods=['GET', 'POST'])
+def initialize_database():
+    """Initialize all database tables and views"""
+    create_tenants_table()
+    migrate_tenant_columns()
+    create_auth_tables()
+    create_vehicles_table()
+    create_spendings_table()
+    create_payments_table()
+    create_companies_table()
+    create_employee_advances_table()
+    create_employee_balance_view()
+    create_hired_vehicles_table()
+    create_hired_vehicle_transactions_table()
+    create_company_sales_table()
+    create_company_payments_table()
+    create_change_notify_triggers()
+    create_search_indexes()
+    create_spendings_indexes()
+    create_spendings_ingest_columns()
+    create_vehicle_monthly_rollup()
+    create_receivables_tables()
+    create_periods_tables()
+    create_month_close_tables()
+    create_journal_tables()
+    create_journal_checkpoints()
+    create_change_log()
+    create_spend_forecasts_table()
+    create_anomaly_tables()
+    create_fuel_efficiency()
+    create_reconciliation_tables()
+    create_jobs_table()
+    create_tenancy()
+    create_tenant_foreign_keys()
+    logger.info("All database tables initialized successfully")
+
+# ----------------------------------------------------
+
+# Home / Dashboard with monthly expense tracking
+@app.route('/')
 @login_required
-def employee_advances():
+def index():
     conn = get_db_conn()
-    
-    if request.method == 'POST':
-        try:
-            employee_name = request.form['employee_name']
-            date = request.form['date']
-            amount = request.form['amount']
-            purpose = request.form.get('purpose', '')
+    vehicles = []
+    monthly_vehicle_expenses = []
+    monthly_trend = []
+    vehicle_forecasts = []
+    totals = {
+        'vehicles': 0,
+        'credited': 0,
+        'debited': 0,
+        'balance': 0,
+        'current_month': 0,
+        'prev_month': 0
+    }
 
-            if not employee_name or not date or not amount:
-                flash('Please fill in all required fields.', 'error')
-            else:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO employee_advances 
-                        (employee_name, date, amount, purpose) 
-                        VALUES (%s, %s, %s, %s)
-                    """, (employee_name, date, amount, purpose))
-                    conn.commit()
-                
-                flash(f'Advance added successfully for {employee_name}.', 'success')
-                return redirect(url_for('employee_advances'))
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error adding employee advance: {str(e)}")
-            flash('An error occurred while adding the advance.', 'error')
-    
-    employee_balances = []
-    advances = []
-    
     try:
-        with get_dict_cursor(conn) as cur:
-            # Fetch balances from the view
-            cur.execute("SELECT * FROM employee_balance ORDER BY employee_name")
-            employee_balances = cur.fetchall()
-            
-            # Convert Decimal types to float for safe display
-            for employee in employee_balances:
-                for key in ['total_advances', 'total_expenses', 'balance']:
-                    if isinstance(employee.get(key), Decimal):
-                        employee[key] = float(employee[key])
-                        
-            # Fetch all individual advances
-            cur.execute("SELECT * FROM employee_advances ORDER BY date DESC")
-            advances = cur.fetchall()
-            
-            # Convert amount for display
-            for advance in advances:
-                 if isinstance(advance.get('amount'), Decimal):
-                    advance['amount'] = float(advance['amount'])
+        # One snapshot so the separate totals agree with each other
+        with db.snapshot(conn), get_dict_cursor(conn) as cur:
+            current_month = datetime.now().strftime('%Y-%m-01')
+            prev_month = (datetime.now().replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-01')
+
+            ledger_replica = ledger_replica_for(g.tenant_id)
+            if config.LEDGER_REPLICA_ENABLED and ledger_replica.ready:
+                # Totals come from the in-memory replica; only the vehicle list hits the DB
+                cur.execute("SELECT id, vehicle_no FROM vehicles")
+                vehicle_totals = ledger_replica.vehicle_totals()
+                vehicles = [{'id': v['id'], 'vehicle_no': v['vehicle_no'], 'total_spent': vehicle_totals.get(v['id'], 0)}
+                            for v in cur.fetchall()]
+                total_vehicles = len(vehicles)
+
+                current_month_total = ledger_replica.month_total(current_month)
+                prev_month_total = ledger_replica.month_total(prev_month)
+            else:
+                cur.execute("SELECT v.id, v.vehicle_no, COALESCE(SUM(s.amount),0) AS total_spent FROM vehicles v LEFT JOIN spendings s ON v.id=s.vehicle_id GROUP BY v.id, v.vehicle_no")
+                vehicles = cur.fetchall()
+
+                cur.execute("SELECT COUNT(*) AS c FROM vehicles")
+                total_vehicles = cur.fetchone()['c']
+
+                cur.execute("SELECT COALESCE(SUM(amount),0) as current_month_total FROM spendings WHERE expense_month = %s", (current_month,))
+                current_month_total = cur.fetchone()['current_month_total'] or 0
+
+                cur.execute("SELECT COALESCE(SUM(amount),0) as prev_month_total FROM spendings WHERE expense_month = %s", (prev_month,))
+                prev_month_total = cur.fetchone()['prev_month_total'] or 0
+
+            # Cash in and out come from the journal, like every other page
+            ledger = journal.ledger_totals(cur)
+            total_credited = ledger['credited']
+            total_debited = ledger['debited']
+            balance = ledger['balance']
+
+            cur.execute("""
+                SELECT
+                    v.vehicle_no,
+                    SUM(s.amount) as monthly_total
+                FROM spendings s
+                JOIN vehicles v ON s.vehicle_id = v.id
+                WHERE s.expense_month = %s
+                GROUP BY v.vehicle_no
+                ORDER BY monthly_total DESC
+            """, (current_month,))
+            monthly_vehicle_expenses = cur.fetchall()
+
+            cur.execute("""
+                SELECT
+                    TO_CHAR(expense_month, 'YYYY-MM') as month,
+                    SUM(amount) as total_expense
+                FROM spendings
+                WHERE expense_month >= (CURRENT_DATE - INTERVAL '6 months')
+                GROUP BY expense_month
+                ORDER BY expense_month DESC
+            """)
+            monthly_trend = cur.fetchall()
+
+            vehicle_forecasts = forecast.vehicle_forecasts(cur, current_month)
+
+            totals = {
+                'vehicles': total_vehicles,
+                'credited': float(total_credited or 0),
+                'debited': float(total_debited or 0),
+                'balance': float(balance),
+                'current_month': float(current_month_total),
+                'prev_month': float(prev_month_total)
+            }
 
     except Exception as e:
-        logger.error(f"Database error in employee_advances: {e}")
-        flash(f'Error loading employee advances: {str(e)}', 'error')
-        
+        app.logger.error(f"Error in index route: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
     finally:
-        if conn:
-            conn.close()
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    return render_template('employee_advances.html',
-                         advances=advances,
-                         employee_balances=employee_balances,
-                         today=today)
+        conn.close()
 
-# Hired Vehicles Audit
-@app.route('/hired_vehicles_audit', methods=['GET', 'POST'])
-@login_required
-def hired_vehicles_audit():
-    conn = get_db_conn()
-    hired_vehicles = []
-    recent_transactions = []
-    hired_vehicles_summary = []
+    return render_template('index.html',
+                         vehicles=vehicles,
+                         monthly_vehicle_expenses=monthly_vehicle_expenses,
+                         monthly_trend=monthly_trend,
+                         vehicle_forecasts=vehicle_forecasts,
+                         totals=totals)
+
+# Login route
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if 'user_id' in session:
+        return redirect(url_for('index'))
     
-    try:
-        with get_dict_cursor(conn) as cur:
-            if request.method == 'POST':
-                action = request.form.get('action')
-                
-                if action == 'add_hired_vehicle':
-                    vehicle_no = request.form.get('vehicle_no').strip()
-                    owner_name = request.form.get('owner_name').strip()
-                    contact_number = request.form.get('contact_number', '').strip()
-                    
-                    cur.execute(
-                        "INSERT INTO hired_vehicles (vehicle_no, owner_name, contact_number) VALUES (%s, %s, %s)",
-                        (vehicle_no, owner_name, contact_number)
-                    )
-                    flash('Hired vehicle added successfully', 'success')
-                    
-                elif action == 'add_transaction':
-                    hired_vehicle_id = request.form.get('hired_vehicle_id')
-                    transaction_type = request.form.get('transaction_type')
-                    transaction_date = datetime.strptime(request.form.get('transaction_date'), '%Y-%m-%d').date()
-                    month_year = datetime.strptime(request.form.get('month_year'), '%Y-%m').date().replace(day=1)
-                    amount = request.form.get('amount')
-                    description = request.form.get('description', '').strip()
-                    reference_no = request.form.get('reference_no', '').strip()
-                    
-                    cur.execute("""
-                        INSERT INTO hired_vehicle_transactions 
-                        (hired_vehicle_id, transaction_type, transaction_date, month_year, amount, description, reference_no)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """, (hired_vehicle_id, transaction_type, transaction_date, month_year, amount, description, reference_no))
-                    
-                    flash('Transaction added successfully', 'success')
-            
-            # Get all hired vehicles
-            cur.execute("SELECT * FROM hired_vehicles ORDER BY vehicle_no")
-            hired_vehicles = cur.fetchall()
-            
-            # Get recent transactions
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        conn = get_db_conn()
+        try:
+            with get_dict_cursor(conn) as cur:
+                cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+                user = cur.fetchone()
+                if user and bcrypt.check_password_hash(user['password_hash'], password):
+                    session['user_id'] = user['id']
+                    session['username'] = user['username']
+                    session['tenant_id'] = user['tenant_id']
+                    flash('Login successful!', 'success')
+                    return redirect(url_for('index'))
+                else:
+                    flash('Invalid username or password.', 'error')
+        except Exception as e:
+            logger.error(f"Login error: {str(e)}")
+            flash('An error occurred during login', 'error')
+        finally:
+            conn.close()
+    return render_template('login.html')
+
+# Logout route
+@app.route('/logout')
+def logout():
+    session.clear()
+    flash('You have been logged out.', 'success')
+    return redirect(url_for('login'))
+
+# Vehicles page & add vehicle
+@app.route('/vehicles', methods=['GET','POST'])
+@login_required
+def vehicles_page():
+    conn = get_db_conn()
+    vehicles = []
+    try:
+        if request.method == 'POST':
+            vehicle_no = request.form.get('vehicle_no').strip()
+            owner_name = request.form.get('owner_name', '').strip()
+            contact_number = request.form.get('contact_number', '').strip()
+
+            if not vehicle_no:
+                flash('Vehicle number cannot be empty.', 'error')
+            else:
+                with get_dict_cursor(conn) as cur:
+                    cur.execute("SELECT id FROM vehicles WHERE vehicle_no = %s", (vehicle_no,))
+                    if cur.fetchone():
+                        flash(f'Vehicle {vehicle_no} already exists.', 'error')
+                    else:
+                        cur.execute("INSERT INTO vehicles (vehicle_no, owner_name, contact_number) VALUES (%s, %s, %s)",
+                                   (vehicle_no, owner_name, contact_number))
+                        flash('Vehicle added successfully!', 'success')
+                        return redirect(url_for('vehicles_page'))
+
+        with get_dict_cursor(conn) as cur:
+            cur.execute("SELECT * FROM vehicles ORDER BY vehicle_no")
+            vehicles = cur.fetchall()
+    except Exception as e:
+        app.logger.error(f"Error in vehicles_page route: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+    return render_template('vehicles.html', vehicles=vehicles)
+
+# Delete Vehicle
+@app.route('/delete_vehicle/<int:id>', methods=['POST'])
+@login_required
+def delete_vehicle(id):
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            cur.execute("SELECT COUNT(*) as count FROM spendings WHERE vehicle_id = %s", (id,))
+            if cur.fetchone()['count'] > 0:
+                flash('Cannot delete vehicle. Delete all associated spendings first.', 'error')
+            else:
+                cur.execute("DELETE FROM vehicles WHERE id = %s", (id,))
+                flash('Vehicle deleted successfully!', 'success')
+    except Exception as e:
+        app.logger.error(f"Error deleting vehicle: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('vehicles_page'))
+
+# Spendings list & add spending
+def spending_readings(form, category):
+    """(litres, odometer_km) from a spending form, validated like feed items.
+    Litres and odometer are only kept for diesel fills (see fuel.py), so other
+    categories get (None, None); raises ValueError."""
+    if category != 'diesel':
+        return None, None
+    return ingest.fill_readings(form, category)
+
+@app.route('/spendings', methods=['GET','POST'])
+@login_required
+def spendings():
+    conn = get_db_conn()
+    vehicles = []
+    paid_rows = []
+    unpaid_rows = []
+    settled_sections = []
+    monthly_totals = []
+    total_spent = 0
+    total_unpaid = 0
+    streamed = False
+
+    try:
+        with get_dict_cursor(conn) as cur:
+            cur.execute("SELECT id, vehicle_no FROM vehicles ORDER BY vehicle_no")
+            vehicles = cur.fetchall()
+
+            if request.method == 'POST':
+                vehicle_id = request.form.get('vehicle_id')
+                date_str = request.form.get('date')
+                expense_month_str = request.form.get('expense_month')
+                category = request.form.get('category').strip()
+                reason = request.form.get('reason', '').strip()
+                amount = request.form.get('amount')
+                spended_by = request.form.get('spended_by', '').strip()
+                mode = request.form.get('mode', '').strip()
+
+                if not all([vehicle_id, date_str, expense_month_str, category, amount]):
+                    flash('Missing required fields.', 'error')
+                    return redirect(url_for('spendings'))
+
+                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+                expense_month = datetime.strptime(expense_month_str, '%Y-%m').date().replace(day=1)
+                amount_decimal = Decimal(amount)
+
+                spended_by = spended_by if spended_by else None
+                mode = mode if mode else None
+
+                try:
+                    litres, odometer_km = spending_readings(request.form, category)
+                except ValueError as e:
+                    flash(f'Invalid fuel reading: {e}', 'error')
+                    return redirect(url_for('spendings'))
+
+                cur.execute("""
+                    INSERT INTO spendings (vehicle_id, date, expense_month, category, reason, amount, spended_by, mode,
+                                          litres, odometer_km)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (vehicle_id, date_obj, expense_month, category, reason, amount_decimal, spended_by, mode,
+                      litres, odometer_km))
+                flash('Spending recorded successfully!', 'success')
+                return redirect(url_for('spendings'))
+
+            ledger = journal.ledger_totals(cur)
+            total_spent = ledger['debited']
+            total_unpaid = ledger['unpaid']
+
+            # Monthly totals by expense month
             cur.execute("""
-                SELECT t.*, hv.vehicle_no, hv.owner_name 
-                FROM hired_vehicle_transactions t
-                JOIN hired_vehicles hv ON t.hired_vehicle_id = hv.id
-                ORDER BY t.transaction_date DESC, t.created_at DESC
-                LIMIT 50
+                SELECT expense_month, COALESCE(SUM(amount),0) as monthly_total
+                FROM spendings
+                WHERE spended_by IS NOT NULL AND mode IS NOT NULL
+                GROUP BY expense_month
+                ORDER BY expense_month DESC
             """)
-            recent_transactions = cur.fetchall()
-            
-            # Get summary for all hired vehicles
-            for vehicle in hired_vehicles:
-                cur.execute("""
-                    SELECT 
-                        SUM(CASE WHEN transaction_type = 'sale' THEN amount ELSE 0 END) as total_sales,
-                        SUM(CASE WHEN transaction_type = 'payment' THEN amount ELSE 0 END) as total_payments
-                    FROM hired_vehicle_transactions 
-                    WHERE hired_vehicle_id = %s
-                """, (vehicle['id'],))
-                summary = cur.fetchone()
-                
-                hired_vehicles_summary.append({
-                    'id': vehicle['id'],
-                    'vehicle_no': vehicle['vehicle_no'],
-                    'owner_name': vehicle['owner_name'],
-                    'total_sales': float(summary['total_sales'] or 0),
-                    'total_payments': float(summary['total_payments'] or 0)
-                })
-                
+            monthly_totals = cur.fetchall()
+
+        # Row tables are read while the page streams (see stream_page)
+        cursor = lambda: get_dict_cursor(conn)
+        unpaid_rows = fragments.lazy_rows(cursor, """
+            SELECT s.*, v.vehicle_no, a.reason AS anomaly, a.expected_amount FROM spendings s
+            JOIN vehicles v ON s.vehicle_id = v.id
+            LEFT JOIN spending_anomalies a ON a.spending_id = s.id AND a.reviewed_at IS NULL
+            WHERE s.spended_by IS NULL OR s.mode IS NULL
+            ORDER BY s.date DESC
+        """, max_rows=config.STREAM_MAX_ROWS)
+        paid_rows = fragments.lazy_rows(cursor, """
+            SELECT s.*, v.vehicle_no, a.reason AS anomaly, a.expected_amount FROM spendings s
+            JOIN vehicles v ON s.vehicle_id = v.id
+            LEFT JOIN spending_anomalies a ON a.spending_id = s.id AND a.reviewed_at IS NULL
+            WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
+            AND s.date >= (CURRENT_DATE - INTERVAL '30 days')
+            ORDER BY s.date DESC
+        """, max_rows=config.STREAM_MAX_ROWS)
+        settled_sections = fragments.Peekable(_settled_sections(conn))
+        streamed = True
+
     except Exception as e:
-        app.logger.error(f"Error in hired_vehicles_audit: {str(e)}")
+        app.logger.error(f"Error in spendings route: {str(e)}")
         flash(f'An error occurred: {str(e)}', 'error')
     finally:
-        conn.close()
-    
+        if not streamed:
+            conn.close()
+
     today = datetime.now().strftime('%Y-%m-%d')
     current_month = datetime.now().strftime('%Y-%m')
     
-    return render_template('hired_vehicles_audit.html',
-                         hired_vehicles=hired_vehicles,
-                         recent_transactions=recent_transactions,
-                         hired_vehicles_summary=hired_vehicles_summary,
-                         today=today,
-                         current_month=current_month)
+    return stream_page('spendings.html', conn if streamed else None,
+                           vehicles=vehicles,
+                           paid_rows=paid_rows,
+                           unpaid_rows=unpaid_rows,
+                           settled_sections=settled_sections,
+                           monthly_totals=monthly_totals,
+                           total_spent=float(total_spent),
+                           total_unpaid=float(total_unpaid),
+                           today=today,
+                           current_month=current_month)
 
-# Company Audit
-@app.route('/company_audit', methods=['GET', 'POST'])
+# Delete Spending
+@app.route('/delete_spending/<int:id>', methods=['POST'])
 @login_required
-def company_audit():
+def delete_spending(id):
     conn = get_db_conn()
-    recent_sales = []
-    recent_payments = []
-    company_summary = []
-    company_list = []
-    totals = {
-        'total_sales': 0,
-        'total_received': 0,
-        'pending_amount': 0,
-        'total_companies': 0
-    }
-    
     try:
-        with get_dict_cursor(conn) as cur:
-            if request.method == 'POST':
-                action = request.form.get('action')
-                
-                if action == 'add_sale':
-                    sale_date = datetime.strptime(request.form.get('sale_date'), '%Y-%m-%d').date()
-                    company_name = request.form.get('company_name').strip()
-                    invoice_number = request.form.get('invoice_number', '').strip()
-                    sale_amount = request.form.get('sale_amount')
-                    month_year = datetime.strptime(request.form.get('month_year'), '%Y-%m').date().replace(day=1)
-                    description = request.form.get('description', '').strip()
-                    
-                    cur.execute("""
-                        INSERT INTO company_sales 
-                        (sale_date, company_name, invoice_number, sale_amount, month_year, description)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (sale_date, company_name, invoice_number, sale_amount, month_year, description))
-                    
-                    flash('Sale recorded successfully', 'success')
-                    
-                elif action == 'add_payment':
-                    payment_date = datetime.strptime(request.form.get('payment_date'), '%Y-%m-%d').date()
-                    company_name = request.form.get('company_name').strip()
-                    if company_name == '_new':
-                        company_name = request.form.get('new_company_name').strip()
-                    received_amount = request.form.get('received_amount')
-                    payment_mode = request.form.get('payment_mode')
-                    reference_number = request.form.get('reference_number', '').strip()
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM spendings WHERE id = %s", (id,))
+            flash('Spending deleted successfully!', 'success')
+    except Exception as e:
+        app.logger.error(f"Error deleting spending: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('spendings'))
+
+# Mark unpaid payment as paid
+@app.route('/mark_paid/<int:id>', methods=['POST'])
+@login_required
+def mark_paid(id):
+    conn = get_db_conn()
+    try:
+        data = request.get_json()
+        spended_by = data.get('spended_by', 'MSR')
+        mode = data.get('mode', 'UPI')
+        
+        with conn.cursor() as cur:
+            update_reason = f" - Marked Paid on {datetime.now().strftime('%Y-%m-%d')}"
+            cur.execute("""
+                UPDATE spendings
+                SET spended_by=%s, mode=%s,
+                reason=COALESCE(reason, '') || %s
+                WHERE id=%s
+            """, (spended_by, mode, update_reason, id))
+            conn.commit()
+            return jsonify({'success': True})
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error marking paid: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Process settlement for multiple unpaid payments
+@app.route('/process_settlement', methods=['POST'])
+@login_required
+def process_settlement():
+    conn = get_db_conn()
+    try:
+        data = request.get_json()
+        spending_ids = data.get('spending_ids', [])
+        spended_by = data.get('spended_by', 'MSR')
+        mode = data.get('mode', 'UPI')
+        
+        if not spending_ids:
+            return jsonify({'success': False, 'message': 'No spendings selected'})
+        
+        spending_ids = [int(id) for id in spending_ids]
+        
+        with get_dict_cursor(conn) as cur:
+            placeholders = ','.join(['%s'] * len(spending_ids))
+            cur.execute(f"SELECT SUM(amount) as total FROM spendings WHERE id IN ({placeholders})", spending_ids)
+            total_amount = cur.fetchone()['total'] or 0
+            
+            update_query = f"""
+                UPDATE spendings 
+                SET spended_by=%s, mode=%s, 
+                reason=COALESCE(reason, '') || %s 
+                WHERE id IN ({placeholders})
+            """
+            update_params = [spended_by, mode, f" - Settled on {datetime.now().strftime('%Y-%m-%d')}"] + spending_ids
+            cur.execute(update_query, update_params)
+            
+            conn.commit()
+            
+            return jsonify({
+                'success': True, 
+                'message': f'Settlement processed for {len(spending_ids)} payments totaling ₹{total_amount}'
+            })
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error in process_settlement: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+    finally:
+        conn.close()
+
+# Payments list & add payment (Credit)
+@app.route('/payments', methods=['GET', 'POST'])
+@login_required
+def payments():
+    conn = get_db_conn()
+    payment_rows = []
+    total_credited = 0
+    try:
+        with get_dict_cursor(conn) as cur:
+            if request.method == 'POST':
+                date_str = request.form.get('date')
+                amount = request.form.get('amount')
+                received_from = request.form.get('received_from', '').strip()
+                reason = request.form.get('reason', '').strip()
+
+                if not all([date_str, amount]):
+                    flash('Missing required fields.', 'error')
+                    return redirect(url_for('payments'))
+
+                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+                amount_decimal = Decimal(amount)
+
+                received_from = received_from if received_from else None
+                reason = reason if reason else None
+
+                cur.execute("""
+                    INSERT INTO payments (date, amount, received_from, reason)
+                    VALUES (%s, %s, %s, %s)
+                """, (date_obj, amount_decimal, received_from, reason))
+                flash('Payment recorded successfully!', 'success')
+                return redirect(url_for('payments'))
+
+            cur.execute("SELECT * FROM payments ORDER BY date DESC")
+            payment_rows = cur.fetchall()
+
+            cur.execute("SELECT COALESCE(SUM(amount),0) AS total_credited FROM payments")
+            total_credited = cur.fetchone()['total_credited'] or 0
+
+    except Exception as e:
+        app.logger.error(f"Error in payments route: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    return render_template('payments.html',
+                           payment_rows=payment_rows,
+                           total_credited=float(total_credited),
+                           today=today)
+
+# Delete Payment
+@app.route('/delete_payment/<int:id>', methods=['POST'])
+@login_required
+def delete_payment(id):
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM payments WHERE id = %s", (id,))
+            flash('Payment deleted successfully!', 'success')
+    except Exception as e:
+        app.logger.error(f"Error deleting payment: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('payments'))
+
+# Employee Advances
+@app.route('/employee_advances', methods=['GET', 'POST'])
+@login_required
+def employee_advances():
+    conn = get_db_conn()
+    
+    if request.method == 'POST':
+        try:
+            employee_name = request.form['employee_name']
+            date = request.form['date']
+            amount = request.form['amount']
+            purpose = request.form.get('purpose', '')
+
+            if not employee_name or not date or not amount:
+                flash('Please fill in all required fields.', 'error')
+            else:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO employee_advances 
+                        (employee_name, date, amount, purpose) 
+                        VALUES (%s, %s, %s, %s)
+                    """, (employee_name, date, amount, purpose))
+                    conn.commit()
+                
+                flash(f'Advance added successfully for {employee_name}.', 'success')
+                return redirect(url_for('employee_advances'))
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error adding employee advance: {str(e)}")
+            flash('An error occurred while adding the advance.', 'error')
+    
+    employee_balances = []
+    advances = []
+    streamed = False
+    
+    try:
+        with get_dict_cursor(conn) as cur:
+            # Employee accounts in the journal (same rows as the employee_balance view)
+            employee_balances = journal.employee_balances(cur)
+
+        # All individual advances, read while the page streams
+        advances = fragments.lazy_rows(
+            lambda: get_dict_cursor(conn),
+            "SELECT * FROM employee_advances ORDER BY date DESC",
+            max_rows=config.STREAM_MAX_ROWS
+        )
+        streamed = True
+
+    except Exception as e:
+        logger.error(f"Database error in employee_advances: {e}")
+        flash(f'Error loading employee advances: {str(e)}', 'error')
+        
+    finally:
+        if conn and not streamed:
+            conn.close()
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    
+    return stream_page('employee_advances.html', conn if streamed else None,
+                         advances=advances,
+                         employee_balances=employee_balances,
+                         today=today)
+
+# Hired Vehicles Audit
+@app.route('/hired_vehicles_audit', methods=['GET', 'POST'])
+@login_required
+def hired_vehicles_audit():
+    conn = get_db_conn()
+    hired_vehicles = []
+    recent_transactions = []
+    hired_vehicles_summary = []
+    available_months = []
+    
+    try:
+        with get_dict_cursor(conn) as cur:
+            if request.method == 'POST':
+                action = request.form.get('action')
+                
+                if action == 'add_hired_vehicle':
+                    vehicle_no = request.form.get('vehicle_no').strip()
+                    owner_name = request.form.get('owner_name').strip()
+                    contact_number = request.form.get('contact_number', '').strip()
+                    
+                    cur.execute(
+                        "INSERT INTO hired_vehicles (vehicle_no, owner_name, contact_number) VALUES (%s, %s, %s)",
+                        (vehicle_no, owner_name, contact_number)
+                    )
+                    flash('Hired vehicle added successfully', 'success')
+                    
+                elif action == 'add_transaction':
+                    hired_vehicle_id = request.form.get('hired_vehicle_id')
+                    transaction_type = request.form.get('transaction_type')
+                    transaction_date = datetime.strptime(request.form.get('transaction_date'), '%Y-%m-%d').date()
                     month_year = datetime.strptime(request.form.get('month_year'), '%Y-%m').date().replace(day=1)
+                    amount = request.form.get('amount')
                     description = request.form.get('description', '').strip()
+                    reference_no = request.form.get('reference_no', '').strip()
                     
                     cur.execute("""
-                        INSERT INTO company_payments 
-                        (payment_date, company_name, received_amount, payment_mode, reference_number, month_year, description)
+                        INSERT INTO hired_vehicle_transactions 
+                        (hired_vehicle_id, transaction_type, transaction_date, month_year, amount, description, reference_no)
                         VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """, (payment_date, company_name, received_amount, payment_mode, reference_number, month_year, description))
+                    """, (hired_vehicle_id, transaction_type, transaction_date, month_year, amount, description, reference_no))
                     
-                    flash('Payment recorded successfully', 'success')
+                    flash('Transaction added successfully', 'success')
             
-            # Get recent sales
-            cur.execute("SELECT * FROM company_sales ORDER BY sale_date DESC LIMIT 20")
-            recent_sales = cur.fetchall()
+            available_months = reports.available_months(cur, 'hired_transactions_count')
+
+            # Get all hired vehicles
+            cur.execute("SELECT * FROM hired_vehicles ORDER BY vehicle_no")
+            hired_vehicles = cur.fetchall()
             
-            # Get recent payments
-            cur.execute("SELECT * FROM company_payments ORDER BY payment_date DESC LIMIT 20")
-            recent_payments = cur.fetchall()
-            
-            # Get unique company names
-            cur.execute("SELECT DISTINCT company_name FROM company_sales UNION SELECT DISTINCT company_name FROM company_payments ORDER BY company_name")
-            company_list = [row['company_name'] for row in cur.fetchall()]
+            # Get recent transactions
+            cur.execute("""
+                SELECT t.*, hv.vehicle_no, hv.owner_name 
+                FROM hired_vehicle_transactions t
+                JOIN hired_vehicles hv ON t.hired_vehicle_id = hv.id
+                ORDER BY t.transaction_date DESC, t.created_at DESC
+                LIMIT 50
+            """)
+            recent_transactions = cur.fetchall()
             
-            # Get company-wise summary
-            for company in company_list:
-                cur.execute("SELECT SUM(sale_amount) as total_sales FROM company_sales WHERE company_name = %s", (company,))
-                sales_result = cur.fetchone()
-                total_sales = sales_result['total_sales'] or 0
-                
-                cur.execute("SELECT SUM(received_amount) as total_received FROM company_payments WHERE company_name = %s", (company,))
-                payments_result = cur.fetchone()
-                total_received = payments_result['total_received'] or 0
+            # Get summary for all hired vehicles
+            for vehicle in hired_vehicles:
+                cur.execute("""
+                    SELECT 
+                        SUM(CASE WHEN transaction_type = 'sale' THEN amount ELSE 0 END) as total_sales,
+                        SUM(CASE WHEN transaction_type = 'payment' THEN amount ELSE 0 END) as total_payments
+                    FROM hired_vehicle_transactions 
+                    WHERE hired_vehicle_id = %s
+                """, (vehicle['id'],))
+                summary = cur.fetchone()
                 
-                cur.execute("SELECT MAX(sale_date) as last_sale_date FROM company_sales WHERE company_name = %s", (company,))
-                last_sale = cur.fetchone()
+                hired_vehicles_summary.append({
+                    'id': vehicle['id'],
+                    'vehicle_no': vehicle['vehicle_no'],
+                    'owner_name': vehicle['owner_name'],
+                    'total_sales': float(summary['total_sales'] or 0),
+                    'total_payments': float(summary['total_payments'] or 0)
+                })
                 
-                cur.execute("SELECT MAX(payment_date) as last_payment_date FROM company_payments WHERE company_name = %s", (company,))
-                last_payment = cur.fetchone()
+    except Exception as e:
+        app.logger.error(f"Error in hired_vehicles_audit: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        conn.close()
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    current_month = datetime.now().strftime('%Y-%m')
+    
+    return render_template('hired_vehicles_audit.html',
+                         hired_vehicles=hired_vehicles,
+                         recent_transactions=recent_transactions,
+                         hired_vehicles_summary=hired_vehicles_summary,
+                         today=today,
+                         current_month=current_month,
+                         available_months=available_months)
+
+def _company_summary_row(row):
+    total_sales = row['total_sales'] or 0
+    total_received = row['total_received'] or 0
+    return {
+        'company_name': row['company_name'],
+        'total_sales': float(total_sales),
+        'total_received': float(total_received),
+        'pending_amount': float(total_sales - total_received),
+        'last_sale_date': row['last_sale_date'].strftime('%Y-%m-%d') if row['last_sale_date'] else None,
+        'last_payment_date': row['last_payment_date'].strftime('%Y-%m-%d') if row['last_payment_date'] else None
+    }
+
+# Company Audit
+@app.route('/company_audit', methods=['GET', 'POST'])
+@login_required
+def company_audit():
+    conn = get_db_conn()
+    recent_sales = []
+    recent_payments = []
+    company_summary = []
+    company_list = []
+    totals = {
+        'total_sales': 0,
+        'total_received': 0,
+        'pending_amount': 0,
+        'total_companies': 0
+    }
+    available_months = []
+    streamed = False
+    
+    try:
+        with get_dict_cursor(conn) as cur:
+            if request.method == 'POST':
+                action = request.form.get('action')
                 
-                company_summary.append({
-                    'company_name': company,
-                    'total_sales': float(total_sales),
-                    'total_received': float(total_received),
-                    'pending_amount': float(total_sales - total_received),
-                    'last_sale_date': last_sale['last_sale_date'].strftime('%Y-%m-%d') if last_sale['last_sale_date'] else None,
-                    'last_payment_date': last_payment['last_payment_date'].strftime('%Y-%m-%d') if last_payment['last_payment_date'] else None
-                })
+                if action == 'add_sale':
+                    sale_date = datetime.strptime(request.form.get('sale_date'), '%Y-%m-%d').date()
+                    company_name = request.form.get('company_name').strip()
+                    invoice_number = request.form.get('invoice_number', '').strip()
+                    sale_amount = request.form.get('sale_amount')
+                    month_year = datetime.strptime(request.form.get('month_year'), '%Y-%m').date().replace(day=1)
+                    description = request.form.get('description', '').strip()
+                    
+                    cur.execute("""
+                        INSERT INTO company_sales 
+                        (sale_date, company_name, invoice_number, sale_amount, month_year, description)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """, (sale_date, company_name, invoice_number, sale_amount, month_year, description))
+                    
+                    flash('Sale recorded successfully', 'success')
+                    
+                elif action == 'add_payment':
+                    payment_date = datetime.strptime(request.form.get('payment_date'), '%Y-%m-%d').date()
+                    company_name = request.form.get('company_name').strip()
+                    if company_name == '_new':
+                        company_name = request.form.get('new_company_name').strip()
+                    received_amount = request.form.get('received_amount')
+                    payment_mode = request.form.get('payment_mode')
+                    reference_number = request.form.get('reference_number', '').strip()
+                    month_year = datetime.strptime(request.form.get('month_year'), '%Y-%m').date().replace(day=1)
+                    description = request.form.get('description', '').strip()
+                    
+                    cur.execute("""
+                        INSERT INTO company_payments 
+                        (payment_date, company_name, received_amount, payment_mode, reference_number, month_year, description)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, (payment_date, company_name, received_amount, payment_mode, reference_number, month_year, description))
+                    
+                    flash('Payment recorded successfully', 'success')
             
+            # Get recent sales
+            cur.execute("SELECT * FROM company_sales ORDER BY sale_date DESC LIMIT 20")
+            recent_sales = cur.fetchall()
+            
+            # Get recent payments
+            cur.execute("SELECT * FROM company_payments ORDER BY payment_date DESC LIMIT 20")
+            recent_payments = cur.fetchall()
+            
+            # Get unique company names
+            cur.execute("SELECT DISTINCT company_name FROM company_sales UNION SELECT DISTINCT company_name FROM company_payments ORDER BY company_name")
+            company_list = [row['company_name'] for row in cur.fetchall()]
+            
+            available_months = reports.available_months(cur, 'company_sales_count', 'company_payments_count')
+
             # Get overall totals
             cur.execute("SELECT SUM(sale_amount) as total_sales FROM company_sales")
             totals['total_sales'] = float(cur.fetchone()['total_sales'] or 0)
@@ -1014,170 +2950,891 @@ def company_audit():
             
             totals['pending_amount'] = totals['total_sales'] - totals['total_received']
             totals['total_companies'] = len(company_list)
+
+        # Company-wise summary in one grouped pass, read while the page streams
+        company_summary = fragments.lazy_rows(lambda: get_dict_cursor(conn), """
+            WITH sales AS (
+                SELECT company_name, SUM(sale_amount) AS total_sales, MAX(sale_date) AS last_sale_date
+                FROM company_sales GROUP BY company_name
+            ),
+            received AS (
+                SELECT company_name, SUM(received_amount) AS total_received, MAX(payment_date) AS last_payment_date
+                FROM company_payments GROUP BY company_name
+            )
+            SELECT company_name, s.total_sales, r.total_received, s.last_sale_date, r.last_payment_date
+            FROM sales s
+            FULL JOIN received r USING (company_name)
+            ORDER BY company_name
+        """, transform=_company_summary_row, max_rows=config.STREAM_MAX_ROWS)
+        streamed = True
                 
     except Exception as e:
-        app.logger.error(f"Error in company_audit: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
+        app.logger.error(f"Error in company_audit: {str(e)}")
+        flash(f'An error occurred: {str(e)}', 'error')
+    finally:
+        if not streamed:
+            conn.close()
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    current_month = datetime.now().strftime('%Y-%m')
+    
+    return stream_page('company_audit.html', conn if streamed else None,
+                         recent_sales=recent_sales,
+                         recent_payments=recent_payments,
+                         company_summary=company_summary,
+                         company_list=company_list,
+                         totals=totals,
+                         today=today,
+                         current_month=current_month,
+                         available_months=available_months)
+
+# Export data to CSV
+@app.route('/export/<data_type>')
+@login_required
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
+def export_data(data_type):
+    if data_type not in reports.EXPORT_QUERIES:
+        return "Invalid data type", 400
+    conn = get_db_conn()
+    try:
+        sql, filename = reports.EXPORT_QUERIES[data_type]
+        with get_dict_cursor(conn) as cur:
+            cur.execute(sql)
+            data = cur.fetchall()
+
+        response = app.response_class(
+            response=reports.rows_to_csv(data),
+            status=200,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment;filename={filename}'}
+        )
+        return response
+
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error exporting data: {e}")
+        return "Error exporting data", 500
+    finally:
+        conn.close()
+
+# Vehicle monthly spendings (AJAX fetch)
+@app.route('/vehicle_spendings/<int:vehicle_id>')
+@login_required
+def vehicle_spendings(vehicle_id):
+    month = request.args.get('month')
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            q = "SELECT * FROM spendings WHERE vehicle_id=%s"
+            params = [vehicle_id]
+            if month:
+                q += " AND TO_CHAR(expense_month,'YYYY-MM')=%s"
+                params.append(month)
+            q += " ORDER BY date DESC"
+            cur.execute(q, params)
+            rows = cur.fetchall()
+    except Exception as e:
+        app.logger.error(f"Error in vehicle_spendings: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    
+    # Convert to serializable format
+    serializable_rows = []
+    for row in rows:
+        row_dict = dict(row)
+        # Convert date objects to strings
+        for key, value in row_dict.items():
+            if hasattr(value, 'strftime'):
+                row_dict[key] = value.strftime('%Y-%m-%d')
+            elif isinstance(value, Decimal):
+                row_dict[key] = float(value)
+        serializable_rows.append(row_dict)
+    
+    return jsonify(serializable_rows)
+
+# API: Overall monthly expenses
+@app.route('/api/overall_monthly_expenses')
+@login_required
+def overall_monthly_expenses():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            cur.execute("""
+                SELECT 
+                    expense_month,
+                    SUM(amount) as total_monthly_expense
+                FROM spendings
+                WHERE spended_by IS NOT NULL AND mode IS NOT NULL
+                GROUP BY expense_month
+                ORDER BY expense_month DESC
+            """)
+            
+            results = cur.fetchall()
+            for result in results:
+                if result['expense_month']:
+                    result['expense_month'] = result['expense_month'].strftime('%Y-%m')
+                if 'total_monthly_expense' in result:
+                    result['total_monthly_expense'] = float(result['total_monthly_expense'])
+                    
+            return jsonify(results)
+            
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in overall_monthly_expenses: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Pivot spendings / payments / advances over any combination of dimensions
+# e.g. /api/pivot?source=spendings&rows=vehicle,month&columns=category&agg=sum
+@app.route('/api/pivot')
+@login_required
+def api_pivot():
+    try:
+        rows = [d.strip() for d in request.args.get('rows', '').split(',') if d.strip()]
+        columns = [d.strip() for d in request.args.get('columns', '').split(',') if d.strip()]
+        result = tenant_ledger_frames().pivot(
+            request.args.get('source', 'spendings'),
+            rows,
+            columns,
+            agg=request.args.get('agg', 'sum'),
+            month_from=request.args.get('month_from'),
+            month_to=request.args.get('month_to')
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_pivot: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# API: Filtered / sorted / paginated spendings with totals for the filtered set
+@app.route('/api/spendings/query')
+@login_required
+def api_spendings_query():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            return jsonify(spending_filters.query_spendings(cur, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_spendings_query: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Bulk ingest of spendings from external feeds (fuel cards, driver app)
+ingest_api_keys = ingest.parse_api_keys(config.INGEST_API_KEYS)
+
+@app.route('/api/ingest/spendings', methods=['POST'])
+def api_ingest_spendings():
+    # Feeds authenticate with their own key instead of a login session; the
+    # key also names the tenant the feed writes to
+    feed = ingest_api_keys.get(request.headers.get('X-API-Key', ''))
+    if feed is None:
+        return jsonify({'error': 'Invalid or missing API key'}), 401
+    tenant_code, source = feed
+    g.tenant_id = tenant_id_for(tenant_code)
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': "Body must be a JSON object with an 'items' list"}), 400
+    if len(items) > config.INGEST_MAX_BATCH:
+        return jsonify({'error': f"At most {config.INGEST_MAX_BATCH} items per request"}), 413
+
+    conn = get_db_conn(primary=True)
+    try:
+        # One transaction per batch: a failure leaves nothing half-inserted and
+        # the feed can simply resend
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            results = ingest.ingest_spendings(cur, source, items)
+        conn.commit()
+        counts = {status: 0 for status in ('accepted', 'duplicate', 'rejected')}
+        for result in results:
+            counts[result['status']] += 1
+        app.logger.info(f"Ingested spendings from {source}: {counts}")
+        return jsonify({'source': source, **counts, 'items': results})
+    except db.QUERY_LIMIT_ERRORS:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error in api_ingest_spendings: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Background jobs: heavy reports and exports run by `flask run-jobs` workers
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+def api_jobs():
+    """GET: the current user's recent jobs. POST {kind, params}: submit a job
+    (returns the identical queued/running job if there is one)."""
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            if request.method == 'POST':
+                data = request.get_json(silent=True) or {}
+                job, created = jobs.submit(cur, data.get('kind'), data.get('params') or {},
+                                           session.get('username'))
+                return jsonify({'job': job, 'created': created}), 202
+            return jsonify({'jobs': jobs.recent(cur, session.get('username'))})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_jobs: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    # Status changes constantly; a lagging replica would show stale progress
+    conn = get_db_conn(primary=True)
+    try:
+        with get_dict_cursor(conn) as cur:
+            job = jobs.get(cur, job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if job['status'] == 'done':
+            job['download_url'] = url_for('download_job_result', job_id=job_id)
+        return jsonify({'job': job})
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_job_status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job_result(job_id):
+    conn = get_db_conn(primary=True)
+    try:
+        with get_dict_cursor(conn) as cur:
+            job = jobs.get(cur, job_id)
+    finally:
+        conn.close()
+    if job is None or job['status'] != 'done':
+        return "Result not available", 404
+    path = jobs.result_path(config.JOB_RESULTS_DIR, job_id)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype='text/csv',
+                               as_attachment=True,
+                               download_name=secure_filename(job['filename'] or '') or f'job_{job_id}.csv')
+
+# Statement reconciliation: import a bank / fuel-card CSV and match it to spendings
+@app.route('/api/reconciliation/import', methods=['POST'])
+@login_required
+def api_reconciliation_import():
+    conn = get_db_conn()
+    try:
+        upload = request.files.get('file')
+        if upload is None:
+            raise ValueError("Upload the statement as 'file'")
+        lines = reconcile.parse_statement(upload.read().decode('utf-8-sig'))
+        source = request.form.get('source', '').strip() or 'bank'
+        mode = request.form.get('mode', '').strip() or None
+        window_days = int(request.form.get('window_days', 3))
+
+        conn.autocommit = False
+        with get_dict_cursor(conn) as cur:
+            import_id = reconcile.import_statement(cur, source, secure_filename(upload.filename or ''), mode, lines)
+            proposed = reconcile.reconcile_import(cur, import_id, window_days)
+        conn.commit()
+        return jsonify({'import_id': import_id, 'lines': len(lines), 'proposed': proposed})
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error in api_reconciliation_import: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/reconciliation/<int:import_id>', methods=['GET', 'POST'])
+@login_required
+def api_reconciliation(import_id):
+    """GET: lines with their proposals. POST: re-run matching for unmatched lines."""
+    conn = get_db_conn(primary=request.method == 'POST')
+    try:
+        with get_dict_cursor(conn) as cur:
+            if request.method == 'POST':
+                data = request.get_json(silent=True) or {}
+                reconcile.reconcile_import(cur, import_id, int(data.get('window_days', 3)))
+            return jsonify({'import_id': import_id, 'lines': reconcile.import_summary(cur, import_id)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_reconciliation: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/reconciliation/confirm', methods=['POST'])
+@login_required
+def api_reconciliation_confirm():
+    """Confirm (or reject) proposals in bulk. Unpaid spendings in confirmed
+    matches are settled like process_settlement when spended_by/mode are given."""
+    conn = get_db_conn()
+    try:
+        data = request.get_json(silent=True) or {}
+        match_ids = [int(i) for i in data.get('match_ids', [])]
+        reject_ids = [int(i) for i in data.get('reject_ids', [])]
+        conn.autocommit = False
+        with get_dict_cursor(conn) as cur:
+            confirmed = reconcile.confirm_matches(cur, match_ids, data.get('spended_by'), data.get('mode'))
+            rejected = reconcile.reject_matches(cur, reject_ids) if reject_ids else 0
+        conn.commit()
+        return jsonify({'success': True, 'confirmed': confirmed, 'rejected': rejected,
+                        'skipped': len(match_ids) - confirmed})
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error in api_reconciliation_confirm: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Search across spendings, hired vehicle transactions and company sales/payments
+@app.route('/api/search')
+@login_required
+def api_search():
+    conn = get_db_conn()
+    try:
+        entities = [e.strip() for e in request.args.get('entity', '').split(',') if e.strip()]
+        with get_dict_cursor(conn) as cur:
+            result = search.search_ledger(
+                cur,
+                request.args.get('q', ''),
+                page=request.args.get('page', 1),
+                per_page=request.args.get('per_page', 25),
+                entities=entities or None
+            )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Live updates: Server-Sent Events stream of ledger change notifications
+@app.route('/events')
+@login_required
+def events():
+    ledger_listener.start()
+    client = event_broadcaster.register(g.tenant_id)
+    return app.response_class(
+        event_broadcaster.stream(client),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# API: Dashboard / incoming totals for in-place updates
+@app.route('/api/live_totals')
+@login_required
+def api_live_totals():
+    conn = get_db_conn()
+    try:
+        current_month = datetime.now().strftime('%Y-%m-01')
+        prev_month = (datetime.now().replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-01')
+        with get_dict_cursor(conn) as cur:
+            # Ledger balances are single-row journal lookups
+            ledger = journal.ledger_totals(cur)
+            ledger_replica = ledger_replica_for(g.tenant_id)
+            if config.LEDGER_REPLICA_ENABLED and ledger_replica.ready:
+                current_month_total = ledger_replica.month_total(current_month)
+                prev_month_total = ledger_replica.month_total(prev_month)
+                vehicle_totals = ledger_replica.vehicle_totals()
+            else:
+                cur.execute("""
+                    SELECT
+                        COALESCE(SUM(amount) FILTER (WHERE expense_month = %s),0) AS current_month,
+                        COALESCE(SUM(amount) FILTER (WHERE expense_month = %s),0) AS prev_month
+                    FROM spendings
+                """, (current_month, prev_month))
+                row = cur.fetchone()
+                current_month_total, prev_month_total = row['current_month'], row['prev_month']
+                cur.execute("SELECT vehicle_id, SUM(amount) AS total FROM spendings WHERE vehicle_id IS NOT NULL GROUP BY vehicle_id")
+                vehicle_totals = {r['vehicle_id']: r['total'] for r in cur.fetchall()}
+
+        credited, debited, unpaid = ledger['credited'], ledger['debited'], ledger['unpaid']
+        tsr_spent = ledger['spent_by']['TSR']
+        msr_spent = ledger['spent_by']['MSR']
+        return jsonify({
+            'credited': credited,
+            'debited': debited,
+            'balance': ledger['balance'],
+            'debited_paid': debited,
+            'balance_paid': ledger['balance'],
+            'spent': debited,
+            'unpaid': unpaid,
+            'tsr_spent': tsr_spent,
+            'msr_spent': msr_spent,
+            'tsr_balance': credited - tsr_spent,
+            'msr_balance': credited - msr_spent,
+            'current_month': float(current_month_total),
+            'prev_month': float(prev_month_total),
+            'vehicles': {str(vid): float(total) for vid, total in vehicle_totals.items()}
+        })
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_live_totals: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Compare the in-memory ledger replica against the database
+@app.route('/api/replica/check')
+@login_required
+def api_replica_check():
+    try:
+        ledger_replica = ledger_replica_for(g.tenant_id)
+        if not ledger_replica.ready:
+            return jsonify({'ready': False, 'consistent': None, 'mismatches': []})
+        result = ledger_replica.verify()
+        if not result['consistent']:
+            app.logger.warning(f"Ledger replica mismatch: {result['mismatches']}")
+        return jsonify(result)
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_replica_check: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# API: Journal account balances, by exact account(s) or account prefix;
+# ?as_of=YYYY-MM-DD gives the balances at the end of that day
+@app.route('/api/journal/balances')
+@login_required
+def api_journal_balances():
+    conn = get_db_conn()
+    try:
+        as_of = reports.parse_date(request.args.get('as_of'))
+        with get_dict_cursor(conn) as cur:
+            accounts = request.args.getlist('account')
+            if as_of:
+                rows = journal.balances_as_of(cur, as_of, accounts=accounts,
+                                              prefix=None if accounts else request.args.get('prefix', ''))
+            elif accounts:
+                rows = list(journal.balances(cur, *accounts).values())
+            else:
+                rows = journal.balances_with_prefix(cur, request.args.get('prefix', ''))
+        return jsonify({'as_of': as_of.isoformat() if as_of else None, 'accounts': rows})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_journal_balances: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Check every journal entry balances and stored balances match the postings
+@app.route('/api/journal/verify')
+@login_required
+def api_journal_verify():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            result = journal.verify(cur)
+        if not result['consistent']:
+            app.logger.warning(f"Journal inconsistency: {result}")
+        return jsonify(result)
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_journal_verify: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Read replica health and lag as seen by the router
+@app.route('/api/db/replicas')
+@login_required
+def api_db_replicas():
+    return jsonify({
+        'replicas': db_router.status(),
+        'pinned_to_primary': session.get('db_pinned_until', 0) >= time.time(),
+    })
+
+def _vehicle_pnl_args():
+    vehicle_ids = request.args.get('vehicle_id', '')
+    return {
+        'month_from': reports.parse_month(request.args.get('from')),
+        'month_to': reports.parse_month(request.args.get('to')),
+        'vehicle_ids': [int(v) for v in vehicle_ids.split(',') if v.strip()] or None,
+    }
+
+# Vehicle P&L: revenue vs cost per vehicle per month with trailing-12-month totals
+@app.route('/api/reports/vehicle_pnl')
+@login_required
+def api_vehicle_pnl():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            rows = reports.vehicle_pnl(cur, **_vehicle_pnl_args())
+        return jsonify({'rows': rows})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_vehicle_pnl: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/export/vehicle_pnl')
+@login_required
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
+def export_vehicle_pnl():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            rows = reports.vehicle_pnl(cur, **_vehicle_pnl_args())
+
+        output = StringIO()
+        if rows:
+            writer = csv.DictWriter(output, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
+
+        return app.response_class(
+            response=output.getvalue(),
+            status=200,
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment;filename=vehicle_pnl.csv'}
+        )
+    except ValueError as e:
+        return str(e), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error exporting vehicle P&L: {e}")
+        return "Error exporting data", 500
+    finally:
+        conn.close()
+
+# Receivables aging: outstanding company_sales per company by age bucket
+@app.route('/api/reports/receivables_aging')
+@login_required
+def api_receivables_aging():
+    # Reads refresh receivable_open_items, so they must run on the primary
+    conn = get_db_conn(primary=True)
+    try:
+        with get_dict_cursor(conn) as cur:
+            companies = reports.receivables_aging(cur)
+        return jsonify({'companies': companies})
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_receivables_aging: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/reports/receivables_aging/<path:company_name>')
+@login_required
+def api_receivables_invoices(company_name):
+    # Reads refresh receivable_open_items, so they must run on the primary
+    conn = get_db_conn(primary=True)
+    try:
+        with get_dict_cursor(conn) as cur:
+            invoices = reports.unpaid_invoices(cur, company_name)
+        return jsonify({'company_name': company_name, 'invoices': invoices})
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_receivables_invoices: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Employee statement: advances and spendings paid by an employee, with running balance
+@app.route('/api/employee_statement/<path:employee_name>')
+@login_required
+def api_employee_statement(employee_name):
+    conn = get_db_conn()
+    try:
+        date_from = reports.parse_date(request.args.get('from'))
+        date_to = reports.parse_date(request.args.get('to'))
+        with get_dict_cursor(conn) as cur:
+            statement = reports.employee_statement(cur, employee_name, date_from, date_to)
+        return jsonify(statement)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_employee_statement: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/export/employee_statement/<path:employee_name>')
+@login_required
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
+def export_employee_statement(employee_name):
+    try:
+        date_from = reports.parse_date(request.args.get('from'))
+        date_to = reports.parse_date(request.args.get('to'))
+    except ValueError as e:
+        return str(e), 400
+    # The generator owns the connection and closes it once the CSV is sent
+    conn = get_db_conn()
+    filename = f"statement_{secure_filename(employee_name) or 'employee'}.csv"
+    return app.response_class(
+        reports.iter_employee_statement_csv(conn, employee_name, date_from, date_to),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment;filename={filename}'}
+    )
+
+# Change-data-capture: NDJSON stream of changes after ?since=<seq>. Sync tools
+# may authenticate with an X-API-Key from CHANGES_API_KEYS instead of a session;
+# the key decides the tenant whose changes are read.
+changes_api_keys = dict((key, code) for code, key in map(tenants.parse_scoped, config.CHANGES_API_KEYS))
+
+@app.route('/api/changes')
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
+def api_changes():
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in changes_api_keys:
+        g.tenant_id = tenant_id_for(changes_api_keys[api_key])
+    elif 'user_id' not in session:
+        return jsonify({'error': 'Login or a valid API key required'}), 401
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', config.CHANGES_MAX_LIMIT)), config.CHANGES_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    tables = request.args.getlist('table')
+    unknown = [t for t in tables if t not in CHANGE_TABLES]
+    if unknown:
+        return jsonify({'error': f"Unknown table: {', '.join(unknown)}"}), 400
+
+    # Publishing writes, so this always runs on the primary
+    conn = get_db_conn(primary=True)
+    try:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            head = changes.publish(cur)
+            changes.check_since(cur, since)
+        conn.commit()
+    except changes.ChangesPruned as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 410
+    except db.QUERY_LIMIT_ERRORS:
+        conn.rollback()
+        conn.close()
+        raise
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        app.logger.error(f"Error in api_changes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    # The generator owns the connection from here
+    return app.response_class(
+        changes.iter_changes_ndjson(conn, since, tables, limit),
+        mimetype='application/x-ndjson',
+        headers={'X-Changes-Head': str(head)}
+    )
+
+# API: Flagged (outlier or duplicate) spendings; ?month=YYYY-MM, ?reviewed=1
+@app.route('/api/anomalies')
+@login_required
+def api_anomalies():
+    conn = get_db_conn()
+    try:
+        month = reports.parse_month(request.args.get('month'))
+        with get_dict_cursor(conn) as cur:
+            rows = anomalies.flagged(cur, month, request.args.get('reviewed') == '1')
+        return jsonify({'anomalies': rows})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_anomalies: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/anomalies/<int:spending_id>/review', methods=['POST'])
+@login_required
+def api_anomaly_review(spending_id):
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            anomalies.review(cur, spending_id, session.get('username'))
+        return jsonify({'success': True})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_anomaly_review: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# API: Fuel efficiency (diesel fills with litres and odometer)
+@app.route('/api/fuel/efficiency/<int:vehicle_id>')
+@login_required
+def api_fuel_efficiency(vehicle_id):
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            series = fuel.vehicle_series(cur, vehicle_id, int(request.args.get('limit', 100)))
+        return jsonify({'vehicle_id': vehicle_id, 'fills': series})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_fuel_efficiency: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/fuel/ranking')
+@login_required
+def api_fuel_ranking():
+    conn = get_db_conn()
+    try:
+        days = int(request.args.get('days', config.FUEL_RANKING_DAYS))
+        with get_dict_cursor(conn) as cur:
+            ranking = fuel.ranking(cur, days)
+        return jsonify({'days': days, 'ranking': ranking})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_fuel_ranking: {str(e)}")
+        return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    current_month = datetime.now().strftime('%Y-%m')
-    
-    return render_template('company_audit.html',
-                         recent_sales=recent_sales,
-                         recent_payments=recent_payments,
-                         company_summary=company_summary,
-                         company_list=company_list,
-                         totals=totals,
-                         today=today,
-                         current_month=current_month)
 
-# Export data to CSV
-@app.route('/export/<data_type>')
+@app.route('/api/fuel/alerts')
 @login_required
-def export_data(data_type):
+def api_fuel_alerts():
     conn = get_db_conn()
     try:
         with get_dict_cursor(conn) as cur:
-            if data_type == 'paid_spendings':
-                cur.execute("""
-                    SELECT s.date, v.vehicle_no, s.category, s.reason, s.amount, s.spended_by, s.mode 
-                    FROM spendings s 
-                    JOIN vehicles v ON s.vehicle_id = v.id 
-                    WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
-                    ORDER BY s.date DESC
-                """)
-                data = cur.fetchall()
-                filename = 'paid_spendings.csv'
-                
-            elif data_type == 'unpaid_spendings':
-                cur.execute("""
-                    SELECT s.date, v.vehicle_no, s.category, s.reason, s.amount 
-                    FROM spendings s 
-                    JOIN vehicles v ON s.vehicle_id = v.id 
-                    WHERE s.spended_by IS NULL OR s.mode IS NULL
-                    ORDER BY s.date DESC
-                """)
-                data = cur.fetchall()
-                filename = 'unpaid_spendings.csv'
-                
-            elif data_type == 'payments':
-                cur.execute("""
-                    SELECT p.date, p.received_from as company_name, p.amount, p.reason
-                    FROM payments p 
-                    ORDER BY p.date DESC
-                """)
-                data = cur.fetchall()
-                filename = 'payments.csv'
-                
-            elif data_type == 'vehicles':
-                cur.execute("SELECT vehicle_no, owner_name, contact_number, created_at FROM vehicles ORDER BY vehicle_no")
-                data = cur.fetchall()
-                filename = 'vehicles.csv'
-                
-            elif data_type == 'monthly_expenses':
-                cur.execute("""
-                    SELECT 
-                        TO_CHAR(expense_month, 'YYYY-MM') as month,
-                        v.vehicle_no,
-                        SUM(s.amount) as total_expense
-                    FROM spendings s
-                    JOIN vehicles v ON s.vehicle_id = v.id
-                    WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
-                    GROUP BY expense_month, v.vehicle_no
-                    ORDER BY expense_month DESC, total_expense DESC
-                """)
-                data = cur.fetchall()
-                filename = 'monthly_expenses.csv'
-                
-            else:
-                return "Invalid data type", 400
-            
-            output = StringIO()
-            if data:
-                writer = csv.DictWriter(output, fieldnames=data[0].keys())
-                writer.writeheader()
-                writer.writerows(data)
-            
-            response = app.response_class(
-                response=output.getvalue(),
-                status=200,
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment;filename={filename}'}
-            )
-            return response
-            
+            alerts = fuel.degradation_alerts(cur, config.FUEL_ALERT_RECENT_FILLS,
+                                             config.FUEL_ALERT_BASELINE_FILLS, config.FUEL_ALERT_DROP_PCT)
+        return jsonify({'alerts': alerts})
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
-        app.logger.error(f"Error exporting data: {e}")
-        return "Error exporting data", 500
+        app.logger.error(f"Error in api_fuel_alerts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
 
-# Vehicle monthly spendings (AJAX fetch)
-@app.route('/vehicle_spendings/<int:vehicle_id>')
+# Periods: months with per-table row counts and open/closed status
+@app.route('/api/periods')
 @login_required
-def vehicle_spendings(vehicle_id):
-    month = request.args.get('month')
+def api_periods():
     conn = get_db_conn()
     try:
         with get_dict_cursor(conn) as cur:
-            q = "SELECT * FROM spendings WHERE vehicle_id=%s"
-            params = [vehicle_id]
-            if month:
-                q += " AND TO_CHAR(expense_month,'YYYY-MM')=%s"
-                params.append(month)
-            q += " ORDER BY date DESC"
-            cur.execute(q, params)
-            rows = cur.fetchall()
+            periods = reports.list_periods(cur)
+        return jsonify({'periods': periods})
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
-        app.logger.error(f"Error in vehicle_spendings: {str(e)}")
+        app.logger.error(f"Error in api_periods: {str(e)}")
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
-    
-    # Convert to serializable format
-    serializable_rows = []
-    for row in rows:
-        row_dict = dict(row)
-        # Convert date objects to strings
-        for key, value in row_dict.items():
-            if hasattr(value, 'strftime'):
-                row_dict[key] = value.strftime('%Y-%m-%d')
-            elif isinstance(value, Decimal):
-                row_dict[key] = float(value)
-        serializable_rows.append(row_dict)
-    
-    return jsonify(serializable_rows)
 
-# API: Overall monthly expenses
-@app.route('/api/overall_monthly_expenses')
+@app.route('/api/periods/<month>/status', methods=['POST'])
 @login_required
-def overall_monthly_expenses():
+def api_period_status(month):
     conn = get_db_conn()
     try:
+        data = request.get_json(silent=True) or request.form
+        month_date = reports.parse_month(month)
+        status = data.get('status')
+        if status not in ('open', 'closed'):
+            raise ValueError("status must be 'open' or 'closed'")
+        # Closing snapshots and locks the month in one transaction
+        conn.autocommit = False
         with get_dict_cursor(conn) as cur:
-            cur.execute("""
-                SELECT 
-                    expense_month,
-                    SUM(amount) as total_monthly_expense
-                FROM spendings
-                WHERE spended_by IS NOT NULL AND mode IS NOT NULL
-                GROUP BY expense_month
-                ORDER BY expense_month DESC
-            """)
-            
-            results = cur.fetchall()
-            for result in results:
-                if result['expense_month']:
-                    result['expense_month'] = result['expense_month'].strftime('%Y-%m')
-                if 'total_monthly_expense' in result:
-                    result['total_monthly_expense'] = float(result['total_monthly_expense'])
-                    
-            return jsonify(results)
-            
+            if status == 'closed':
+                force = str(data.get('force', '')).lower() in ('1', 'true', 'yes')
+                month_close.close_month(cur, month_date, session.get('username'), force)
+            else:
+                month_close.reopen_month(cur, month_date)
+        conn.commit()
+        return jsonify({'success': True})
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        conn.rollback()
+        raise
     except Exception as e:
-        app.logger.error(f"Error in overall_monthly_expenses: {str(e)}")
+        conn.rollback()
+        app.logger.error(f"Error in api_period_status: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        conn.close()
+
+# Month-over-month comparison of spendings per vehicle and category
+@app.route('/api/reports/month_comparison')
+@login_required
+def api_month_comparison():
+    conn = get_db_conn()
+    try:
+        with get_dict_cursor(conn) as cur:
+            result = reports.month_comparison(
+                cur,
+                reports.parse_month(request.args.get('from')),
+                reports.parse_month(request.args.get('to'))
+            )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except db.QUERY_LIMIT_ERRORS:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error in api_month_comparison: {str(e)}")
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
@@ -1238,7 +3895,8 @@ def monthly_report():
     conn = get_db_conn()
     try:
         month = request.args.get('month', datetime.now().strftime('%Y-%m'))
-        with get_dict_cursor(conn) as cur:
+        # One snapshot so the separate totals agree with each other
+        with db.snapshot(conn), get_dict_cursor(conn) as cur:
             cur.execute("""
                 SELECT s.*, v.vehicle_no 
                 FROM spendings s 
@@ -1248,20 +3906,18 @@ def monthly_report():
             """, (datetime.strptime(month, '%Y-%m').date().replace(day=1),))
             spendings = cur.fetchall()
             
-            cur.execute("""
-                SELECT COALESCE(SUM(amount),0) as total 
-                FROM spendings 
-                WHERE expense_month = %s
-            """, (datetime.strptime(month, '%Y-%m').date().replace(day=1),))
-            total = cur.fetchone()['total']
+            month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
+            if month_close.is_closed(cur, month_date):
+                total = month_close.month_total(cur, month_date)
+            else:
+                cur.execute("""
+                    SELECT COALESCE(SUM(amount),0) as total 
+                    FROM spendings 
+                    WHERE expense_month = %s
+                """, (month_date,))
+                total = cur.fetchone()['total']
             
-            cur.execute("""
-                SELECT DISTINCT expense_month 
-                FROM spendings 
-                WHERE expense_month IS NOT NULL 
-                ORDER BY expense_month DESC
-            """)
-            available_months = [m['expense_month'].strftime('%Y-%m') for m in cur.fetchall()]
+            available_months = reports.available_months(cur, 'spendings_count')
             
     except Exception as e:
         app.logger.error(f"Error in monthly_report: {str(e)}")
@@ -1285,19 +3941,22 @@ def monthly_vehicle_expenses(month):
         with get_dict_cursor(conn) as cur:
             month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
             
-            cur.execute("""
-                SELECT 
-                    v.vehicle_no,
-                    s.expense_month,
-                    SUM(s.amount) as monthly_total
-                FROM spendings s
-                JOIN vehicles v ON s.vehicle_id = v.id
-                WHERE s.expense_month = %s
-                GROUP BY v.vehicle_no, s.expense_month
-                ORDER BY monthly_total DESC
-            """, (month_date,))
-            
-            results = cur.fetchall()
+            if month_close.is_closed(cur, month_date):
+                results = month_close.vehicle_totals(cur, month_date)
+            else:
+                cur.execute("""
+                    SELECT 
+                        v.vehicle_no,
+                        s.expense_month,
+                        SUM(s.amount) as monthly_total
+                    FROM spendings s
+                    JOIN vehicles v ON s.vehicle_id = v.id
+                    WHERE s.expense_month = %s
+                    GROUP BY v.vehicle_no, s.expense_month
+                    ORDER BY monthly_total DESC
+                """, (month_date,))
+                
+                results = cur.fetchall()
             for result in results:
                 result['expense_month'] = result['expense_month'].strftime('%Y-%m')
                 if 'monthly_total' in result:
@@ -1305,6 +3964,8 @@ def monthly_vehicle_expenses(month):
                     
             return jsonify(results)
             
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
         app.logger.error(f"Error in monthly_vehicle_expenses: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -1318,7 +3979,7 @@ def get_spending(id):
     conn = get_db_conn()
     try:
         with get_dict_cursor(conn) as cur:
-            cur.execute("SELECT * FROM spendings WHERE id=%s", (id,))
+            cur.execute("SELECT s.*, v.vehicle_no FROM spendings s LEFT JOIN vehicles v ON s.vehicle_id = v.id WHERE s.id=%s", (id,))
             spending = cur.fetchone()
             
             if not spending:
@@ -1331,11 +3992,15 @@ def get_spending(id):
                     'date': spending['date'].strftime('%Y-%m-%d'),
                     'expense_month': spending['expense_month'].strftime('%Y-%m') if spending['expense_month'] else '',
                     'vehicle_id': spending['vehicle_id'],
+                    'vehicle_no': spending['vehicle_no'],
+                    'marked': bool(spending['marked']),
                     'category': spending['category'],
                     'reason': spending['reason'] or '',
                     'amount': float(spending['amount']),
                     'spended_by': spending['spended_by'] or '',
-                    'mode': spending['mode'] or ''
+                    'mode': spending['mode'] or '',
+                    'litres': float(spending['litres']) if spending['litres'] is not None else None,
+                    'odometer_km': spending['odometer_km']
                 }
             })
     except Exception as e:
@@ -1371,6 +4036,10 @@ def update_spending(id):
                 amount_decimal = Decimal(amount)
             except (ValueError, TypeError) as e:
                 return jsonify({'success': False, 'error': 'Invalid date or amount format'})
+            try:
+                litres, odometer_km = spending_readings(request.form, category)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': f'Invalid fuel reading: {e}'})
             
             # Check if record exists
             cur.execute("SELECT id FROM spendings WHERE id=%s", (id,))
@@ -1382,16 +4051,18 @@ def update_spending(id):
                 cur.execute("""
                     UPDATE spendings 
                     SET date=%s, expense_month=%s, vehicle_id=%s, category=%s, 
-                    reason=%s, amount=%s, spended_by=NULL, mode=NULL 
+                    reason=%s, amount=%s, spended_by=NULL, mode=NULL, litres=%s, odometer_km=%s
                     WHERE id=%s
-                """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, id))
+                """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal,
+                      litres, odometer_km, id))
             else:
                 cur.execute("""
                     UPDATE spendings 
                     SET date=%s, expense_month=%s, vehicle_id=%s, category=%s, 
-                    reason=%s, amount=%s, spended_by=%s, mode=%s 
+                    reason=%s, amount=%s, spended_by=%s, mode=%s, litres=%s, odometer_km=%s
                     WHERE id=%s
-                """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, spended_by, mode, id))
+                """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, spended_by, mode,
+                      litres, odometer_km, id))
             
             conn.commit()
             return jsonify({'success': True, 'message': 'Spending updated successfully'})
@@ -1456,21 +4127,31 @@ def edit_spending(id):
                         return jsonify({'success': False, 'error': 'Invalid date or amount format'})
                     flash('Invalid date or amount format', 'error')
                     return redirect(url_for('spendings'))
+
+                try:
+                    litres, odometer_km = spending_readings(request.form, category)
+                except ValueError as e:
+                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                        return jsonify({'success': False, 'error': f'Invalid fuel reading: {e}'})
+                    flash(f'Invalid fuel reading: {e}', 'error')
+                    return redirect(url_for('spendings'))
                 
                 if not spended_by or not mode:
                     cur.execute("""
                         UPDATE spendings 
                         SET date=%s, expense_month=%s, vehicle_id=%s, category=%s, reason=%s, amount=%s, 
-                        spended_by=NULL, mode=NULL 
+                        spended_by=NULL, mode=NULL, litres=%s, odometer_km=%s
                         WHERE id=%s
-                    """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, id))
+                    """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal,
+                          litres, odometer_km, id))
                 else:
                     cur.execute("""
                         UPDATE spendings 
                         SET date=%s, expense_month=%s, vehicle_id=%s, category=%s, reason=%s, amount=%s, 
-                        spended_by=%s, mode=%s 
+                        spended_by=%s, mode=%s, litres=%s, odometer_km=%s
                         WHERE id=%s
-                    """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, spended_by, mode, id))
+                    """, (payment_date, expense_month, vehicle_id, category, reason, amount_decimal, spended_by, mode,
+                          litres, odometer_km, id))
                 
                 conn.commit()
                 
@@ -1497,7 +4178,9 @@ def edit_spending(id):
                     'reason': spending['reason'] or '',
                     'amount': float(spending['amount']),
                     'spended_by': spending['spended_by'] or '',
-                    'mode': spending['mode'] or ''
+                    'mode': spending['mode'] or '',
+                    'litres': float(spending['litres']) if spending['litres'] is not None else None,
+                    'odometer_km': spending['odometer_km']
                 }
             })
             
@@ -1535,20 +4218,15 @@ def incoming():
             cur.execute("SELECT id, vehicle_no FROM vehicles ORDER BY vehicle_no")
             vehicles = cur.fetchall()
 
-            cur.execute("SELECT COALESCE(SUM(amount),0) as credited FROM payments")
-            credited = cur.fetchone()['credited'] or 0
-            cur.execute("SELECT COALESCE(SUM(amount),0) as debited FROM spendings WHERE spended_by IS NOT NULL AND mode IS NOT NULL")
-            debited = cur.fetchone()['debited'] or 0
-            balance = Decimal(credited) - Decimal(debited)
-            
-            cur.execute("SELECT COALESCE(SUM(amount),0) AS tsr_spent FROM spendings WHERE spended_by='TSR'")
-            tsr_spent = cur.fetchone()['tsr_spent'] or 0
-
-            cur.execute("SELECT COALESCE(SUM(amount),0) AS msr_spent FROM spendings WHERE spended_by='MSR'")
-            msr_spent = cur.fetchone()['msr_spent'] or 0
+            ledger = journal.ledger_totals(cur)
+            credited = ledger['credited']
+            debited = ledger['debited']
+            tsr_spent = ledger['spent_by']['TSR']
+            msr_spent = ledger['spent_by']['MSR']
+            balance = ledger['balance']
 
-            tsr_balance = Decimal(credited) - Decimal(tsr_spent)
-            msr_balance = Decimal(credited) - Decimal(msr_spent)
+            tsr_balance = credited - tsr_spent
+            msr_balance = credited - msr_spent
             
             cur.execute("SELECT p.*, c.name as company_name, v.vehicle_no FROM payments p LEFT JOIN companies c ON p.company_id=c.id LEFT JOIN vehicles v ON p.vehicle_id=v.id ORDER BY p.date DESC")
             payments = cur.fetchall()
@@ -1893,22 +4571,27 @@ def api_hired_vehicles_audit():
         
         month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
         
-        with get_dict_cursor(conn) as cur:
+        # One snapshot so the separate totals agree with each other
+        with db.snapshot(conn), get_dict_cursor(conn) as cur:
+            closed = month_close.is_closed(cur, month_date)
             if vehicle_id == 'all':
-                cur.execute("""
-                    SELECT 
-                        hv.id,
-                        hv.vehicle_no,
-                        hv.owner_name,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments
-                    FROM hired_vehicles hv
-                    LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
-                    GROUP BY hv.id, hv.vehicle_no, hv.owner_name
-                    ORDER BY hv.vehicle_no
-                """, (month_date,))
+                if closed:
+                    summary = month_close.hired_vehicle_summary(cur, month_date)
+                else:
+                    cur.execute("""
+                        SELECT 
+                            hv.id,
+                            hv.vehicle_no,
+                            hv.owner_name,
+                            COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
+                            COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments
+                        FROM hired_vehicles hv
+                        LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
+                        GROUP BY hv.id, hv.vehicle_no, hv.owner_name
+                        ORDER BY hv.vehicle_no
+                    """, (month_date,))
                 
-                summary = cur.fetchall()
+                    summary = cur.fetchall()
                 
                 return jsonify({
                     'summary': summary,
@@ -1916,20 +4599,23 @@ def api_hired_vehicles_audit():
                 })
                 
             else:
-                cur.execute("""
-                    SELECT 
-                        hv.id,
-                        hv.vehicle_no,
-                        hv.owner_name,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments
-                    FROM hired_vehicles hv
-                    LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
-                    WHERE hv.id = %s
-                    GROUP BY hv.id, hv.vehicle_no, hv.owner_name
-                """, (month_date, vehicle_id))
+                if closed:
+                    summary = month_close.hired_vehicle_summary(cur, month_date, int(vehicle_id))
+                else:
+                    cur.execute("""
+                        SELECT 
+                            hv.id,
+                            hv.vehicle_no,
+                            hv.owner_name,
+                            COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
+                            COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments
+                        FROM hired_vehicles hv
+                        LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
+                        WHERE hv.id = %s
+                        GROUP BY hv.id, hv.vehicle_no, hv.owner_name
+                    """, (month_date, vehicle_id))
                 
-                summary = cur.fetchall()
+                    summary = cur.fetchall()
                 
                 cur.execute("""
                     SELECT *
@@ -1946,6 +4632,8 @@ def api_hired_vehicles_audit():
                     'month': month
                 })
                 
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
         app.logger.error(f"Error in api_hired_vehicles_audit: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -1962,49 +4650,58 @@ def api_company_audit():
         
         month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
         
-        with get_dict_cursor(conn) as cur:
+        # One snapshot so the separate totals agree with each other
+        with db.snapshot(conn), get_dict_cursor(conn) as cur:
+            closed = month_close.is_closed(cur, month_date)
             if company == 'all':
-                cur.execute("""
-                    SELECT 
-                        company_name,
-                        COALESCE(SUM(sale_amount), 0) as sales_amount
-                    FROM company_sales 
-                    WHERE month_year = %s
-                    GROUP BY company_name
-                """, (month_date,))
-                
-                sales_data = cur.fetchall()
+                if closed:
+                    company_dict = {row['company_name']: {
+                        'company_name': row['company_name'],
+                        'sales_amount': float(row['sales_amount']),
+                        'received_amount': float(row['received_amount'])
+                    } for row in month_close.company_totals(cur, month_date)}
+                else:
+                    cur.execute("""
+                        SELECT 
+                            company_name,
+                            COALESCE(SUM(sale_amount), 0) as sales_amount
+                        FROM company_sales 
+                        WHERE month_year = %s
+                        GROUP BY company_name
+                    """, (month_date,))
                 
-                cur.execute("""
-                    SELECT 
-                        company_name,
-                        COALESCE(SUM(received_amount), 0) as received_amount
-                    FROM company_payments 
-                    WHERE month_year = %s
-                    GROUP BY company_name
-                """, (month_date,))
+                    sales_data = cur.fetchall()
                 
-                payment_data = cur.fetchall()
+                    cur.execute("""
+                        SELECT 
+                            company_name,
+                            COALESCE(SUM(received_amount), 0) as received_amount
+                        FROM company_payments 
+                        WHERE month_year = %s
+                        GROUP BY company_name
+                    """, (month_date,))
                 
-                # Combine data
-                company_dict = {}
-                for row in sales_data:
-                    company_dict[row['company_name']] = {
-                        'company_name': row['company_name'],
-                        'sales_amount': float(row['sales_amount']),
-                        'received_amount': 0
-                    }
+                    payment_data = cur.fetchall()
                 
-                for row in payment_data:
-                    if row['company_name'] in company_dict:
-                        company_dict[row['company_name']]['received_amount'] = float(row['received_amount'])
-                    else:
+                    # Combine data
+                    company_dict = {}
+                    for row in sales_data:
                         company_dict[row['company_name']] = {
                             'company_name': row['company_name'],
-                            'sales_amount': 0,
-                            'received_amount': float(row['received_amount'])
+                            'sales_amount': float(row['sales_amount']),
+                            'received_amount': 0
                         }
                 
+                    for row in payment_data:
+                        if row['company_name'] in company_dict:
+                            company_dict[row['company_name']]['received_amount'] = float(row['received_amount'])
+                        else:
+                            company_dict[row['company_name']] = {
+                                'company_name': row['company_name'],
+                                'sales_amount': 0,
+                                'received_amount': float(row['received_amount'])
+                            }
+                
                 companies = list(company_dict.values())
                 for comp in companies:
                     comp['pending_amount'] = comp['sales_amount'] - comp['received_amount']
@@ -2015,29 +4712,34 @@ def api_company_audit():
                 })
                 
             else:
-                cur.execute("""
-                    SELECT 
-                        company_name,
-                        COALESCE(SUM(sale_amount), 0) as sales_amount
-                    FROM company_sales 
-                    WHERE company_name = %s AND month_year = %s
-                    GROUP BY company_name
-                """, (company, month_date))
+                if closed:
+                    totals = month_close.company_totals(cur, month_date, company)
+                    sales_amount = float(totals[0]['sales_amount']) if totals else 0
+                    received_amount = float(totals[0]['received_amount']) if totals else 0
+                else:
+                    cur.execute("""
+                        SELECT 
+                            company_name,
+                            COALESCE(SUM(sale_amount), 0) as sales_amount
+                        FROM company_sales 
+                        WHERE company_name = %s AND month_year = %s
+                        GROUP BY company_name
+                    """, (company, month_date))
                 
-                sales_result = cur.fetchone()
-                sales_amount = float(sales_result['sales_amount'] or 0) if sales_result else 0
+                    sales_result = cur.fetchone()
+                    sales_amount = float(sales_result['sales_amount'] or 0) if sales_result else 0
                 
-                cur.execute("""
-                    SELECT 
-                        company_name,
-                        COALESCE(SUM(received_amount), 0) as received_amount
-                    FROM company_payments 
-                    WHERE company_name = %s AND month_year = %s
-                    GROUP BY company_name
-                """, (company, month_date))
+                    cur.execute("""
+                        SELECT 
+                            company_name,
+                            COALESCE(SUM(received_amount), 0) as received_amount
+                        FROM company_payments 
+                        WHERE company_name = %s AND month_year = %s
+                        GROUP BY company_name
+                    """, (company, month_date))
                 
-                payments_result = cur.fetchone()
-                received_amount = float(payments_result['received_amount'] or 0) if payments_result else 0
+                    payments_result = cur.fetchone()
+                    received_amount = float(payments_result['received_amount'] or 0) if payments_result else 0
                 
                 cur.execute("""
                     SELECT 
@@ -2076,6 +4778,8 @@ def api_company_audit():
                     'month': month
                 })
                 
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
         app.logger.error(f"Error in api_company_audit: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -2084,67 +4788,29 @@ def api_company_audit():
 
 @app.route('/export/hired_vehicles_audit')
 @login_required
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
 def export_hired_vehicles_audit():
     conn = get_db_conn()
     try:
         month = request.args.get('month', datetime.now().strftime('%Y-%m'))
         vehicle_id = request.args.get('vehicle_id', 'all')
-        
-        month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
-        
+
         with get_dict_cursor(conn) as cur:
-            if vehicle_id == 'all':
-                cur.execute("""
-                    SELECT 
-                        hv.vehicle_no,
-                        hv.owner_name,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments,
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) - 
-                        COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as net_balance
-                    FROM hired_vehicles hv
-                    LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
-                    GROUP BY hv.id, hv.vehicle_no, hv.owner_name
-                    ORDER BY hv.vehicle_no
-                """, (month_date,))
-                
-                data = cur.fetchall()
-                filename = f'hired_vehicles_audit_{month}.csv'
-                
-            else:
-                cur.execute("""
-                    SELECT 
-                        t.transaction_date,
-                        t.transaction_type,
-                        t.description,
-                        t.reference_no,
-                        t.amount,
-                        hv.vehicle_no,
-                        hv.owner_name
-                    FROM hired_vehicle_transactions t
-                    JOIN hired_vehicles hv ON t.hired_vehicle_id = hv.id
-                    WHERE t.hired_vehicle_id = %s AND t.month_year = %s
-                    ORDER BY t.transaction_date, t.created_at
-                """, (vehicle_id, month_date))
-                
-                data = cur.fetchall()
-                vehicle_info = data[0] if data else {}
-                filename = f'hired_vehicle_audit_{vehicle_info.get("vehicle_no", "unknown")}_{month}.csv'
-            
-            output = StringIO()
-            if data:
-                writer = csv.DictWriter(output, fieldnames=data[0].keys())
-                writer.writeheader()
-                writer.writerows(data)
-            
-            response = app.response_class(
-                response=output.getvalue(),
-                status=200,
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment;filename={filename}'}
-            )
-            return response
-            
+            sql, params, filename = reports.hired_vehicles_audit_export(cur, month, vehicle_id)
+            cur.execute(sql, params)
+            data = cur.fetchall()
+
+        response = app.response_class(
+            response=reports.rows_to_csv(data),
+            status=200,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment;filename={filename}'}
+        )
+        return response
+
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
         app.logger.error(f"Error exporting hired vehicles audit: {e}")
         return "Error exporting data", 500
@@ -2153,80 +4819,29 @@ def export_hired_vehicles_audit():
 
 @app.route('/export/company_audit')
 @login_required
+@query_limits(statement_timeout=config.EXPORT_STATEMENT_TIMEOUT_MS, max_rows=config.EXPORT_MAX_ROWS,
+              max_seconds=config.EXPORT_STATEMENT_TIMEOUT_MS // 1000)
 def export_company_audit():
     conn = get_db_conn()
     try:
         month = request.args.get('month', datetime.now().strftime('%Y-%m'))
         company = request.args.get('company', 'all')
-        
-        month_date = datetime.strptime(month, '%Y-%m').date().replace(day=1)
-        
+
+        sql, params, filename = reports.company_audit_export(month, company)
         with get_dict_cursor(conn) as cur:
-            if company == 'all':
-                cur.execute("""
-                    SELECT 
-                        cs.company_name,
-                        cs.sale_date,
-                        cs.invoice_number,
-                        cs.sale_amount,
-                        cs.description,
-                        cp.payment_date,
-                        cp.received_amount,
-                        cp.payment_mode,
-                        cp.reference_number
-                    FROM company_sales cs
-                    LEFT JOIN company_payments cp ON cs.company_name = cp.company_name AND cs.month_year = cp.month_year
-                    WHERE cs.month_year = %s
-                    ORDER BY cs.company_name, cs.sale_date
-                """, (month_date,))
-                
-                data = cur.fetchall()
-                filename = f'company_audit_{month}.csv'
-                
-            else:
-                cur.execute("""
-                    SELECT 
-                        'sale' as transaction_type,
-                        sale_date as date,
-                        invoice_number as reference,
-                        sale_amount as amount,
-                        description,
-                        NULL as payment_mode
-                    FROM company_sales 
-                    WHERE company_name = %s AND month_year = %s
-                    
-                    UNION ALL
-                    
-                    SELECT 
-                        'payment' as transaction_type,
-                        payment_date as date,
-                        reference_number as reference,
-                        received_amount as amount,
-                        description,
-                        payment_mode
-                    FROM company_payments 
-                    WHERE company_name = %s AND month_year = %s
-                    
-                    ORDER BY date
-                """, (company, month_date, company, month_date))
-                
-                data = cur.fetchall()
-                filename = f'company_audit_{company}_{month}.csv'
-            
-            output = StringIO()
-            if data:
-                writer = csv.DictWriter(output, fieldnames=data[0].keys())
-                writer.writeheader()
-                writer.writerows(data)
-            
-            response = app.response_class(
-                response=output.getvalue(),
-                status=200,
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment;filename={filename}'}
-            )
-            return response
-            
+            cur.execute(sql, params)
+            data = cur.fetchall()
+
+        response = app.response_class(
+            response=reports.rows_to_csv(data),
+            status=200,
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment;filename={filename}'}
+        )
+        return response
+
+    except db.QUERY_LIMIT_ERRORS:
+        raise
     except Exception as e:
         app.logger.error(f"Error exporting company audit: {e}")
         return "Error exporting data", 500
@@ -2236,8 +4851,11 @@ def export_company_audit():
 
 
 
-# Initialize database when app starts
-initialize_database()
+# Initialize database on import only when asked to (see config.INIT_DB_ON_IMPORT)
+if config.INIT_DB_ON_IMPORT:
+    initialize_database()
 
 if __name__ == "__main__":
+    if not config.INIT_DB_ON_IMPORT:
+        initialize_database()
     app.run(host="0.0.0.0", port=5000, debug=True)
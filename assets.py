@@ -0,0 +1,272 @@
+# assets.py - Build step for static assets: bundle, dedupe, minify, fingerprint, precompress
+#
+#   flask --app app build-assets
+#
+# writes static/dist/<name>.<hash>.<ext> (+ .gz, and .br when the brotli
+# package is installed) and static/dist/manifest.json mapping bundle names to
+# the hashed files. Templates call asset_url('app.js'); without a manifest it
+# falls back to the unbuilt file under static/.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: .br variants are skipped
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# bundle name -> source files (relative to static/), concatenated in order
+BUNDLES = {
+    'app.js': ['js/app.js'],
+    'style.css': ['css/style.css'],
+}
+
+# A '/' after one of these starts a regex literal rather than a division
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw'}
+
+
+def _scan_js(source):
+    """Split JS into ('code' | 'string' | 'comment', text) segments.
+
+    Understands quotes, template literals (without nesting `${}` templates
+    inside `${}`), comments and regex literals well enough for hand-written
+    code like app.js; it is not a full parser.
+    """
+    segments = []
+    i, n = 0, len(source)
+    code_start = 0
+
+    def flush(end):
+        if end > code_start:
+            segments.append(('code', source[code_start:end]))
+
+    def prev_significant(pos):
+        j = pos - 1
+        while j >= 0 and source[j].isspace():
+            j -= 1
+        if j < 0:
+            return ''
+        if source[j].isalnum() or source[j] in '_$':
+            k = j
+            while k >= 0 and (source[k].isalnum() or source[k] in '_$'):
+                k -= 1
+            return source[k + 1:j + 1]
+        return source[j]
+
+    while i < n:
+        ch = source[i]
+        nxt = source[i + 1] if i + 1 < n else ''
+        if ch == '/' and nxt == '/':
+            end = source.find('\n', i)
+            end = n if end == -1 else end
+            flush(i)
+            segments.append(('comment', source[i:end]))
+            i = code_start = end
+        elif ch == '/' and nxt == '*':
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            flush(i)
+            segments.append(('comment', source[i:end]))
+            i = code_start = end
+        elif ch in '"\'`':
+            j = i + 1
+            while j < n and source[j] != ch:
+                j += 2 if source[j] == '\\' else 1
+            flush(i)
+            segments.append(('string', source[i:j + 1]))
+            i = code_start = j + 1
+        elif ch == '/':
+            prev = prev_significant(i)
+            if prev == '' or prev in _REGEX_PRECEDERS or prev in _REGEX_KEYWORDS:
+                j = i + 1
+                in_class = False
+                while j < n and source[j] != '\n':
+                    c = source[j]
+                    if c == '\\':
+                        j += 2
+                        continue
+                    if c == '[':
+                        in_class = True
+                    elif c == ']':
+                        in_class = False
+                    elif c == '/' and not in_class:
+                        break
+                    j += 1
+                j += 1
+                while j < n and source[j].isalpha():  # flags
+                    j += 1
+                flush(i)
+                segments.append(('string', source[i:j]))
+                i = code_start = j
+            else:
+                i += 1
+        else:
+            i += 1
+    flush(n)
+    return segments
+
+
+def _mask(segments):
+    """Source with strings and comments blanked out (same length and newlines)."""
+    return ''.join(
+        text if kind == 'code' else re.sub(r'[^\n]', ' ', text)
+        for kind, text in segments
+    )
+
+
+_FUNCTION_DECL = re.compile(r'(?:async\s+)?function\s+([A-Za-z_$][\w$]*)\s*\(')
+
+
+def dedupe_functions(source):
+    """Drop all but the last top-level declaration of each function name.
+
+    Later declarations already win in the browser, so this only removes dead
+    code; each removal is logged so the source can be cleaned up.
+    """
+    masked = _mask(_scan_js(source))
+    decls = []
+    depth = 0
+    i = 0
+    while i < len(masked):
+        ch = masked[i]
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+        elif depth == 0 and (i == 0 or not (masked[i - 1].isalnum() or masked[i - 1] in '_$.')):
+            match = _FUNCTION_DECL.match(masked, i)
+            if match:
+                body = masked.index('{', match.end())
+                level = 0
+                for end in range(body, len(masked)):
+                    if masked[end] == '{':
+                        level += 1
+                    elif masked[end] == '}':
+                        level -= 1
+                        if level == 0:
+                            break
+                decls.append((match.group(1), i, end + 1))
+                i = end + 1
+                continue
+        i += 1
+
+    last = {name: start for name, start, _ in decls}
+    removals = [(start, end) for name, start, end in decls if last[name] != start]
+    for name, start, _ in decls:
+        if last[name] != start:
+            logger.warning(f"Dropping duplicate definition of {name}()")
+    for start, end in reversed(removals):
+        source = source[:start] + source[end:]
+    return source
+
+
+def minify_js(source):
+    """Conservative JS minifier: strips comments and indentation but keeps line
+    breaks, so automatic semicolon insertion behaves exactly as before."""
+    out = []
+    for kind, text in _scan_js(source):
+        if kind == 'comment':
+            out.append('\n' if '\n' in text else '')
+        elif kind == 'code':
+            text = re.sub(r'[ \t]+', ' ', text)
+            text = re.sub(r' ?\n[ \n]*', '\n', text)
+            out.append(text)
+        else:
+            out.append(text)
+    return re.sub(r'\n{2,}', '\n', ''.join(out)).strip() + '\n'
+
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(static_folder):
+    """Build every bundle into static/dist and write the manifest; returns it."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+                parts.append(f.read())
+        stem, ext = os.path.splitext(name)
+        if ext == '.js':
+            # Join with ';' so a file without a trailing semicolon can't run into the next
+            content = minify_js(dedupe_functions('\n;\n'.join(parts)))
+        else:
+            content = minify_css('\n'.join(parts))
+
+        data = content.encode('utf-8')
+        hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        path = os.path.join(dist, hashed)
+        _write(path, data)
+        _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+        manifest[name] = hashed
+        logger.info(f"Built {hashed} ({len(data)} bytes)")
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Remove builds that are no longer referenced
+    current = set(manifest.values())
+    for filename in os.listdir(dist):
+        base = re.sub(r'\.(gz|br)$', '', filename)
+        if filename != MANIFEST and base not in current:
+            os.remove(os.path.join(dist, filename))
+    return manifest
+
+
+class AssetManifest:
+    """Resolves bundle names to hashed files, re-reading the manifest when a
+    new build replaces it."""
+
+    def __init__(self, static_folder):
+        self.path = os.path.join(static_folder, DIST_DIR, MANIFEST)
+        self._mtime = None
+        self._entries = {}
+
+    def get(self, name):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+        return self._entries.get(name)
+
+    def source_path(self, name):
+        """Unbuilt fallback: the bundle's first source file under static/."""
+        return BUNDLES[name][0]
+
+
+def pick_encoding(accept_encoding, path):
+    """Best precompressed variant of `path` the client accepts: (suffix, encoding)."""
+    accept_encoding = accept_encoding or ''
+    if 'br' in accept_encoding and os.path.exists(path + '.br'):
+        return '.br', 'br'
+    if 'gzip' in accept_encoding and os.path.exists(path + '.gz'):
+        return '.gz', 'gzip'
+    return '', None
@@ -0,0 +1,115 @@
+# changes.py - Change-data-capture log for incremental sync
+#
+# Triggers on the ledger tables (see create_change_log) append one change_log
+# row per inserted, updated or deleted row: table, row id, operation ('I',
+# 'U', 'D') and the row as written (NULL for deletes). Consumers keep the last
+# seq they processed and ask for what came after it:
+#
+#   GET /api/changes?since=<seq>[&table=spendings][&limit=10000]
+#   flask --app app export-changes --since <seq> > delta.ndjson
+#
+# Each line of the NDJSON response is one change, in seq order.
+#
+# Sequence numbers are assigned when changes are published, not when they
+# are written. Numbers taken at insert time would be handed out before
+# commit, so a long transaction could commit seq 41 after a consumer had
+# already read up to 42. publish() numbers every committed, unnumbered row
+# under an advisory lock, so each batch always comes after everything
+# published before it.
+#
+# Each tenant has its own sequence: a connection only sees, publishes and
+# prunes its tenant's changes (see tenants.py).
+
+import json
+
+from psycopg2 import extras
+
+# pg_advisory_xact_lock key serialising publish(), paired with the tenant id
+PUBLISH_LOCK_KEY = 7150001
+
+
+class ChangesPruned(Exception):
+    """The requested position is older than the retained change log."""
+
+
+def publish(cur):
+    """Number the committed, unpublished changes; returns the newest seq.
+    Must run inside a transaction (the lock is held until it ends)."""
+    cur.execute("SELECT pg_advisory_xact_lock(%s, current_tenant_id())", (PUBLISH_LOCK_KEY,))
+    cur.execute("""
+        UPDATE change_log c
+        SET seq = n.base + n.rn
+        FROM (
+            SELECT id, (SELECT COALESCE(MAX(seq), 0) FROM change_log) AS base,
+                   ROW_NUMBER() OVER (ORDER BY id) AS rn
+            FROM change_log
+            WHERE seq IS NULL
+        ) n
+        WHERE c.id = n.id
+    """)
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+    return cur.fetchone()[0]
+
+
+def check_since(cur, since):
+    """Raise ChangesPruned when changes after `since` have already been pruned."""
+    cur.execute("SELECT MIN(seq) FROM change_log WHERE seq IS NOT NULL")
+    oldest = cur.fetchone()[0]
+    if oldest is not None and since < oldest - 1:
+        raise ChangesPruned(f"Changes after {since} are no longer kept (oldest is {oldest}); "
+                            f"resync from a full export")
+
+
+def _change(row):
+    return {
+        'seq': row['seq'],
+        'table': row['table_name'],
+        'id': row['row_id'],
+        'op': row['op'],
+        'changed_at': row['changed_at'].isoformat(),
+        'data': row['data'],
+    }
+
+
+def iter_changes_ndjson(conn, since, tables=None, limit=None, itersize=2000):
+    """Yield published changes after `since` as NDJSON text chunks, read
+    through a server-side cursor.
+
+    Takes ownership of `conn` and closes it when the generator finishes.
+    """
+    try:
+        conn.autocommit = False
+        with conn.cursor('change_log', cursor_factory=extras.DictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute("""
+                SELECT seq, table_name, row_id, op, changed_at, data
+                FROM change_log
+                WHERE seq > %(since)s
+                AND (%(tables)s::text[] IS NULL OR table_name = ANY(%(tables)s))
+                ORDER BY seq
+                LIMIT %(limit)s
+            """, {'since': since, 'tables': list(tables) if tables else None, 'limit': limit})
+            lines = []
+            for row in cur:
+                lines.append(json.dumps(_change(row), default=str))
+                if len(lines) >= itersize:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def prune(cur, keep_days):
+    """Delete published changes older than `keep_days`; returns the count."""
+    # Always a prefix of the sequence, so check_since() can tell what is gone
+    cur.execute("""
+        DELETE FROM change_log
+        WHERE seq <= (
+            SELECT MAX(seq) FROM change_log
+            WHERE changed_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        )
+    """, (keep_days,))
+    return cur.rowcount
@@ -1,7 +1,102 @@
 # config.py
-DB_USER = 'tsrfleet_user'
-DB_PASS = 'AETy1afH8aelRKs7OwurTcQYjIeyFtvk'    # <<-- change this
-DB_HOST = 'dpg-d3d1vdq4d50c73cvvvrg-a'  # as you provided
-DB_PORT = 5432
-DB_NAME = 'tsrfleet'
-SECRET_KEY = 'Tsat@9392350848'
+# Every setting can be overridden from the environment; the literals below are
+# development fallbacks only.
+import os
+import tempfile
+
+
+def _env(name, default):
+    return os.environ.get(name, default)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_list(name):
+    """Replica DSNs contain spaces, so lists are separated by ';'."""
+    return [item.strip() for item in os.environ.get(name, '').split(';') if item.strip()]
+
+
+# Credentials have no real defaults: the placeholders below only work against
+# a local development database, and app.py refuses to start outside debug
+# mode while any setting in MISSING_SECRETS is unset.
+DB_USER = _env('DB_USER', 'tsrfleet_user')
+DB_PASS = _env('DB_PASS', 'dev-only-password')
+DB_HOST = _env('DB_HOST', 'localhost')
+DB_PORT = _env_int('DB_PORT', 5432)
+DB_NAME = _env('DB_NAME', 'tsrfleet')
+SECRET_KEY = _env('SECRET_KEY', 'dev-only-secret-key')
+
+# Keep an in-process replica of spendings/payments for dashboard totals
+LEDGER_REPLICA_ENABLED = _env_bool('LEDGER_REPLICA_ENABLED', True)
+
+# Compiled Jinja templates are cached here across restarts
+JINJA_CACHE_DIR = _env('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tsr_fleet_jinja_cache'))
+
+# Database routing: writes go to the primary, GET requests may read from replicas.
+# DB_REPLICA_DSNS="host=replica1 port=5432 user=... password=... dbname=tsrfleet;host=replica2 ..."
+DB_PRIMARY_DSN = _env('DB_PRIMARY_DSN',
+                      f"host={DB_HOST} port={DB_PORT} user={DB_USER} password={DB_PASS} dbname={DB_NAME}")
+DB_REPLICA_DSNS = _env_list('DB_REPLICA_DSNS')
+
+MISSING_SECRETS = [name for name in ('SECRET_KEY',) if name not in os.environ]
+if 'DB_PRIMARY_DSN' not in os.environ:
+    MISSING_SECRETS += [name for name in ('DB_HOST', 'DB_PASS') if name not in os.environ]
+DB_REPLICA_MAX_LAG = _env_int('DB_REPLICA_MAX_LAG', 5)      # seconds
+DB_PIN_SECONDS = _env_int('DB_PIN_SECONDS', 10)             # read from the primary this long after a session writes
+
+# Query limits. Routes may override the timeouts and budget with @query_limits.
+DB_STATEMENT_TIMEOUT_MS = _env_int('DB_STATEMENT_TIMEOUT_MS', 15000)
+DB_LOCK_TIMEOUT_MS = _env_int('DB_LOCK_TIMEOUT_MS', 5000)
+DB_REQUEST_BUDGET_SECONDS = _env_int('DB_REQUEST_BUDGET_SECONDS', 30)    # total DB time per request
+DB_REQUEST_BUDGET_ROWS = _env_int('DB_REQUEST_BUDGET_ROWS', 200000)      # rows fetched per request
+EXPORT_STATEMENT_TIMEOUT_MS = _env_int('EXPORT_STATEMENT_TIMEOUT_MS', 60000)
+EXPORT_MAX_ROWS = _env_int('EXPORT_MAX_ROWS', 500000)
+STREAM_MAX_ROWS = _env_int('STREAM_MAX_ROWS', 5000)           # rows per table on a streamed page
+
+# Process model. Importing app.py does not touch the schema, so flask CLI
+# commands start without it: the schema setup runs from `flask init-db`, from
+# `python app.py`, and once in the gunicorn master (wsgi.py). Set
+# INIT_DB_ON_IMPORT to run it on every import instead.
+INIT_DB_ON_IMPORT = _env_bool('INIT_DB_ON_IMPORT', False)
+DB_POOL_MAX_IDLE = _env_int('DB_POOL_MAX_IDLE', 4)      # idle connections kept per database per worker
+DB_POOL_WARM = _env_int('DB_POOL_WARM', 2)              # connections opened when a worker starts
+
+# Spendings ingest API: INGEST_API_KEYS="fuelcard:<key>;depot2/driverapp:<key>" (source:key
+# pairs, optionally prefixed with the code of the tenant the feed writes to)
+INGEST_API_KEYS = _env_list('INGEST_API_KEYS')
+INGEST_MAX_BATCH = _env_int('INGEST_MAX_BATCH', 5000)
+
+# Background jobs (flask --app app run-jobs)
+JOB_RESULTS_DIR = _env('JOB_RESULTS_DIR', os.path.join(tempfile.gettempdir(), 'tsr_fleet_jobs'))
+JOB_WORKER_PROCESSES = _env_int('JOB_WORKER_PROCESSES', 2)
+JOB_STATEMENT_TIMEOUT_MS = _env_int('JOB_STATEMENT_TIMEOUT_MS', 300000)
+JOB_RESULT_TTL_HOURS = _env_int('JOB_RESULT_TTL_HOURS', 24)
+
+# Change-data-capture log (GET /api/changes, flask --app app export-changes).
+# CHANGES_API_KEYS lets sync tools read changes without a login session; a key
+# reads the default tenant's changes unless prefixed with a tenant code ("depot2/<key>").
+CHANGES_API_KEYS = _env_list('CHANGES_API_KEYS')
+CHANGES_MAX_LIMIT = _env_int('CHANGES_MAX_LIMIT', 50000)        # changes per request
+CHANGE_LOG_RETENTION_DAYS = _env_int('CHANGE_LOG_RETENTION_DAYS', 30)
+
+# Spending anomaly flags (see anomalies.py). Thresholds are baked into the
+# scoring trigger when the schema is created.
+ANOMALY_Z_THRESHOLD = float(_env('ANOMALY_Z_THRESHOLD', '3.5'))
+ANOMALY_MIN_SAMPLES = _env_int('ANOMALY_MIN_SAMPLES', 8)
+ANOMALY_MIN_STDDEV = float(_env('ANOMALY_MIN_STDDEV', '0.1'))     # on ln(1 + amount)
+ANOMALY_DUPLICATE_DAYS = _env_int('ANOMALY_DUPLICATE_DAYS', 3)
+
+# Fuel efficiency (see fuel.py)
+FUEL_RANKING_DAYS = _env_int('FUEL_RANKING_DAYS', 90)
+FUEL_ALERT_RECENT_FILLS = _env_int('FUEL_ALERT_RECENT_FILLS', 3)
+FUEL_ALERT_BASELINE_FILLS = _env_int('FUEL_ALERT_BASELINE_FILLS', 10)
+FUEL_ALERT_DROP_PCT = _env_int('FUEL_ALERT_DROP_PCT', 15)
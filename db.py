@@ -0,0 +1,336 @@
+# db.py - Connection routing between the primary and read replicas, pooled
+# per-process connections, plus per-request statement timeouts and query budgets
+#
+# Writes, background threads and anything outside a request go to the
+# primary. GET/HEAD requests are served from a replica whose replay lag is
+# within bounds, unless the session wrote recently (read-your-writes pin).
+
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import extensions, extras
+
+logger = logging.getLogger(__name__)
+
+# Replay lag in seconds; 0 when the replica has replayed everything it received
+# (pg_last_xact_replay_timestamp alone keeps growing while the primary is idle)
+LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+
+class QueryBudgetExceeded(Exception):
+    """A request used up its allowance of database time or fetched rows."""
+
+
+class QueryBudget:
+    """Per-request allowance of total statement time and rows fetched."""
+
+    def __init__(self, max_seconds, max_rows):
+        self.max_seconds = max_seconds
+        self.max_rows = max_rows
+        self.seconds = 0.0
+        self.rows = 0
+
+    def check(self):
+        if self.max_seconds is not None and self.seconds > self.max_seconds:
+            raise QueryBudgetExceeded(
+                f"Request spent {self.seconds:.1f}s in the database (limit {self.max_seconds}s)")
+        if self.max_rows is not None and self.rows > self.max_rows:
+            raise QueryBudgetExceeded(
+                f"Request fetched more than {self.max_rows} rows; narrow the date range or filters")
+
+    def charge_time(self, seconds):
+        self.seconds += seconds
+        self.check()
+
+    def charge_rows(self, count):
+        self.rows += count
+        self.check()
+
+
+class BudgetedCursorMixin:
+    """Charges statement time and fetched rows to `connection.budget`, if set."""
+
+    def execute(self, query, vars=None):
+        budget = getattr(self.connection, 'budget', None)
+        if budget is None:
+            return super().execute(query, vars)
+        budget.check()
+        started = time.monotonic()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            budget.seconds += time.monotonic() - started
+            raise
+        budget.charge_time(time.monotonic() - started)
+        return result
+
+    def _charge_rows(self, count):
+        budget = getattr(self.connection, 'budget', None)
+        if budget is not None and count:
+            budget.charge_rows(count)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._charge_rows(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._charge_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._charge_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in super().__iter__():
+            self._charge_rows(1)
+            yield row
+
+
+class BudgetedCursor(BudgetedCursorMixin, extensions.cursor):
+    pass
+
+
+class BudgetedDictCursor(BudgetedCursorMixin, extras.DictCursor):
+    pass
+
+
+# Errors that mean a request hit its limits; routes re-raise them so the
+# app-level error handler can answer instead of a generic 500
+QUERY_LIMIT_ERRORS = (QueryBudgetExceeded, psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable)
+
+
+class Connection(extensions.connection):
+    """Connection that can carry the current request's QueryBudget and, when it
+    came from a ConnectionPool, goes back to the pool on close()."""
+    budget = None
+    pool = None
+    in_use = False
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_use:
+            self.in_use = False
+            self.pool.release(self)
+
+    def discard(self):
+        super().close()
+
+
+def connect(dsn, pool=None):
+    conn = psycopg2.connect(dsn, sslmode='prefer', connection_factory=Connection,
+                            cursor_factory=BudgetedCursor)
+    conn.autocommit = True
+    conn.pool = pool
+    return conn
+
+
+class ConnectionPool:
+    """Keeps up to `max_idle` open connections to one DSN for reuse.
+
+    Callers keep the existing `conn = get_db_conn() ... conn.close()` pattern;
+    close() resets the session and returns the connection here. Connections
+    are never shared across processes: after a fork the child starts with an
+    empty pool (the parent's sockets are left alone rather than closed).
+    """
+
+    def __init__(self, dsn, max_idle=4):
+        self.dsn = dsn
+        self.max_idle = max_idle
+        self._idle = []
+        self._orphans = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Inherited from the parent: keep references so garbage collection
+            # never sends a terminate message down the parent's socket
+            self._orphans.extend(self._idle)
+            self._idle = []
+            self._pid = os.getpid()
+
+    def getconn(self):
+        with self._lock:
+            self._check_pid()
+            conn = self._idle.pop() if self._idle else None
+        if conn is None or conn.closed:
+            conn = connect(self.dsn, pool=self)
+        conn.in_use = True
+        return conn
+
+    def release(self, conn):
+        if conn.closed:
+            return
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.autocommit = True
+            # Drop per-request SETs, LISTENs, prepared statements and temp tables
+            with conn.cursor() as cur:
+                cur.execute("DISCARD ALL")
+            conn.budget = None
+        except Exception:
+            conn.discard()
+            return
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def warm(self, count):
+        """Open connections up front so the first requests don't pay for connecting."""
+        conns = [self.getconn() for _ in range(min(count, self.max_idle))]
+        for conn in conns:
+            conn.close()
+
+    def dispose(self):
+        """Really close idle connections (e.g. in the master before forking)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+
+def apply_limits(conn, statement_timeout_ms, lock_timeout_ms):
+    """Session-level timeouts for a connection used by one request.
+
+    Our connections are autocommit, where SET LOCAL would only last until the
+    end of its own implicit transaction, so these are session-level SETs; they
+    also hold inside db.snapshot() transactions.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout = %s; SET lock_timeout = %s",
+                    (int(statement_timeout_ms), int(lock_timeout_ms)))
+
+
+def set_tenant(conn, tenant_id):
+    """Make the connection act for one tenant (see tenants.py): column
+    defaults and row-level security policies read app.tenant_id. Session-level
+    for the same reason as apply_limits(); the pool's DISCARD ALL clears it."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('app.tenant_id', %s, false)", (str(int(tenant_id)),))
+
+
+class Replica:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.lag = None          # seconds, None until first check
+        self.healthy = False
+        self.checked_at = 0.0
+
+
+class DatabaseRouter:
+    """Hands out autocommit connections to the primary or a suitable replica.
+
+    Replica lag is sampled at most every `lag_check_interval` seconds per
+    replica; a replica that fails its check or lags more than `max_lag`
+    seconds is skipped until its next check.
+    """
+
+    def __init__(self, primary_dsn, replica_dsns=(), max_lag=5, lag_check_interval=10, max_idle=4):
+        self.primary_dsn = primary_dsn
+        self.replicas = [Replica(dsn) for dsn in replica_dsns]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._lock = threading.Lock()
+        self._pools = {dsn: ConnectionPool(dsn, max_idle)
+                       for dsn in [primary_dsn] + list(replica_dsns)}
+
+    def primary(self):
+        return self._pools[self.primary_dsn].getconn()
+
+    def warm(self, count):
+        for pool in self._pools.values():
+            try:
+                pool.warm(count)
+            except Exception as e:
+                logger.warning(f"Could not warm connection pool: {e}")
+
+    def dispose(self):
+        for pool in self._pools.values():
+            pool.dispose()
+
+    def _check(self, replica):
+        conn = None
+        try:
+            conn = connect(replica.dsn)
+            with conn.cursor() as cur:
+                cur.execute(LAG_SQL)
+                replica.lag = float(cur.fetchone()[0])
+            replica.healthy = True
+        except Exception as e:
+            replica.healthy = False
+            logger.warning(f"Replica lag check failed: {e}")
+        finally:
+            replica.checked_at = time.monotonic()
+            if conn is not None:
+                conn.close()
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            stale = [r for r in self.replicas if now - r.checked_at >= self.lag_check_interval]
+            for replica in stale:
+                # Claim the check so concurrent requests don't all probe at once
+                replica.checked_at = now
+        for replica in stale:
+            self._check(replica)
+        return [r for r in self.replicas if r.healthy and r.lag is not None and r.lag <= self.max_lag]
+
+    def replica(self):
+        """Connection to the least-lagged eligible replica, else the primary."""
+        candidates = self._candidates()
+        if candidates:
+            best = min(r.lag for r in candidates)
+            # Spread load across replicas that are about equally fresh
+            replica = random.choice([r for r in candidates if r.lag - best < 1])
+            try:
+                return self._pools[replica.dsn].getconn()
+            except Exception as e:
+                replica.healthy = False
+                logger.warning(f"Replica connection failed, using primary: {e}")
+        return self.primary()
+
+    def status(self):
+        return [{'dsn_host': _host(r.dsn), 'healthy': r.healthy, 'lag': r.lag} for r in self.replicas]
+
+
+def _host(dsn):
+    for part in dsn.split():
+        if part.startswith('host='):
+            return part[len('host='):]
+    return None
+
+
+@contextmanager
+def snapshot(conn):
+    """Run the enclosed queries in one READ ONLY REPEATABLE READ transaction, so
+    totals computed by separate statements all see the same data.
+
+    `conn` is one of our autocommit connections; autocommit is left on and the
+    transaction is driven explicitly.
+    """
+    with conn.cursor() as cur:
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    try:
+        yield conn
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("ROLLBACK")
@@ -0,0 +1,171 @@
+# forecast.py - Per-vehicle, per-category spend forecasts
+#
+# Run nightly (cron):
+#
+#   flask --app app forecast-spend
+#
+# The monthly spend history of every (vehicle, category) series is loaded as
+# one matrix (series x months) and all series are forecast together with
+# array operations:
+#   * season - series with two full years of history get a seasonal index
+#              per calendar month (its ratio to the centred 12-month moving
+#              average, damped halfway towards 1); the history is divided
+#              by it before the level is taken and the forecast multiplied;
+#   * level  - 3-month moving average blended with a 12-month linear trend,
+#              both over the months since the series' first one (the trend
+#              only once a series has 6 months of history).
+# Forecasts are written to spend_forecasts for the first month after the last
+# complete one (the current month) and the quarter starting there.
+
+from datetime import date
+
+import numpy as np
+from psycopg2 import extras
+
+import reports
+
+HISTORY_MONTHS = 24
+MA_MONTHS = 3
+TREND_MONTHS = 12
+MIN_TREND_HISTORY = 6
+SEASONAL_DAMPING = 0.5
+HORIZON = 3
+
+
+def load_history(cur, first_month, end_month):
+    """(keys, matrix): keys is a list of (vehicle_id, category) and matrix
+    holds their monthly spend for [first_month, end_month), oldest first."""
+    cur.execute("""
+        SELECT vehicle_id, category, expense_month, SUM(amount) AS amount
+        FROM spendings
+        WHERE vehicle_id IS NOT NULL
+        AND expense_month >= %s AND expense_month < %s
+        GROUP BY vehicle_id, category, expense_month
+    """, (first_month, end_month))
+    rows = cur.fetchall()
+    months = (end_month.year - first_month.year) * 12 + end_month.month - first_month.month
+    if not rows:
+        return [], np.zeros((0, months))
+
+    keys = sorted({(row[0], row[1]) for row in rows})
+    index = {key: i for i, key in enumerate(keys)}
+    series = np.fromiter((index[(row[0], row[1])] for row in rows), dtype=np.intp, count=len(rows))
+    month = np.fromiter(((row[2].year - first_month.year) * 12 + row[2].month - first_month.month
+                         for row in rows), dtype=np.intp, count=len(rows))
+    amounts = np.fromiter((float(row[3]) for row in rows), dtype=float, count=len(rows))
+    matrix = np.zeros((len(keys), months))
+    np.add.at(matrix, (series, month), amounts)
+    return keys, matrix
+
+
+def _fit_lines(values, valid):
+    """Least-squares line through each row of `values` over its `valid`
+    columns (x = column number); returns (slope, intercept) per row."""
+    t = np.arange(values.shape[1], dtype=float)
+    count = np.maximum(valid.sum(axis=1), 1)
+    t_mean = (valid * t).sum(axis=1) / count
+    values_mean = np.where(valid, values, 0).sum(axis=1) / count
+    t_centered = np.where(valid, t[None, :] - t_mean[:, None], 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = ((values - values_mean[:, None]) * t_centered).sum(axis=1) / (t_centered ** 2).sum(axis=1)
+    slope = np.nan_to_num(slope, nan=0.0, posinf=0.0, neginf=0.0)
+    return slope, values_mean - slope * t_mean
+
+
+def forecast_matrix(matrix, horizon=HORIZON):
+    """Forecast the next `horizon` months of every row of `matrix` (series x
+    months, oldest first, at least 24 columns). Returns (forecasts, history)
+    where history is each series' months since its first non-zero month.
+
+    Months before a series' first non-zero month are not treated as zero
+    spend: the moving average and the trend only use the months since."""
+    n_series, n_months = matrix.shape
+    nonzero = matrix != 0
+    first = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), n_months)
+    history = n_months - first
+
+    # Seasonal index per calendar month from the last two years: the month's
+    # ratio to the centred 12-month moving average (which follows the trend,
+    # so a steady rise is not mistaken for seasonality), normalised to
+    # average 1 and damped towards 1. Column c of the last 24 is calendar
+    # slot c % 12; the centred average exists for columns 6..17, one per
+    # slot. Month k ahead is slot (k - 1) % 12.
+    two_years = matrix[:, -24:]
+    weights = np.r_[0.5, np.ones(11), 0.5] / 12
+    centred = np.lib.stride_tricks.sliding_window_view(two_years, 13, axis=1)[:, :12] @ weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        by_slot = np.roll(two_years[:, 6:18] / centred, 6, axis=1)
+        index = 1 + SEASONAL_DAMPING * (by_slot / by_slot.mean(axis=1, keepdims=True) - 1)
+    seasonal = (history >= 24) & (centred > 0).all(axis=1)
+    index = np.where(seasonal[:, None], index, 1.0)
+    deseasonalised = two_years / np.tile(index, 2)
+
+    # Moving average over the last MA_MONTHS, or fewer for younger series
+    ma_valid = np.arange(MA_MONTHS)[None, :] >= (MA_MONTHS - np.clip(history, 1, MA_MONTHS))[:, None]
+    moving_average = (np.where(ma_valid, deseasonalised[:, -MA_MONTHS:], 0).sum(axis=1)
+                      / ma_valid.sum(axis=1))
+
+    # Least-squares line through the last TREND_MONTHS of each series
+    t = np.arange(TREND_MONTHS)
+    slope, intercept = _fit_lines(deseasonalised[:, -TREND_MONTHS:],
+                                  t[None, :] >= (first - (n_months - TREND_MONTHS))[:, None])
+    steps = np.arange(1, horizon + 1)
+    trend = intercept[:, None] + slope[:, None] * (TREND_MONTHS - 1 + steps)[None, :]
+
+    level = np.where((history >= MIN_TREND_HISTORY)[:, None],
+                     (moving_average[:, None] + trend) / 2,
+                     moving_average[:, None])
+    return np.clip(level * index[:, (steps - 1) % 12], 0, None), history
+
+
+def run(cur, as_of=None):
+    """Recompute forecasts for the month containing `as_of` (default today)
+    from the complete months before it; returns the number of series.
+    Replaces that month's rows, so the caller should run it in a transaction."""
+    run_month = (as_of or date.today()).replace(day=1)
+    keys, matrix = load_history(cur, reports.add_months(run_month, -HISTORY_MONTHS), run_month)
+    cur.execute("DELETE FROM spend_forecasts WHERE run_month = %s", (run_month,))
+    if not keys:
+        return 0
+
+    forecasts, history = forecast_matrix(matrix)
+    next_month = forecasts[:, 0].round(2)
+    next_quarter = forecasts.sum(axis=1).round(2)
+    method = np.where(history >= 24, 'seasonal',
+                      np.where(history >= MIN_TREND_HISTORY, 'trend', 'moving_average'))
+    rows = [(run_month, vehicle_id, category, float(next_month[i]), float(next_quarter[i]),
+             str(method[i]), int(history[i]))
+            for i, (vehicle_id, category) in enumerate(keys)
+            # Series quiet for the whole horizon are left out
+            if next_quarter[i] > 0]
+    if rows:
+        extras.execute_values(cur, """
+            INSERT INTO spend_forecasts (run_month, vehicle_id, category, next_month, next_quarter,
+                                         method, history_months)
+            VALUES %s
+        """, rows)
+    return len(rows)
+
+
+def vehicle_forecasts(cur, run_month):
+    """Per-vehicle forecast for `run_month` next to its actual spend so far."""
+    cur.execute("""
+        SELECT v.id, v.vehicle_no,
+               COALESCE(f.next_month, 0) AS forecast_month,
+               COALESCE(f.next_quarter, 0) AS forecast_quarter,
+               COALESCE(a.actual, 0) AS actual
+        FROM vehicles v
+        LEFT JOIN (
+            SELECT vehicle_id, SUM(next_month) AS next_month, SUM(next_quarter) AS next_quarter
+            FROM spend_forecasts WHERE run_month = %(month)s
+            GROUP BY vehicle_id
+        ) f ON f.vehicle_id = v.id
+        LEFT JOIN (
+            SELECT vehicle_id, SUM(amount) AS actual
+            FROM spendings WHERE expense_month = %(month)s
+            GROUP BY vehicle_id
+        ) a ON a.vehicle_id = v.id
+        WHERE f.vehicle_id IS NOT NULL OR a.vehicle_id IS NOT NULL
+        ORDER BY forecast_month DESC, v.vehicle_no
+    """, {'month': run_month})
+    return cur.fetchall()
@@ -0,0 +1,105 @@
+# fragments.py - Helpers for streamed page rendering: lazily run row sets
+# and an in-process cache of rendered HTML fragments
+
+import threading
+from collections import OrderedDict
+
+
+class Peekable:
+    """Wraps an iterator so templates can test it for emptiness.
+
+    Truthiness pulls at most one item ahead, which keeps `{% if rows %}`
+    working on generators without materialising them. `truncated` is set by
+    lazy_rows once iteration stops at its row cap.
+    """
+
+    truncated = False
+
+    def __init__(self, iterable):
+        self._iter = iter(iterable)
+        self._peeked = []
+
+    def __bool__(self):
+        if not self._peeked:
+            for item in self._iter:
+                self._peeked.append(item)
+                break
+        return bool(self._peeked)
+
+    def __iter__(self):
+        while self._peeked:
+            yield self._peeked.pop(0)
+        yield from self._iter
+
+
+def lazy_rows(cursor_factory, sql, params=None, transform=None, batch_size=500, max_rows=None):
+    """Query result that runs on first use, so a streamed template sends the
+    page up to the table before the query runs.
+
+    The cursor is client-side: execute() receives the whole result set, and
+    fetchmany() only turns it into row objects `batch_size` at a time, so
+    memory grows with the result. `max_rows` bounds it: the query gets a
+    LIMIT (so `sql` must not have its own), at most `max_rows` rows are
+    yielded, and the result's `truncated` is set when more were available, for
+    the template to say so. A server-side cursor is not used here because it
+    would need closing on the request's connection even when the template
+    stops early, after stream_page() may have returned that connection to the
+    pool.
+
+    `transform` is applied to every row (e.g. Decimal -> float for display).
+    """
+    if max_rows is not None:
+        sql = f"{sql}\nLIMIT {int(max_rows) + 1}"
+
+    def rows():
+        yielded = 0
+        with cursor_factory() as cur:
+            cur.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    return
+                for row in batch:
+                    if max_rows is not None and yielded == max_rows:
+                        result.truncated = True
+                        return
+                    yielded += 1
+                    yield transform(row) if transform else row
+
+    result = Peekable(rows())
+    return result
+
+
+class FragmentCache:
+    """Small thread-safe LRU of rendered HTML keyed by anything hashable.
+
+    Keys should include whatever version stamp invalidates the fragment
+    (e.g. the month's periods.updated_at), so entries never need explicit
+    invalidation; stale ones simply age out.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_render(self, key, render):
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
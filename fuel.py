@@ -0,0 +1,95 @@
+# fuel.py - Fuel efficiency from diesel fills
+#
+# Diesel spendings may record the litres filled and the odometer reading at
+# the fill. Assuming full-tank fills, a fill's efficiency is the distance
+# since the vehicle's previous fill divided by the litres put in now.
+# fuel_efficiency holds one row per fill and is kept current by the
+# spendings_fuel_efficiency trigger (see create_fuel_efficiency): a new or
+# changed fill recomputes, with LAG() over the vehicle's fills, only the
+# fills from its date onwards, which for a normal entry is just itself.
+#
+# Rankings and degradation alerts below read fuel_efficiency only.
+
+
+def vehicle_series(cur, vehicle_id, limit=100):
+    """A vehicle's most recent fills with distance and km per litre."""
+    cur.execute("""
+        SELECT f.spending_id, f.date, f.odometer_km, f.litres, f.distance_km, f.km_per_litre
+        FROM fuel_efficiency f
+        WHERE f.vehicle_id = %s
+        ORDER BY f.date DESC, f.odometer_km DESC, f.spending_id DESC
+        LIMIT %s
+    """, (vehicle_id, limit))
+    return [{
+        'spending_id': row['spending_id'],
+        'date': row['date'].strftime('%Y-%m-%d'),
+        'odometer_km': row['odometer_km'],
+        'litres': float(row['litres']),
+        'distance_km': row['distance_km'],
+        'km_per_litre': float(row['km_per_litre']) if row['km_per_litre'] is not None else None,
+    } for row in cur.fetchall()]
+
+
+def ranking(cur, days=90):
+    """Vehicles ranked by km per litre over fills in the last `days` days
+    (total distance over total litres, so small top-ups don't skew it)."""
+    cur.execute("""
+        SELECT v.id AS vehicle_id, v.vehicle_no,
+               SUM(f.distance_km) AS distance_km, SUM(f.litres) AS litres, COUNT(*) AS fills,
+               ROUND(SUM(f.distance_km) / SUM(f.litres), 2) AS km_per_litre,
+               RANK() OVER (ORDER BY SUM(f.distance_km) / SUM(f.litres) DESC) AS rank
+        FROM fuel_efficiency f
+        JOIN vehicles v ON v.id = f.vehicle_id
+        WHERE f.km_per_litre IS NOT NULL
+        AND f.date >= CURRENT_DATE - %s
+        GROUP BY v.id, v.vehicle_no
+        ORDER BY rank, v.vehicle_no
+    """, (days,))
+    return [{
+        'rank': row['rank'],
+        'vehicle_id': row['vehicle_id'],
+        'vehicle_no': row['vehicle_no'],
+        'km_per_litre': float(row['km_per_litre']),
+        'distance_km': int(row['distance_km']),
+        'litres': float(row['litres']),
+        'fills': row['fills'],
+    } for row in cur.fetchall()]
+
+
+def degradation_alerts(cur, recent_fills=3, baseline_fills=10, drop_pct=15):
+    """Vehicles whose last `recent_fills` fills average at least `drop_pct`
+    percent fewer km per litre than the `baseline_fills` fills before them."""
+    cur.execute("""
+        WITH numbered AS (
+            SELECT vehicle_id, distance_km, litres,
+                   ROW_NUMBER() OVER (PARTITION BY vehicle_id
+                                      ORDER BY date DESC, odometer_km DESC, spending_id DESC) AS n
+            FROM fuel_efficiency
+            WHERE km_per_litre IS NOT NULL
+        ), windows AS (
+            SELECT vehicle_id,
+                   SUM(distance_km) FILTER (WHERE n <= %(recent)s)
+                       / NULLIF(SUM(litres) FILTER (WHERE n <= %(recent)s), 0) AS recent_kmpl,
+                   SUM(distance_km) FILTER (WHERE n > %(recent)s)
+                       / NULLIF(SUM(litres) FILTER (WHERE n > %(recent)s), 0) AS baseline_kmpl,
+                   COUNT(*) FILTER (WHERE n > %(recent)s) AS baseline_count
+            FROM numbered
+            WHERE n <= %(recent)s + %(baseline)s
+            GROUP BY vehicle_id
+            HAVING COUNT(*) FILTER (WHERE n <= %(recent)s) = %(recent)s
+        )
+        SELECT v.id AS vehicle_id, v.vehicle_no, w.recent_kmpl, w.baseline_kmpl,
+               100 * (1 - w.recent_kmpl / w.baseline_kmpl) AS drop_pct
+        FROM windows w
+        JOIN vehicles v ON v.id = w.vehicle_id
+        WHERE w.baseline_count >= %(recent)s
+        AND w.recent_kmpl <= w.baseline_kmpl * (1 - %(drop)s / 100.0)
+        ORDER BY drop_pct DESC
+    """, {'recent': recent_fills, 'baseline': baseline_fills, 'drop': drop_pct})
+    return [{
+        'vehicle_id': row['vehicle_id'],
+        'vehicle_no': row['vehicle_no'],
+        'recent_km_per_litre': round(float(row['recent_kmpl']), 2),
+        'baseline_km_per_litre': round(float(row['baseline_kmpl']), 2),
+        'drop_pct': round(float(row['drop_pct']), 1),
+    } for row in cur.fetchall()]
@@ -0,0 +1,42 @@
+# gunicorn.conf.py - Worker configuration for wsgi:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# CPU-bound work (pandas pivots, CSV exports) wants processes; database waits
+# want threads. /events (Server-Sent Events) holds a thread for as long as a
+# dashboard stays open, so each worker needs a thread per open dashboard on
+# top of the threads that serve ordinary requests:
+#
+#   threads = GUNICORN_SSE_CLIENTS + GUNICORN_REQUEST_THREADS
+#
+# Size GUNICORN_SSE_CLIENTS for (open dashboards / workers) with headroom, as
+# the master spreads streams unevenly. A stream waits on its queue without a
+# database connection, so idle stream threads are cheap. Postgres still needs
+# room for workers x threads connections in the worst case, where every
+# thread is busy with ordinary requests.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+sse_clients = int(os.environ.get('GUNICORN_SSE_CLIENTS', 32))
+request_threads = int(os.environ.get('GUNICORN_REQUEST_THREADS', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', sse_clients + request_threads))
+
+# Import the app (schema checks, template compilation) once in the master
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 90))   # above EXPORT_STATEMENT_TIMEOUT_MS
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks (DataFrame caches) can't accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from app import warm_worker
+    warm_worker()
@@ -0,0 +1,192 @@
+# ingest.py - Idempotent bulk ingestion of spendings from external feeds
+#
+# POST /api/ingest/spendings with an X-API-Key header and a JSON body:
+#   {"items": [{"external_ref": "TXN-123", "vehicle_no": "TS09AB1234",
+#               "date": "2024-05-01", "expense_month": "2024-05",
+#               "category": "diesel", "amount": "4500.00", "reason": "...",
+#               "spended_by": "TSR", "mode": "Fuel Card",
+#               "litres": "48.5", "odometer_km": 182340}, ...]}
+# category is one of CATEGORIES (case-insensitive). The feed's source name and
+# tenant come from its API key. Each item is reported back as
+# accepted (with the new id), duplicate (with the existing id) or rejected
+# (with the validation error), so a feed can safely resend a whole batch.
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from psycopg2 import extras
+
+import tenants
+
+MAX_AMOUNT = Decimal('99999999.99')      # NUMERIC(10, 2)
+FIELD_LIMITS = {'external_ref': 100, 'category': 100, 'spended_by': 50, 'mode': 50}
+# The spendings form's categories; rollups, vehicle P&L, fuel efficiency and
+# the anomaly series all match these exact (lowercase) values
+CATEGORIES = ('diesel', 'salary', 'others')
+
+COLUMNS = ('source', 'external_ref', 'vehicle_id', 'date', 'expense_month',
+           'category', 'reason', 'amount', 'spended_by', 'mode', 'litres', 'odometer_km')
+
+INSERT_SQL = f"""
+    INSERT INTO spendings ({', '.join(COLUMNS)})
+    VALUES %s
+    ON CONFLICT (tenant_id, source, external_ref) DO NOTHING
+    RETURNING external_ref, id
+"""
+
+
+def parse_api_keys(entries):
+    """'[tenant/]source:key' config entries -> {key: (tenant code or None, source)}."""
+    keys = {}
+    for entry in entries:
+        source, sep, key = entry.partition(':')
+        if not sep or not source.strip() or not key.strip():
+            raise ValueError("INGEST_API_KEYS entries must look like '[tenant/]source:key'")
+        tenant_code, source = tenants.parse_scoped(source.strip())
+        keys[key.strip()] = (tenant_code, source.strip())
+    return keys
+
+
+def _text(item, name, required=False):
+    value = item.get(name)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError(f"'{name}' is required")
+        return None
+    if not isinstance(value, (str, int)):
+        raise ValueError(f"'{name}' must be a string")
+    value = str(value).strip()
+    limit = FIELD_LIMITS.get(name)
+    if limit and len(value) > limit:
+        raise ValueError(f"'{name}' is longer than {limit} characters")
+    return value
+
+
+def _amount(value):
+    if isinstance(value, float):
+        value = repr(value)
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"Invalid amount '{value}'")
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"Invalid amount '{value}'")
+    return amount.quantize(Decimal('0.01'))
+
+
+def fill_readings(item, category):
+    """Optional (litres, odometer_km) of a diesel fill; only diesel items may
+    carry them, so readings on another category are rejected, not dropped."""
+    if category != 'diesel':
+        if any(item.get(name) not in (None, '') for name in ('litres', 'odometer_km')):
+            raise ValueError("'litres' and 'odometer_km' are only allowed on diesel items")
+        return None, None
+    litres = odometer_km = None
+    if item.get('litres') not in (None, ''):
+        litres = _amount(item['litres'])
+        if litres <= 0:
+            raise ValueError("'litres' must be positive")
+    if item.get('odometer_km') not in (None, ''):
+        try:
+            odometer_km = int(item['odometer_km'])
+        except (TypeError, ValueError):
+            raise ValueError("Invalid odometer_km")
+        if odometer_km < 0:
+            raise ValueError("'odometer_km' must not be negative")
+    return litres, odometer_km
+
+
+def validate_item(item, vehicles_by_no, vehicle_ids):
+    """One feed item -> tuple in COLUMNS order (without source); raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+    external_ref = _text(item, 'external_ref', required=True)
+
+    if item.get('vehicle_id') is not None:
+        try:
+            vehicle_id = int(item['vehicle_id'])
+        except (TypeError, ValueError):
+            raise ValueError("Invalid vehicle_id")
+        if vehicle_id not in vehicle_ids:
+            raise ValueError(f"Unknown vehicle_id {vehicle_id}")
+    else:
+        vehicle_no = _text(item, 'vehicle_no', required=True)
+        vehicle_id = vehicles_by_no.get(vehicle_no.upper())
+        if vehicle_id is None:
+            raise ValueError(f"Unknown vehicle '{vehicle_no}'")
+
+    try:
+        date_obj = datetime.strptime(_text(item, 'date', required=True), '%Y-%m-%d').date()
+        expense_month_str = _text(item, 'expense_month')
+        expense_month = (datetime.strptime(expense_month_str, '%Y-%m').date().replace(day=1)
+                         if expense_month_str else date_obj.replace(day=1))
+    except ValueError as e:
+        raise ValueError(f"Invalid date: {e}")
+
+    if item.get('amount') is None:
+        raise ValueError("'amount' is required")
+
+    category = _text(item, 'category', required=True).lower()
+    if category not in CATEGORIES:
+        raise ValueError(f"Unknown category '{category}' (expected one of {', '.join(CATEGORIES)})")
+    return (external_ref, vehicle_id, date_obj, expense_month,
+            category, _text(item, 'reason') or '',
+            _amount(item['amount']), _text(item, 'spended_by'), _text(item, 'mode'),
+            *fill_readings(item, category))
+
+
+def ingest_spendings(cur, source, items, page_size=1000):
+    """Validate and insert a batch for `source`; returns per-item results in input order.
+
+    The caller owns the transaction. Rows whose (source, external_ref) already
+    exists, or repeats within the batch, are reported as duplicates.
+    """
+    cur.execute("SELECT id, vehicle_no FROM vehicles")
+    vehicles = cur.fetchall()
+    vehicles_by_no = {row[1].strip().upper(): row[0] for row in vehicles if row[1]}
+    vehicle_ids = {row[0] for row in vehicles}
+    # Closed months reject writes (see month_close.py); report those items
+    # instead of failing the whole batch
+    cur.execute("SELECT month FROM periods WHERE status = 'closed'")
+    closed_months = {row[0] for row in cur.fetchall()}
+
+    results = []
+    rows = []
+    seen = set()
+    for index, item in enumerate(items):
+        ref = item.get('external_ref') if isinstance(item, dict) else None
+        try:
+            row = validate_item(item, vehicles_by_no, vehicle_ids)
+            if row[3] in closed_months:
+                raise ValueError(f"Month {row[3].strftime('%Y-%m')} is closed")
+        except ValueError as e:
+            results.append({'index': index, 'external_ref': ref, 'status': 'rejected', 'error': str(e)})
+            continue
+        results.append({'index': index, 'external_ref': row[0], 'status': None})
+        if row[0] not in seen:
+            seen.add(row[0])
+            rows.append((source,) + row)
+
+    inserted = {}
+    if rows:
+        returned = extras.execute_values(cur, INSERT_SQL, rows, page_size=page_size, fetch=True)
+        inserted = {ref: row_id for ref, row_id in returned}
+
+    existing = {}
+    missing = [ref for ref in seen if ref not in inserted]
+    if missing:
+        cur.execute("SELECT external_ref, id FROM spendings WHERE source = %s AND external_ref = ANY(%s)",
+                    (source, missing))
+        existing = dict(cur.fetchall())
+
+    for result in results:
+        if result['status'] is not None:
+            continue
+        ref = result['external_ref']
+        if ref in inserted:
+            result['status'] = 'accepted'
+            result['id'] = inserted.pop(ref)
+        else:
+            result['status'] = 'duplicate'
+            result['id'] = existing.get(ref)
+    return results
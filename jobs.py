@@ -0,0 +1,338 @@
+# jobs.py - Database-backed queue for heavy reports and exports
+#
+# Requests submit a job (POST /api/jobs) and poll its status; a separate
+# worker process pool started with
+#
+#   flask --app app run-jobs --processes 2
+#
+# claims queued jobs with FOR UPDATE SKIP LOCKED, writes each result file
+# under config.JOB_RESULTS_DIR and records progress as it goes. Submitting a
+# job identical (same tenant, kind and parameters) to one still queued or
+# running returns that job instead of starting another. Jobs run as the
+# tenant that submitted them.
+
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from psycopg2 import extras
+
+import reports
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# A running job's worker refreshes heartbeat_at every HEARTBEAT_INTERVAL
+# seconds, whether or not its handler reports rows; jobs whose heartbeat is
+# older than STALE_AFTER_SECONDS belong to a dead worker and are queued again
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER_SECONDS = 600
+POLL_INTERVAL = 2
+PROGRESS_INTERVAL = 1.0
+
+
+# Job kinds
+# ----------------------------------------------------
+# Each handler takes (conn, params, progress, out) and writes CSV text to
+# `out`; it returns the download filename.
+
+def _export(data_type):
+    def run(conn, params, progress, out):
+        sql, filename = reports.EXPORT_QUERIES[data_type]
+        reports.write_query_csv(conn, sql, None, out, progress)
+        return filename
+    return run
+
+
+def _hired_vehicles_audit(conn, params, progress, out):
+    with conn.cursor() as cur:
+        sql, sql_params, filename = reports.hired_vehicles_audit_export(
+            cur, params['month'], params.get('vehicle_id', 'all'))
+    reports.write_query_csv(conn, sql, sql_params, out, progress)
+    return filename
+
+
+def _company_audit(conn, params, progress, out):
+    sql, sql_params, filename = reports.company_audit_export(params['month'], params.get('company', 'all'))
+    reports.write_query_csv(conn, sql, sql_params, out, progress)
+    return filename
+
+
+def _vehicle_pnl(conn, params, progress, out):
+    with conn.cursor(cursor_factory=extras.DictCursor) as cur:
+        rows = reports.vehicle_pnl(cur, reports.parse_month(params.get('from')),
+                                   reports.parse_month(params.get('to')), params.get('vehicle_ids'))
+    out.write(reports.rows_to_csv(rows))
+    progress(len(rows))
+    return 'vehicle_pnl.csv'
+
+
+def _employee_statement(conn, params, progress, out):
+    # The generator closes `conn` when done; run_job's own close is then a no-op
+    written = 0
+    for chunk in reports.iter_employee_statement_csv(conn, params['employee'],
+                                                     reports.parse_date(params.get('from')),
+                                                     reports.parse_date(params.get('to'))):
+        out.write(chunk)
+        written += chunk.count('\n')
+        progress(written)
+    return f"statement_{params['employee']}.csv"
+
+
+HANDLERS = {kind: _export(kind) for kind in reports.EXPORT_QUERIES}
+HANDLERS.update({
+    'hired_vehicles_audit': _hired_vehicles_audit,
+    'company_audit': _company_audit,
+    'vehicle_pnl': _vehicle_pnl,
+    'employee_statement': _employee_statement,
+})
+
+
+def _params_hash(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _job_dict(row):
+    if row is None:
+        return None
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'params': row['params'],
+        'status': row['status'],
+        'rows_done': row['rows_done'],
+        'message': row['message'],
+        'error': row['error'],
+        'filename': row['result_name'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'started_at': row['started_at'].isoformat() if row['started_at'] else None,
+        'finished_at': row['finished_at'].isoformat() if row['finished_at'] else None,
+    }
+
+
+# Queue operations
+# ----------------------------------------------------
+
+def submit(cur, kind, params, submitted_by=None):
+    """Queue a job, or return the identical queued/running one: (job, created)."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    params_hash = _params_hash(kind, params)
+    cur.execute("""
+        INSERT INTO jobs (kind, params, params_hash, submitted_by)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (tenant_id, kind, params_hash) WHERE status IN ('queued', 'running') DO NOTHING
+        RETURNING *
+    """, (kind, json.dumps(params), params_hash, submitted_by))
+    row = cur.fetchone()
+    if row is not None:
+        return _job_dict(row), True
+    cur.execute("""
+        SELECT * FROM jobs
+        WHERE kind = %s AND params_hash = %s AND status IN ('queued', 'running')
+    """, (kind, params_hash))
+    row = cur.fetchone()
+    if row is None:
+        # Finished between the insert and the select; queue a fresh one
+        return submit(cur, kind, params, submitted_by)
+    return _job_dict(row), False
+
+
+def get(cur, job_id):
+    cur.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
+    return _job_dict(cur.fetchone())
+
+
+def recent(cur, submitted_by=None, limit=50):
+    cur.execute("""
+        SELECT * FROM jobs
+        WHERE %(user)s IS NULL OR submitted_by = %(user)s
+        ORDER BY id DESC LIMIT %(limit)s
+    """, {'user': submitted_by, 'limit': limit})
+    return [_job_dict(row) for row in cur.fetchall()]
+
+
+def result_path(results_dir, job_id):
+    return os.path.join(results_dir, f"job_{int(job_id)}.csv")
+
+
+def _claim(cur, worker):
+    cur.execute("""
+        UPDATE jobs
+        SET status = 'running', started_at = CURRENT_TIMESTAMP,
+            heartbeat_at = CURRENT_TIMESTAMP, worker = %s
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued'
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, params
+    """, (worker,))
+    return cur.fetchone()
+
+
+def _requeue_stale(cur):
+    cur.execute("""
+        UPDATE jobs SET status = 'queued', worker = NULL, rows_done = 0,
+               message = 'Requeued after its worker stopped responding'
+        WHERE status = 'running'
+        AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (STALE_AFTER_SECONDS,))
+    if cur.rowcount:
+        logger.warning(f"Requeued {cur.rowcount} stale jobs")
+
+
+def _expire_results(cur, results_dir, ttl_hours):
+    cur.execute("""
+        UPDATE jobs SET status = 'expired'
+        WHERE status = 'done'
+        AND finished_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+        RETURNING id
+    """, (ttl_hours,))
+    for (job_id,) in cur.fetchall():
+        try:
+            os.remove(result_path(results_dir, job_id))
+        except FileNotFoundError:
+            pass
+
+
+# Worker
+# ----------------------------------------------------
+
+def _heartbeat(status_conn, lock, stop, job_id, worker):
+    """Keep a running job's heartbeat fresh until `stop` is set."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            with lock, status_conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker = %s
+                """, (job_id, worker))
+        except Exception as e:
+            logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+
+def run_job(conn_factory, results_dir, job_id, kind, params, worker):
+    """Run one claimed job to completion, recording progress and the outcome.
+
+    Status updates only apply while the job is still this worker's, so a job
+    requeued from under a worker is not overwritten by it."""
+    status_conn = conn_factory()
+    status_lock = threading.Lock()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(status_conn, status_lock, stop, job_id, worker),
+                                 name=f"job-{job_id}-heartbeat", daemon=True)
+    heartbeat.start()
+    last_update = [0.0]
+    done = [0]
+
+    def progress(rows_done):
+        done[0] = rows_done
+        now = time.monotonic()
+        if now - last_update[0] < PROGRESS_INTERVAL:
+            return
+        last_update[0] = now
+        with status_lock, status_conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET rows_done = %s, heartbeat_at = CURRENT_TIMESTAMP,
+                       message = %s
+                WHERE id = %s AND worker = %s
+            """, (rows_done, f"{rows_done} rows written", job_id, worker))
+
+    path = result_path(results_dir, job_id)
+    # Per process, so a worker that lost the job can't clobber the new run's file
+    partial = f"{path}.{os.getpid()}.part"
+    conn = conn_factory()
+    try:
+        with open(partial, 'w', newline='', encoding='utf-8') as out:
+            filename = HANDLERS[kind](conn, params, progress, out)
+        stop.set()
+        heartbeat.join()
+        with status_lock, status_conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP,
+                       result_name = %s, message = 'Finished', rows_done = %s
+                WHERE id = %s AND worker = %s AND status = 'running'
+            """, (filename, done[0], job_id, worker))
+            owned = cur.rowcount == 1
+        if owned:
+            os.replace(partial, path)
+            logger.info(f"Job {job_id} ({kind}) finished")
+        else:
+            os.remove(partial)
+            logger.warning(f"Job {job_id} ({kind}) was requeued while running; result discarded")
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
+        with status_lock, status_conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET status = 'failed', finished_at = CURRENT_TIMESTAMP, error = %s
+                WHERE id = %s AND worker = %s
+            """, (str(e), job_id, worker))
+    finally:
+        stop.set()
+        heartbeat.join()
+        conn.close()
+        status_conn.close()
+
+
+def work(conn_factory, results_dir, ttl_hours=24, once=False):
+    """Worker loop: claim and run jobs until the process is stopped.
+
+    `conn_factory(tenant_id)` returns a connection acting for that tenant
+    (`conn_factory()` one that can only list tenants). Each pass takes at most
+    one job per tenant, so a depot with a long queue doesn't hold up the rest.
+    """
+    worker = f"{os.uname().nodename}:{os.getpid()}"
+    os.makedirs(results_dir, exist_ok=True)
+    while True:
+        conn = conn_factory()
+        try:
+            with conn.cursor() as cur:
+                tenant_ids = [tenant_id for tenant_id, _ in tenants.all_tenants(cur)]
+        finally:
+            conn.close()
+        claimed = False
+        for tenant_id in tenant_ids:
+            conn = conn_factory(tenant_id)
+            try:
+                with conn.cursor() as cur:
+                    _requeue_stale(cur)
+                    _expire_results(cur, results_dir, ttl_hours)
+                    job = _claim(cur, worker)
+            finally:
+                conn.close()
+            if job is not None:
+                job_id, kind, params = job
+                run_job(functools.partial(conn_factory, tenant_id), results_dir, job_id, kind, params, worker)
+                claimed = True
+        if claimed:
+            continue
+        if once:
+            return
+        time.sleep(POLL_INTERVAL)
+
+
+def run_pool(conn_factory, results_dir, processes=2, ttl_hours=24):
+    """Run `processes` worker processes and wait for them (Ctrl-C stops all)."""
+    workers = [multiprocessing.Process(target=work, args=(conn_factory, results_dir, ttl_hours),
+                                       name=f"job-worker-{i}", daemon=True)
+               for i in range(processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
@@ -0,0 +1,209 @@
+# journal.py - Double-entry journal: the single source of ledger balances
+#
+# Every row of spendings, payments, employee_advances, company_sales,
+# company_payments and hired_vehicle_transactions posts one balanced entry
+# (see journal_lines() / journal_post() in create_journal_tables). Amounts are
+# signed: debits positive, credits negative. account_balances keeps running
+# debit and credit totals per account in the same transaction as the write,
+# so balances are single-row lookups.
+#
+# Accounts
+#   cash                      payments in (Dr), paid spendings out (Cr)
+#   income:payments           payments received (Cr)
+#   expense:<category>        spendings (Dr)
+#   payable:unpaid            spendings not yet paid (Cr); settled when paid
+#   employee:<name>           advances given (Dr), spendings they paid (Cr)
+#   clearing:employee         contra account for the employee memo postings
+#   receivable:<company>      company sales (Dr), company payments (Cr)
+#   income:company_sales      company sales (Cr)
+#   cash:company_receipts     company payments received (Dr)
+#   hired:<hired_vehicle_id>  hired vehicle sales (Dr), payments (Cr)
+#   income:hired_vehicles     hired vehicle sales (Cr)
+#   cash:hired_receipts       hired vehicle payments received (Dr)
+#
+# A spending is paid when both spended_by and mode are set, as on the
+# spendings and incoming pages.
+#
+# Point-in-time balances: account_balance_checkpoints holds each account's
+# totals over postings dated before the first day of a month. A balance as of
+# any date is the nearest checkpoint plus at most a month of postings, so old
+# dates cost the same as recent ones. Back-dated postings adjust the later
+# checkpoints from a trigger on journal_postings; create_checkpoints() adds
+# the missing months (run by close_month and `flask --app app checkpoint-journal`).
+
+from datetime import date, timedelta
+
+import reports
+
+CASH = 'cash'
+INCOME_PAYMENTS = 'income:payments'
+UNPAID = 'payable:unpaid'
+EMPLOYEE_PREFIX = 'employee:'
+RECEIVABLE_PREFIX = 'receivable:'
+HIRED_PREFIX = 'hired:'
+EXPENSE_PREFIX = 'expense:'
+
+
+def _row(row):
+    return {
+        'account': row['account'],
+        'debits': float(row['debits']),
+        'credits': float(row['credits']),
+        'balance': float(row['balance']),
+        'postings': row['postings'],
+    }
+
+
+def _like_prefix(prefix):
+    return prefix.replace('%', r'\%').replace('_', r'\_') + '%'
+
+
+def balances(cur, *accounts):
+    """account -> {debits, credits, balance, postings}; missing accounts are zero."""
+    cur.execute("SELECT * FROM account_balances WHERE account = ANY(%s)", (list(accounts),))
+    found = {row['account']: _row(row) for row in cur.fetchall()}
+    return {account: found.get(account, {'account': account, 'debits': 0.0, 'credits': 0.0,
+                                         'balance': 0.0, 'postings': 0})
+            for account in accounts}
+
+
+def balances_with_prefix(cur, prefix):
+    cur.execute("""
+        SELECT * FROM account_balances
+        WHERE account LIKE %s
+        ORDER BY account
+    """, (_like_prefix(prefix),))
+    return [_row(row) for row in cur.fetchall()]
+
+
+def balances_as_of(cur, as_of, accounts=None, prefix=None):
+    """Balances over postings dated on or before `as_of`, for the given
+    accounts or every account starting with `prefix`; same row shape as
+    balances_with_prefix()."""
+    params = {'accounts': list(accounts or []),
+              'prefix': _like_prefix(prefix) if prefix is not None else None,
+              'before': as_of + timedelta(days=1)}
+    cur.execute("""
+        WITH accts AS (
+            SELECT account FROM account_balances
+            WHERE account = ANY(%(accounts)s) OR account LIKE %(prefix)s
+        ), cp AS (
+            SELECT DISTINCT ON (c.account) c.account, c.month, c.debits, c.credits, c.postings
+            FROM account_balance_checkpoints c
+            JOIN accts a ON a.account = c.account
+            WHERE c.month <= %(before)s
+            ORDER BY c.account, c.month DESC
+        )
+        SELECT a.account,
+               COALESCE(cp.debits, 0) + COALESCE(SUM(GREATEST(p.amount, 0)), 0) AS debits,
+               COALESCE(cp.credits, 0) + COALESCE(SUM(GREATEST(-p.amount, 0)), 0) AS credits,
+               COALESCE(cp.postings, 0) + COUNT(p.amount) AS postings
+        FROM accts a
+        LEFT JOIN cp ON cp.account = a.account
+        LEFT JOIN journal_postings p
+            ON p.account = a.account
+            AND p.entry_date >= COALESCE(cp.month, '-infinity'::date)
+            AND p.entry_date < %(before)s
+        GROUP BY a.account, cp.debits, cp.credits, cp.postings
+        ORDER BY a.account
+    """, params)
+    rows = {}
+    for row in cur.fetchall():
+        debits, credits = float(row['debits']), float(row['credits'])
+        rows[row['account']] = {'account': row['account'], 'debits': debits, 'credits': credits,
+                                'balance': debits - credits, 'postings': row['postings']}
+    for account in accounts or []:
+        rows.setdefault(account, {'account': account, 'debits': 0.0, 'credits': 0.0,
+                                  'balance': 0.0, 'postings': 0})
+    return [rows[account] for account in sorted(rows)]
+
+
+def create_checkpoints(cur, upto=None):
+    """Add the missing monthly checkpoints up to `upto` (first day of a month,
+    default this month), each built from the previous one plus that month's
+    postings. Must run inside a transaction; returns the months created."""
+    upto = (upto or date.today()).replace(day=1)
+    # Postings written while a checkpoint is summed would miss its adjustment
+    cur.execute("LOCK TABLE journal_postings IN SHARE MODE")
+    cur.execute("SELECT MAX(month) FROM account_balance_checkpoints")
+    last = cur.fetchone()[0]
+    if last is None:
+        cur.execute("SELECT MIN(entry_date) FROM journal_postings")
+        first = cur.fetchone()[0]
+        if first is None:
+            return []
+        month = reports.add_months(first.replace(day=1), 1)
+    else:
+        month = reports.add_months(last, 1)
+
+    created = []
+    while month <= upto:
+        cur.execute("""
+            INSERT INTO account_balance_checkpoints (month, account, debits, credits, postings)
+            SELECT %(month)s, account, SUM(debits), SUM(credits), SUM(postings)
+            FROM (
+                SELECT account, debits, credits, postings
+                FROM account_balance_checkpoints WHERE month = %(prev)s
+                UNION ALL
+                SELECT account, SUM(GREATEST(amount, 0)), SUM(GREATEST(-amount, 0)), COUNT(*)
+                FROM journal_postings
+                WHERE entry_date < %(month)s AND (%(prev)s::date IS NULL OR entry_date >= %(prev)s)
+                GROUP BY account
+            ) t
+            GROUP BY account
+        """, {'month': month, 'prev': last})
+        created.append(month)
+        last = month
+        month = reports.add_months(month, 1)
+    return created
+
+
+def ledger_totals(cur, payers=('TSR', 'MSR')):
+    """Main-ledger totals used by the dashboard, spendings and incoming pages."""
+    accounts = balances(cur, CASH, UNPAID, *(EMPLOYEE_PREFIX + p for p in payers))
+    cash = accounts[CASH]
+    return {
+        'credited': cash['debits'],
+        'debited': cash['credits'],
+        'balance': cash['balance'],
+        'unpaid': -accounts[UNPAID]['balance'],
+        'spent_by': {p: accounts[EMPLOYEE_PREFIX + p]['credits'] for p in payers},
+    }
+
+
+def employee_balances(cur):
+    """Same rows as the employee_balance view: employees who received advances."""
+    return [{
+        'employee_name': row['account'][len(EMPLOYEE_PREFIX):],
+        'total_advances': row['debits'],
+        'total_expenses': row['credits'],
+        'balance': row['balance'],
+    } for row in balances_with_prefix(cur, EMPLOYEE_PREFIX) if row['debits'] > 0]
+
+
+def verify(cur):
+    """Check every entry balances and account_balances matches the postings."""
+    cur.execute("""
+        SELECT e.source_table, e.source_id, SUM(p.amount) AS imbalance
+        FROM journal_entries e
+        JOIN journal_postings p ON p.entry_id = e.id
+        GROUP BY e.id, e.source_table, e.source_id
+        HAVING SUM(p.amount) <> 0
+        LIMIT 20
+    """)
+    unbalanced = [{'source': row['source_table'], 'id': row['source_id'],
+                   'imbalance': float(row['imbalance'])} for row in cur.fetchall()]
+    cur.execute("""
+        SELECT COALESCE(b.account, p.account) AS account,
+               COALESCE(b.balance, 0) AS stored, COALESCE(p.balance, 0) AS posted
+        FROM account_balances b
+        FULL JOIN (
+            SELECT account, SUM(amount) AS balance FROM journal_postings GROUP BY account
+        ) p ON p.account = b.account
+        WHERE COALESCE(b.balance, 0) <> COALESCE(p.balance, 0)
+        LIMIT 20
+    """)
+    mismatched = [{'account': row['account'], 'stored': float(row['stored']),
+                   'posted': float(row['posted'])} for row in cur.fetchall()]
+    return {'consistent': not unbalanced and not mismatched,
+            'unbalanced_entries': unbalanced, 'mismatched_accounts': mismatched}
@@ -0,0 +1,180 @@
+# listener.py - Background LISTEN/NOTIFY consumer for row-level change notifications
+
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'ledger_changes'
+
+
+class ChangeListener:
+    """Listens on a PostgreSQL channel in a daemon thread and hands batches of
+    decoded notifications to every subscriber.
+
+    Payloads are the JSON objects emitted by notify_ledger_change():
+    {"table": ..., "op": "INSERT" | "UPDATE" | "DELETE", "id": ..., "tenant": ...}.
+    Subscribers may also pass `on_disconnect`, called when the connection is
+    lost, and `on_reconnect`, called once it is back, since notifications
+    sent while disconnected are gone.
+    """
+
+    def __init__(self, conn_factory, channel=CHANNEL, poll_timeout=5):
+        self.conn_factory = conn_factory
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self._subscribers = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.connected = threading.Event()
+
+    def subscribe(self, callback, on_reconnect=None, on_disconnect=None):
+        self._subscribers.append((callback, on_reconnect, on_disconnect))
+
+    def start(self):
+        """Start the listener thread once per process (safe to call on every request)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ledger-listener', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        backoff = 1
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = self.conn_factory()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self.connected.set()
+                if not first:
+                    self._dispatch_reconnect()
+                first = False
+                backoff = 1
+                while True:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    events = []
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        try:
+                            events.append(json.loads(note.payload))
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed notification: {note.payload!r}")
+                    if events:
+                        self._dispatch(events)
+            except Exception as e:
+                self.connected.clear()
+                self._dispatch_disconnect()
+                logger.error(f"Change listener error, reconnecting in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, events):
+        for callback, _, _ in self._subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"Change subscriber {callback!r} failed: {e}")
+
+    def _dispatch_reconnect(self):
+        for _, on_reconnect, _ in self._subscribers:
+            if on_reconnect is None:
+                continue
+            try:
+                on_reconnect()
+            except Exception as e:
+                logger.error(f"Change subscriber reconnect hook {on_reconnect!r} failed: {e}")
+
+    def _dispatch_disconnect(self):
+        for _, _, on_disconnect in self._subscribers:
+            if on_disconnect is None:
+                continue
+            try:
+                on_disconnect()
+            except Exception as e:
+                logger.error(f"Change subscriber disconnect hook {on_disconnect!r} failed: {e}")
+
+
+class EventBroadcaster:
+    """Fans notification batches out to per-client queues (one per SSE stream).
+
+    A client that stops reading is dropped once its queue fills up, rather
+    than blocking the listener thread. A client registered for a tenant only
+    gets that tenant's events (and the tenant-less RESYNC).
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def register(self, tenant_id=None):
+        client = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._clients[client] = tenant_id
+        return client
+
+    def unregister(self, client):
+        with self._lock:
+            self._clients.pop(client, None)
+
+    def publish(self, events):
+        with self._lock:
+            clients = list(self._clients.items())
+        for client, tenant_id in clients:
+            if tenant_id is not None:
+                events_for_client = [e for e in events if e.get('tenant', tenant_id) == tenant_id]
+                if not events_for_client:
+                    continue
+            else:
+                events_for_client = events
+            try:
+                client.put_nowait(events_for_client)
+            except queue.Full:
+                # Tell the stream to end; the browser reconnects and resyncs.
+                self.unregister(client)
+                with client.mutex:
+                    client.queue.clear()
+                client.put_nowait(None)
+                logger.warning("Dropping a live-update client that fell behind")
+
+    def resync(self):
+        """Ask every client to reload its state (notifications may have been missed)."""
+        self.publish([{'op': 'RESYNC'}])
+
+    def stream(self, client, heartbeat=15):
+        """Yield Server-Sent Events for a registered client until it disconnects."""
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    events = client.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if events is None:
+                    yield 'event: change\ndata: {"op": "RESYNC"}\n\n'
+                    return
+                for event in events:
+                    yield f"event: change\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unregister(client)
@@ -0,0 +1,178 @@
+# month_close.py - Closing months: edit lock plus immutable snapshot totals
+#
+# Closing a month (periods.status = 'closed') does two things in one
+# transaction:
+#   * writes the month's per-vehicle, per-category, per-employee, per-company
+#     and per-hired-vehicle totals into the period_*_totals tables, which
+#     reports read instead of re-aggregating raw rows;
+#   * from then on the reject_closed_period_change() triggers refuse inserts,
+#     updates and deletes of rows dated in that month (and the snapshot rows
+#     themselves are read-only until the month is reopened).
+# It also adds the journal's monthly balance checkpoints up to the start of
+# the following month (see journal.py).
+
+import journal
+
+# Snapshot table -> INSERT ... SELECT filling it for month %(month)s
+SNAPSHOTS = {
+    'period_vehicle_totals': """
+        INSERT INTO period_vehicle_totals (month, vehicle_id, vehicle_no, paid_amount, unpaid_amount, entries)
+        SELECT %(month)s, v.id, v.vehicle_no,
+               COALESCE(SUM(s.amount) FILTER (WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL), 0),
+               COALESCE(SUM(s.amount) FILTER (WHERE s.spended_by IS NULL OR s.mode IS NULL), 0),
+               COUNT(*)
+        FROM spendings s
+        JOIN vehicles v ON v.id = s.vehicle_id
+        WHERE s.expense_month >= %(month)s AND s.expense_month < %(next_month)s
+        GROUP BY v.id, v.vehicle_no
+    """,
+    'period_category_totals': """
+        INSERT INTO period_category_totals (month, category, amount, entries)
+        SELECT %(month)s, s.category, SUM(s.amount), COUNT(*)
+        FROM spendings s
+        WHERE s.expense_month >= %(month)s AND s.expense_month < %(next_month)s
+        GROUP BY s.category
+    """,
+    'period_employee_totals': """
+        INSERT INTO period_employee_totals (month, employee_name, advances, expenses)
+        SELECT %(month)s, employee_name, SUM(advances), SUM(expenses)
+        FROM (
+            SELECT employee_name, amount AS advances, 0 AS expenses
+            FROM employee_advances
+            WHERE date >= %(month)s AND date < %(next_month)s
+            UNION ALL
+            SELECT spended_by, 0, amount
+            FROM spendings
+            WHERE spended_by IS NOT NULL
+            AND expense_month >= %(month)s AND expense_month < %(next_month)s
+        ) e
+        GROUP BY employee_name
+    """,
+    'period_company_totals': """
+        INSERT INTO period_company_totals (month, company_name, sales_amount, received_amount)
+        SELECT %(month)s, company_name, SUM(sales_amount), SUM(received_amount)
+        FROM (
+            SELECT company_name, sale_amount AS sales_amount, 0 AS received_amount
+            FROM company_sales WHERE month_year = %(month)s
+            UNION ALL
+            SELECT company_name, 0, received_amount
+            FROM company_payments WHERE month_year = %(month)s
+        ) c
+        GROUP BY company_name
+    """,
+    'period_hired_vehicle_totals': """
+        INSERT INTO period_hired_vehicle_totals (month, hired_vehicle_id, vehicle_no, owner_name,
+                                                 total_sales, total_payments)
+        SELECT %(month)s, hv.id, hv.vehicle_no, hv.owner_name,
+               COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0)
+        FROM hired_vehicles hv
+        LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %(month)s
+        GROUP BY hv.id, hv.vehicle_no, hv.owner_name
+    """,
+}
+
+
+def _next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def is_closed(cur, month):
+    cur.execute("SELECT status = 'closed' FROM periods WHERE month = %s", (month,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def close_month(cur, month, closed_by=None, force=False):
+    """Snapshot and lock `month` (first day of the month). Must run inside a
+    transaction. Refuses while the month still has unpaid spendings unless
+    `force` is set, since settling them afterwards would be an edit."""
+    cur.execute("""
+        INSERT INTO periods (month) VALUES (%s)
+        ON CONFLICT (tenant_id, month) DO NOTHING
+    """, (month,))
+    cur.execute("SELECT status FROM periods WHERE month = %s FOR UPDATE", (month,))
+    if cur.fetchone()[0] == 'closed':
+        raise ValueError(f"{month.strftime('%Y-%m')} is already closed")
+
+    # Block writers while the totals are taken; the lock trigger takes over at commit
+    cur.execute("""
+        LOCK TABLE spendings, payments, employee_advances, hired_vehicle_transactions,
+                   company_sales, company_payments IN SHARE MODE
+    """)
+    params = {'month': month, 'next_month': _next_month(month)}
+    if not force:
+        cur.execute("""
+            SELECT COUNT(*) FROM spendings
+            WHERE (spended_by IS NULL OR mode IS NULL)
+            AND expense_month >= %(month)s AND expense_month < %(next_month)s
+        """, params)
+        unpaid = cur.fetchone()[0]
+        if unpaid:
+            raise ValueError(f"{month.strftime('%Y-%m')} still has {unpaid} unpaid spendings; "
+                             f"settle them first or close with force")
+
+    for table, sql in SNAPSHOTS.items():
+        cur.execute(f"DELETE FROM {table} WHERE month = %s", (month,))
+        cur.execute(sql, params)
+    journal.create_checkpoints(cur, params['next_month'])
+    cur.execute("""
+        UPDATE periods
+        SET status = 'closed', closed_at = CURRENT_TIMESTAMP, closed_by = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE month = %s
+    """, (closed_by, month))
+
+
+def reopen_month(cur, month):
+    """Unlock `month` and drop its snapshots; reports fall back to raw rows."""
+    cur.execute("""
+        UPDATE periods
+        SET status = 'open', closed_at = NULL, closed_by = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE month = %s AND status = 'closed'
+    """, (month,))
+    if cur.rowcount == 0:
+        raise ValueError(f"{month.strftime('%Y-%m')} is not closed")
+    for table in SNAPSHOTS:
+        cur.execute(f"DELETE FROM {table} WHERE month = %s", (month,))
+
+
+# Snapshot readers (same row shapes as the live queries they replace)
+# ----------------------------------------------------
+
+def vehicle_totals(cur, month):
+    cur.execute("""
+        SELECT vehicle_no, %s::date AS expense_month, paid_amount + unpaid_amount AS monthly_total
+        FROM period_vehicle_totals
+        WHERE month = %s
+        ORDER BY monthly_total DESC
+    """, (month, month))
+    return cur.fetchall()
+
+
+def month_total(cur, month):
+    cur.execute("""
+        SELECT COALESCE(SUM(paid_amount + unpaid_amount), 0) AS total
+        FROM period_vehicle_totals WHERE month = %s
+    """, (month,))
+    return cur.fetchone()['total']
+
+
+def hired_vehicle_summary(cur, month, vehicle_id=None):
+    cur.execute("""
+        SELECT hired_vehicle_id AS id, vehicle_no, owner_name, total_sales, total_payments
+        FROM period_hired_vehicle_totals
+        WHERE month = %(month)s AND (%(vehicle_id)s IS NULL OR hired_vehicle_id = %(vehicle_id)s)
+        ORDER BY vehicle_no
+    """, {'month': month, 'vehicle_id': vehicle_id})
+    return cur.fetchall()
+
+
+def company_totals(cur, month, company=None):
+    cur.execute("""
+        SELECT company_name, sales_amount, received_amount
+        FROM period_company_totals
+        WHERE month = %(month)s AND (%(company)s IS NULL OR company_name = %(company)s)
+        ORDER BY company_name
+    """, {'month': month, 'company': company})
+    return cur.fetchall()
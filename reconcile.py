@@ -0,0 +1,346 @@
+# reconcile.py - Matching bank / fuel-card statement lines to spendings
+#
+# A statement CSV is imported into statement_lines, then matched against
+# spendings in one pass:
+#   one-to-one   same amount, date within the window; candidates come from an
+#                amount -> date-sorted index, so each line only looks at
+#                spendings of exactly its amount near its date
+#   many-to-one  one statement debit settling several unpaid spendings (the
+#                "Diesel - Unpaid" items later closed by process_settlement):
+#                a run of consecutive unpaid spendings, in date order, whose
+#                amounts add up to the line; every run's total is indexed
+#                once, so each line is a dict lookup
+# Proposals are stored in reconciliation_matches and confirmed in bulk.
+
+import csv
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from io import StringIO
+
+from psycopg2 import extras
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d-%b-%Y', '%d %b %Y', '%d/%m/%y')
+DATE_HEADERS = ('date', 'txn date', 'transaction date', 'value date', 'posting date')
+AMOUNT_HEADERS = ('debit', 'withdrawal', 'withdrawal amt', 'debit amount', 'amount')
+DESCRIPTION_HEADERS = ('description', 'narration', 'particulars', 'remarks', 'details')
+REFERENCE_HEADERS = ('reference', 'ref no', 'chq/ref no', 'transaction id', 'txn id', 'reference no')
+
+MAX_RUN = 20    # most unpaid spendings one statement line may settle
+
+
+def _paise(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised date '{value}'")
+
+
+def _parse_amount(value):
+    value = (value or '').replace(',', '').replace('₹', '').strip()
+    if not value:
+        return None
+    try:
+        return abs(Decimal(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount '{value}'")
+
+
+def _column(header, names):
+    lowered = [h.strip().lower() for h in header]
+    for name in names:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+
+def parse_statement(text):
+    """Statement CSV -> list of dicts (line_no, date, amount, description, reference).
+
+    Column names are matched loosely (Date/Txn Date, Debit/Withdrawal/Amount,
+    Narration/Description, ...). Lines without a debit amount (credits,
+    balances, blank rows) are skipped.
+    """
+    reader = csv.reader(StringIO(text))
+    header = next(reader, None)
+    if not header:
+        raise ValueError("Statement is empty")
+    date_col = _column(header, DATE_HEADERS)
+    amount_col = _column(header, AMOUNT_HEADERS)
+    if date_col is None or amount_col is None:
+        raise ValueError("Statement needs a date column and a debit/amount column")
+    description_col = _column(header, DESCRIPTION_HEADERS)
+    reference_col = _column(header, REFERENCE_HEADERS)
+
+    lines = []
+    for line_no, row in enumerate(reader, start=2):
+        if len(row) <= max(date_col, amount_col) or not row[date_col].strip():
+            continue
+        try:
+            amount = _parse_amount(row[amount_col])
+            if not amount:
+                continue
+            lines.append({
+                'line_no': line_no,
+                'date': _parse_date(row[date_col]),
+                'amount': amount,
+                'description': row[description_col].strip() if description_col is not None and len(row) > description_col else None,
+                'reference': row[reference_col].strip() if reference_col is not None and len(row) > reference_col else None,
+            })
+        except ValueError as e:
+            raise ValueError(f"Line {line_no}: {e}")
+    return lines
+
+
+def import_statement(cur, source, filename, mode, lines):
+    """Store a parsed statement; returns the import id."""
+    cur.execute("""
+        INSERT INTO statement_imports (source, filename, mode, line_count)
+        VALUES (%s, %s, %s, %s) RETURNING id
+    """, (source, filename, mode, len(lines)))
+    import_id = cur.fetchone()[0]
+    extras.execute_values(cur, """
+        INSERT INTO statement_lines (import_id, line_no, date, amount, description, reference)
+        VALUES %s
+    """, [(import_id, l['line_no'], l['date'], l['amount'], l['description'], l['reference'])
+          for l in lines], page_size=1000)
+    return import_id
+
+
+def _candidates(cur, date_from, date_to):
+    """Spendings in the date range not already part of a confirmed match."""
+    cur.execute("""
+        SELECT s.id, s.date, s.amount, s.mode,
+               (s.spended_by IS NULL OR s.mode IS NULL) AS unpaid
+        FROM spendings s
+        WHERE s.date BETWEEN %s AND %s
+        AND NOT EXISTS (
+            SELECT 1 FROM reconciliation_matches m
+            WHERE m.status = 'confirmed' AND s.id = ANY(m.spending_ids)
+        )
+        ORDER BY s.date, s.id
+    """, (date_from, date_to))
+    return [(row[0], row[1], _paise(row[2]), row[3], row[4]) for row in cur.fetchall()]
+
+
+def propose_matches(lines, spendings, mode=None, window_days=3):
+    """Pure matching step: `lines` are (line_id, date, paise), `spendings` are
+    (id, date, paise, mode, unpaid) sorted by date. Returns proposals as
+    (line_id, [spending_ids], confidence, kind).
+    """
+    # amount -> spendings of that amount, in date order
+    by_amount = defaultdict(list)
+    for spending in spendings:
+        by_amount[spending[2]].append(spending)
+    dates_by_amount = {amount: [s[1] for s in group] for amount, group in by_amount.items()}
+    window = timedelta(days=window_days)
+
+    pairs = []
+    for line_id, line_date, paise in lines:
+        group = by_amount.get(paise)
+        if not group:
+            continue
+        dates = dates_by_amount[paise]
+        lo = bisect_left(dates, line_date - window)
+        hi = bisect_right(dates, line_date + window)
+        for spending_id, spending_date, _, spending_mode, unpaid in group[lo:hi]:
+            days = abs((line_date - spending_date).days)
+            confidence = 0.6 + 0.3 * (1 - days / (window_days + 1))
+            if mode and spending_mode and spending_mode.lower() == mode.lower():
+                confidence += 0.1
+            elif unpaid:
+                confidence += 0.05
+            pairs.append((round(confidence, 2), -days, line_id, spending_id))
+
+    # Greedy one-to-one assignment, best pairs first
+    pairs.sort(reverse=True)
+    proposals = []
+    used_lines, used_spendings = set(), set()
+    for confidence, _, line_id, spending_id in pairs:
+        if line_id in used_lines or spending_id in used_spendings:
+            continue
+        used_lines.add(line_id)
+        used_spendings.add(spending_id)
+        proposals.append((line_id, [spending_id], confidence, 'one_to_one'))
+
+    # Many-to-one: settlements after the fact, so look back from the line date
+    unpaid = [s for s in spendings if s[4] and s[0] not in used_spendings]
+    unpaid_dates = [s[1] for s in unpaid]
+    open_lines = [line for line in lines if line[0] not in used_lines]
+    runs = _runs_by_total(unpaid, max((line[2] for line in open_lines), default=0))
+    for line_id, line_date, paise in sorted(open_lines, key=lambda l: l[1]):
+        lo = bisect_left(unpaid_dates, line_date - timedelta(days=window_days * 10))
+        hi = bisect_right(unpaid_dates, line_date + window)
+        run = _find_run(unpaid, runs.get(paise), lo, hi, used_spendings)
+        if run:
+            used_lines.add(line_id)
+            used_spendings.update(s[0] for s in run)
+            spread = (run[-1][1] - run[0][1]).days
+            confidence = max(0.3, 0.6 - 0.02 * len(run) - 0.005 * spread)
+            proposals.append((line_id, [s[0] for s in run], round(confidence, 2), 'many_to_one'))
+    return proposals
+
+
+def _runs_by_total(candidates, max_total):
+    """{total: [(end, start)]} of every run of 2..MAX_RUN consecutive positive
+    candidates (inclusive indexes) adding up to at most `max_total`, in order
+    of end, so matching a line is a dict lookup instead of a sweep."""
+    runs = defaultdict(list)
+    for end in range(len(candidates)):
+        total = 0
+        for start in range(end, max(end - MAX_RUN, -1), -1):
+            amount = candidates[start][2]
+            if amount <= 0:
+                break
+            total += amount
+            if total > max_total:
+                break
+            if start < end:
+                runs[total].append((end, start))
+    return runs
+
+
+def _find_run(candidates, runs, lo, hi, used):
+    """Latest run from `runs` (one total's entries of _runs_by_total) within
+    candidates[lo:hi] none of whose spendings is used yet."""
+    if not runs:
+        return None
+    for k in range(bisect_left(runs, (hi,)) - 1, -1, -1):
+        end, start = runs[k]
+        if end < lo:
+            break
+        if start >= lo and not any(s[0] in used for s in candidates[start:end + 1]):
+            return candidates[start:end + 1]
+    return None
+
+
+def reconcile_import(cur, import_id, window_days=3):
+    """(Re)compute proposals for an import's unmatched lines; returns the count."""
+    cur.execute("SELECT mode FROM statement_imports WHERE id = %s", (import_id,))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"Unknown statement import {import_id}")
+    mode = row[0]
+
+    cur.execute("DELETE FROM reconciliation_matches WHERE import_id = %s AND status = 'proposed'", (import_id,))
+    cur.execute("""
+        SELECT id, date, amount FROM statement_lines
+        WHERE import_id = %s AND status = 'unmatched'
+    """, (import_id,))
+    lines = [(row[0], row[1], _paise(row[2])) for row in cur.fetchall()]
+    if not lines:
+        return 0
+
+    lookback = timedelta(days=window_days * 10)
+    spendings = _candidates(cur, min(l[1] for l in lines) - lookback,
+                            max(l[1] for l in lines) + timedelta(days=window_days))
+    cur.execute("""
+        SELECT line_id, spending_ids FROM reconciliation_matches
+        WHERE import_id = %s AND status = 'rejected'
+    """, (import_id,))
+    rejected = {(row[0], tuple(sorted(row[1]))) for row in cur.fetchall()}
+    proposals = [p for p in propose_matches(lines, spendings, mode, window_days)
+                 if (p[0], tuple(sorted(p[1]))) not in rejected]
+    extras.execute_values(cur, """
+        INSERT INTO reconciliation_matches (import_id, line_id, spending_ids, confidence, kind)
+        VALUES %s
+    """, [(import_id, line_id, ids, confidence, kind) for line_id, ids, confidence, kind in proposals],
+        page_size=1000)
+    return len(proposals)
+
+
+def import_summary(cur, import_id):
+    cur.execute("""
+        SELECT l.id, l.line_no, l.date, l.amount, l.description, l.reference, l.status,
+               m.id AS match_id, m.spending_ids, m.confidence, m.kind, m.status AS match_status
+        FROM statement_lines l
+        LEFT JOIN reconciliation_matches m ON m.line_id = l.id AND m.status <> 'rejected'
+        WHERE l.import_id = %s
+        ORDER BY l.line_no
+    """, (import_id,))
+    return [{
+        'line_id': row['id'],
+        'line_no': row['line_no'],
+        'date': row['date'].strftime('%Y-%m-%d'),
+        'amount': float(row['amount']),
+        'description': row['description'],
+        'reference': row['reference'],
+        'status': row['status'],
+        'match': None if row['match_id'] is None else {
+            'id': row['match_id'],
+            'spending_ids': row['spending_ids'],
+            'confidence': float(row['confidence']),
+            'kind': row['kind'],
+            'status': row['match_status'],
+        },
+    } for row in cur.fetchall()]
+
+
+def confirm_matches(cur, match_ids, spended_by=None, mode=None):
+    """Confirm proposed matches; unpaid spendings in them are settled with
+    `spended_by`/`mode` when given. Returns the number confirmed.
+
+    A proposal sharing a spending with an already confirmed match (from
+    another statement, a concurrent batch, or earlier in this batch) is
+    skipped rather than matching the spending twice. Must run inside a
+    transaction (the spendings stay locked until it ends).
+    """
+    cur.execute("""
+        SELECT id, line_id, spending_ids FROM reconciliation_matches
+        WHERE id = ANY(%s) AND status = 'proposed'
+        ORDER BY confidence DESC, id
+        FOR UPDATE
+    """, (list(match_ids),))
+    proposals = cur.fetchall()
+    if not proposals:
+        return 0
+    # Lock the spendings first: a concurrent batch sharing any of them waits
+    # for this one to commit, and then sees its matches as confirmed below
+    cur.execute("""
+        SELECT id FROM spendings WHERE id = ANY(%s) ORDER BY id FOR UPDATE
+    """, (sorted({sid for row in proposals for sid in row[2]}),))
+    cur.execute("""
+        SELECT DISTINCT unnest(spending_ids) FROM reconciliation_matches
+        WHERE status = 'confirmed' AND spending_ids && %s
+    """, ([sid for row in proposals for sid in row[2]],))
+    taken = {row[0] for row in cur.fetchall()}
+
+    confirmed = []
+    for match_id, line_id, spending_ids in proposals:
+        if taken.intersection(spending_ids):
+            continue
+        taken.update(spending_ids)
+        confirmed.append((match_id, line_id, spending_ids))
+    if not confirmed:
+        return 0
+
+    cur.execute("""
+        UPDATE reconciliation_matches SET status = 'confirmed', confirmed_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s)
+    """, ([row[0] for row in confirmed],))
+    cur.execute("UPDATE statement_lines SET status = 'matched' WHERE id = ANY(%s)",
+                ([row[1] for row in confirmed],))
+    if spended_by and mode:
+        cur.execute("""
+            UPDATE spendings
+            SET spended_by = %s, mode = %s, reason = COALESCE(reason, '') || %s
+            WHERE id = ANY(%s) AND (spended_by IS NULL OR mode IS NULL)
+        """, (spended_by, mode, f" - Reconciled on {datetime.now().strftime('%Y-%m-%d')}",
+              [sid for row in confirmed for sid in row[2]]))
+    return len(confirmed)
+
+
+def reject_matches(cur, match_ids):
+    cur.execute("""
+        UPDATE reconciliation_matches SET status = 'rejected'
+        WHERE id = ANY(%s) AND status = 'proposed'
+    """, (list(match_ids),))
+    return cur.rowcount
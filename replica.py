@@ -0,0 +1,342 @@
+# replica.py - In-process columnar replica of spendings and payments
+#
+# Rows are stored column-wise in array.array buffers (amounts as integer paise)
+# and the dashboard totals are kept as running sums, so reading them costs a
+# dict lookup instead of a database round trip. The replica is bootstrapped
+# once and then kept current from the notifications delivered by
+# listener.ChangeListener.
+
+from array import array
+from decimal import Decimal
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+NULL = -1
+
+
+def to_paise(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def from_paise(value):
+    return Decimal(value) / 100
+
+
+def month_key(d):
+    """Month ordinal for a date (or a 'YYYY-MM' string); NULL when missing."""
+    if d is None:
+        return NULL
+    if isinstance(d, str):
+        year, month = d.split('-')[:2]
+        return int(year) * 12 + int(month) - 1
+    return d.year * 12 + d.month - 1
+
+
+class ColumnTable:
+    """Fixed set of typed array columns with id -> slot lookup and slot reuse."""
+
+    def __init__(self, **typecodes):
+        self.columns = {name: array(code) for name, code in typecodes.items()}
+        self.alive = array('b')
+        self.slot_of = {}
+        self.free = []
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def get(self, row_id):
+        slot = self.slot_of.get(row_id)
+        if slot is None:
+            return None
+        return {name: col[slot] for name, col in self.columns.items()}
+
+    def put(self, row_id, values):
+        slot = self.slot_of.get(row_id)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+                self.alive[slot] = 1
+            else:
+                slot = len(self.alive)
+                self.alive.append(1)
+                for col in self.columns.values():
+                    col.append(0)
+            self.slot_of[row_id] = slot
+        for name, value in values.items():
+            self.columns[name][slot] = value
+
+    def remove(self, row_id):
+        slot = self.slot_of.pop(row_id, None)
+        if slot is not None:
+            self.alive[slot] = 0
+            self.free.append(slot)
+
+
+class LedgerReplica:
+    SPENDINGS_SQL = "SELECT id, vehicle_id, expense_month, spended_by, mode, amount FROM spendings"
+    PAYMENTS_SQL = "SELECT id, vehicle_id, date, amount FROM payments"
+
+    def __init__(self, conn_factory, listener, tenant_id=None):
+        self.conn_factory = conn_factory
+        self.listener = listener
+        self.tenant_id = tenant_id  # only this tenant's notifications are applied
+        self._loaded = False
+        self._disconnects = 0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()  # orders bootstrap and apply fetches
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self.spendings = ColumnTable(amount='q', vehicle_id='l', month='l', payer='l', has_mode='b')
+        self.payments = ColumnTable(amount='q', vehicle_id='l', month='l')
+        self.payer_names = []
+        self.payer_codes = {}
+        self.credited = 0
+        self.spent_total = 0
+        self.debited_any = 0      # spended_by IS NOT NULL OR mode IS NOT NULL
+        self.debited_paid = 0     # spended_by IS NOT NULL AND mode IS NOT NULL
+        self.by_payer = {}
+        self.by_vehicle = {}
+        self.by_vehicle_month = {}
+        self.by_month = {}
+        self.credited_by_month = {}
+
+    # -- lifecycle -------------------------------------------------------
+
+    @property
+    def ready(self):
+        """Whether the totals are current: loaded, and the listener is still
+        connected (notifications missed while it is down would leave them
+        stale). Callers fall back to SQL otherwise."""
+        return self._loaded and self.listener.connected.is_set()
+
+    def start(self):
+        """Subscribe to change notifications and bootstrap in the background."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        self.listener.subscribe(self.apply, on_reconnect=self._resync, on_disconnect=self._mark_stale)
+        self.listener.start()
+        threading.Thread(target=self._resync, name='ledger-replica-bootstrap', daemon=True).start()
+
+    def _mark_stale(self):
+        self._disconnects += 1
+        self._loaded = False
+
+    def _resync(self):
+        self._loaded = False
+        # Load only once listening, so no change falls between the two
+        self.listener.connected.wait()
+        try:
+            self.bootstrap()
+        except Exception as e:
+            logger.error(f"Ledger replica bootstrap failed: {e}")
+
+    def bootstrap(self):
+        with self._sync_lock:
+            self._bootstrap()
+
+    def _bootstrap(self):
+        disconnects = self._disconnects
+        conn = self.conn_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(self.SPENDINGS_SQL)
+                spending_rows = cur.fetchall()
+                cur.execute(self.PAYMENTS_SQL)
+                payment_rows = cur.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._reset()
+            for row in spending_rows:
+                self._upsert_spending(row)
+            for row in payment_rows:
+                self._upsert_payment(row)
+            # A disconnect during the load may have lost changes; the
+            # reconnect's resync loads again
+            self._loaded = disconnects == self._disconnects
+        logger.info(f"Ledger replica loaded {len(self.spendings)} spendings and {len(self.payments)} payments")
+
+    def apply(self, events):
+        """Re-read the rows named in a batch of notifications and apply them."""
+        ids = {'spendings': set(), 'payments': set()}
+        for event in events:
+            if self.tenant_id is not None and event.get('tenant') != self.tenant_id:
+                continue
+            if event.get('table') in ids:
+                ids[event['table']].add(int(event['id']))
+        if not any(ids.values()):
+            return
+        with self._sync_lock:
+            self._apply(ids)
+
+    def _apply(self, ids):
+        conn = self.conn_factory()
+        try:
+            with conn.cursor() as cur:
+                fetched = {}
+                for table, sql in (('spendings', self.SPENDINGS_SQL), ('payments', self.PAYMENTS_SQL)):
+                    if ids[table]:
+                        cur.execute(sql + " WHERE id = ANY(%s)", (list(ids[table]),))
+                        fetched[table] = cur.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for row in fetched.get('spendings', []):
+                self._upsert_spending(row)
+                ids['spendings'].discard(row[0])
+            for row in fetched.get('payments', []):
+                self._upsert_payment(row)
+                ids['payments'].discard(row[0])
+            # Anything notified but no longer present was deleted.
+            for row_id in ids['spendings']:
+                self._remove_spending(row_id)
+            for row_id in ids['payments']:
+                self._remove_payment(row_id)
+
+    # -- row maintenance -------------------------------------------------
+
+    def _payer_code(self, name):
+        if name is None:
+            return NULL
+        code = self.payer_codes.get(name)
+        if code is None:
+            code = len(self.payer_names)
+            self.payer_names.append(name)
+            self.payer_codes[name] = code
+        return code
+
+    @staticmethod
+    def _add(bucket, key, value):
+        total = bucket.get(key, 0) + value
+        if total:
+            bucket[key] = total
+        else:
+            bucket.pop(key, None)
+
+    def _contribute_spending(self, row, sign):
+        amount = row['amount'] * sign
+        has_payer = row['payer'] != NULL
+        self.spent_total += amount
+        if has_payer or row['has_mode']:
+            self.debited_any += amount
+        if has_payer and row['has_mode']:
+            self.debited_paid += amount
+        if has_payer:
+            self._add(self.by_payer, row['payer'], amount)
+        self._add(self.by_vehicle, row['vehicle_id'], amount)
+        self._add(self.by_vehicle_month, (row['vehicle_id'], row['month']), amount)
+        self._add(self.by_month, row['month'], amount)
+
+    def _upsert_spending(self, row):
+        row_id, vehicle_id, expense_month, spended_by, mode, amount = row
+        self._remove_spending(row_id)
+        values = {
+            'amount': to_paise(amount),
+            'vehicle_id': vehicle_id if vehicle_id is not None else NULL,
+            'month': month_key(expense_month),
+            'payer': self._payer_code(spended_by),
+            'has_mode': 1 if mode is not None else 0,
+        }
+        self.spendings.put(row_id, values)
+        self._contribute_spending(values, 1)
+
+    def _remove_spending(self, row_id):
+        old = self.spendings.get(row_id)
+        if old is not None:
+            self._contribute_spending(old, -1)
+            self.spendings.remove(row_id)
+
+    def _upsert_payment(self, row):
+        row_id, vehicle_id, date, amount = row
+        self._remove_payment(row_id)
+        values = {
+            'amount': to_paise(amount),
+            'vehicle_id': vehicle_id if vehicle_id is not None else NULL,
+            'month': month_key(date),
+        }
+        self.payments.put(row_id, values)
+        self.credited += values['amount']
+        self._add(self.credited_by_month, values['month'], values['amount'])
+
+    def _remove_payment(self, row_id):
+        old = self.payments.get(row_id)
+        if old is not None:
+            self.credited -= old['amount']
+            self._add(self.credited_by_month, old['month'], -old['amount'])
+            self.payments.remove(row_id)
+
+    # -- reads -----------------------------------------------------------
+
+    def totals(self):
+        with self._lock:
+            return {
+                'credited': from_paise(self.credited),
+                'spent': from_paise(self.spent_total),
+                'debited_any': from_paise(self.debited_any),
+                'debited_paid': from_paise(self.debited_paid),
+                'unpaid': from_paise(self.spent_total - self.debited_paid),
+                'spent_by': {self.payer_names[code]: from_paise(v) for code, v in self.by_payer.items()},
+            }
+
+    def spent_by(self, name):
+        code = self.payer_codes.get(name)
+        return from_paise(self.by_payer.get(code, 0)) if code is not None else Decimal(0)
+
+    def vehicle_totals(self):
+        with self._lock:
+            return {vid: from_paise(v) for vid, v in self.by_vehicle.items() if vid != NULL}
+
+    def month_total(self, month):
+        return from_paise(self.by_month.get(month_key(month), 0))
+
+    def vehicle_month_total(self, vehicle_id, month):
+        return from_paise(self.by_vehicle_month.get((vehicle_id, month_key(month)), 0))
+
+    # -- consistency -----------------------------------------------------
+
+    def verify(self):
+        """Compare the replica's totals with the database; returns the mismatches.
+        `conn_factory` must give primary connections, or replication lag shows
+        up as mismatches."""
+        conn = self.conn_factory()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT
+                        (SELECT COALESCE(SUM(amount), 0) FROM payments),
+                        COALESCE(SUM(amount), 0),
+                        COALESCE(SUM(amount) FILTER (WHERE spended_by IS NOT NULL OR mode IS NOT NULL), 0),
+                        COALESCE(SUM(amount) FILTER (WHERE spended_by IS NOT NULL AND mode IS NOT NULL), 0)
+                    FROM spendings
+                """)
+                credited, spent, debited_any, debited_paid = cur.fetchone()
+                cur.execute("SELECT vehicle_id, SUM(amount) FROM spendings GROUP BY vehicle_id")
+                db_vehicles = {vid: amount for vid, amount in cur.fetchall() if vid is not None}
+                cur.execute("SELECT spended_by, SUM(amount) FROM spendings WHERE spended_by IS NOT NULL GROUP BY spended_by")
+                db_payers = dict(cur.fetchall())
+        finally:
+            conn.close()
+
+        mine = self.totals()
+        expected = {'credited': credited, 'spent': spent, 'debited_any': debited_any, 'debited_paid': debited_paid}
+        mismatches = [
+            {'metric': key, 'replica': float(mine[key]), 'database': float(value)}
+            for key, value in expected.items() if mine[key] != value
+        ]
+        vehicles = self.vehicle_totals()
+        for vid in set(vehicles) | set(db_vehicles):
+            if vehicles.get(vid, 0) != db_vehicles.get(vid, 0):
+                mismatches.append({'metric': f'vehicle:{vid}', 'replica': float(vehicles.get(vid, 0)),
+                                   'database': float(db_vehicles.get(vid, 0))})
+        for name in set(mine['spent_by']) | set(db_payers):
+            if mine['spent_by'].get(name, 0) != db_payers.get(name, 0):
+                mismatches.append({'metric': f'spent_by:{name}', 'replica': float(mine['spent_by'].get(name, 0)),
+                                   'database': float(db_payers.get(name, 0))})
+        return {'ready': self.ready, 'consistent': not mismatches, 'mismatches': mismatches}
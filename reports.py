@@ -0,0 +1,592 @@
+# reports.py - SQL-backed financial reports (JSON rows, shared by the API and CSV exports)
+
+import csv
+from datetime import datetime, date
+from io import StringIO
+
+from psycopg2 import extras
+
+
+def parse_date(value, default=None):
+    """'YYYY-MM-DD' -> date."""
+    if not value:
+        return default
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_month(value, default=None):
+    """'YYYY-MM' -> first day of that month (date)."""
+    if not value:
+        return default
+    return datetime.strptime(value, '%Y-%m').date().replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _money(value):
+    return float(value or 0)
+
+
+# Vehicle P&L
+# ----------------------------------------------------
+
+def vehicle_pnl(cur, month_from=None, month_to=None, vehicle_ids=None):
+    """Revenue, diesel, salary, other and margin per vehicle per month, with
+    trailing-12-month totals, in one windowed pass over vehicle_monthly_rollup.
+    """
+    month_to = month_to or datetime.now().date().replace(day=1)
+    month_from = month_from or add_months(month_to, -11)
+    if month_from > month_to:
+        raise ValueError('from month must not be after to month')
+
+    vehicle_filter = "AND r.vehicle_id = ANY(%(vehicle_ids)s)" if vehicle_ids else ""
+    cur.execute(f"""
+        WITH monthly AS (
+            SELECT r.vehicle_id, r.month, r.revenue, r.diesel, r.salary, r.other,
+                   r.diesel + r.salary + r.other AS cost
+            FROM vehicle_monthly_rollup r
+            WHERE r.month BETWEEN %(window_start)s AND %(month_to)s
+            {vehicle_filter}
+        ),
+        windowed AS (
+            SELECT m.*,
+                   m.revenue - m.cost AS margin,
+                   SUM(m.revenue) OVER w AS revenue_ttm,
+                   SUM(m.cost) OVER w AS cost_ttm,
+                   SUM(m.revenue - m.cost) OVER w AS margin_ttm
+            FROM monthly m
+            WINDOW w AS (PARTITION BY m.vehicle_id ORDER BY m.month
+                         RANGE BETWEEN INTERVAL '11 months' PRECEDING AND CURRENT ROW)
+        )
+        SELECT v.vehicle_no, w.*
+        FROM windowed w
+        JOIN vehicles v ON v.id = w.vehicle_id
+        WHERE w.month >= %(month_from)s
+        ORDER BY v.vehicle_no, w.month
+    """, {
+        # Trailing totals need the 11 months before the first reported month
+        'window_start': add_months(month_from, -11),
+        'month_from': month_from,
+        'month_to': month_to,
+        'vehicle_ids': vehicle_ids,
+    })
+    return [{
+        'vehicle_id': row['vehicle_id'],
+        'vehicle_no': row['vehicle_no'],
+        'month': row['month'].strftime('%Y-%m'),
+        'revenue': _money(row['revenue']),
+        'diesel': _money(row['diesel']),
+        'salary': _money(row['salary']),
+        'other': _money(row['other']),
+        'margin': _money(row['margin']),
+        'revenue_ttm': _money(row['revenue_ttm']),
+        'cost_ttm': _money(row['cost_ttm']),
+        'margin_ttm': _money(row['margin_ttm']),
+    } for row in cur.fetchall()]
+
+
+# Receivables aging
+# ----------------------------------------------------
+# receivable_open_items holds each company's unpaid invoices after allocating
+# its company_payments against company_sales oldest-first. Writes to either
+# table only mark the company in receivables_dirty (see
+# create_receivables_tables); the allocation is re-run for those companies on
+# the next read.
+
+AGING_BUCKETS = (
+    ('current', 0, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_90_plus', 91, None),
+)
+
+
+def refresh_receivables(cur):
+    """Re-allocate payments for dirty companies; returns how many were refreshed.
+
+    Dirty rows still locked by the transaction that marked them are skipped:
+    its sale or payment is not in this statement's snapshot, so the company
+    stays dirty for the next refresh. Rows locked by a concurrent refresh are
+    skipped too, so two refreshes never rebuild the same company.
+    """
+    cur.execute("""
+        WITH dirty AS (
+            SELECT company_name, version FROM receivables_dirty
+            FOR UPDATE SKIP LOCKED
+        ),
+        done AS (
+            DELETE FROM receivables_dirty r
+            USING dirty d
+            WHERE r.company_name = d.company_name AND r.version = d.version
+        ),
+        cleared AS (
+            DELETE FROM receivable_open_items o
+            USING dirty d
+            WHERE o.company_name = d.company_name
+        ),
+        sales AS (
+            SELECT cs.id, cs.company_name, cs.sale_date, cs.invoice_number, cs.sale_amount,
+                   SUM(cs.sale_amount) OVER (PARTITION BY cs.company_name
+                                             ORDER BY cs.sale_date, cs.id) AS billed_to_date
+            FROM company_sales cs
+            JOIN dirty d ON d.company_name = cs.company_name
+        ),
+        paid AS (
+            SELECT cp.company_name, SUM(cp.received_amount) AS total_paid
+            FROM company_payments cp
+            JOIN dirty d ON d.company_name = cp.company_name
+            GROUP BY cp.company_name
+        ),
+        inserted AS (
+            INSERT INTO receivable_open_items
+                (sale_id, company_name, sale_date, invoice_number, sale_amount, outstanding)
+            SELECT s.id, s.company_name, s.sale_date, s.invoice_number, s.sale_amount,
+                   LEAST(s.sale_amount, s.billed_to_date - COALESCE(p.total_paid, 0))
+            FROM sales s
+            LEFT JOIN paid p ON p.company_name = s.company_name
+            WHERE s.billed_to_date - COALESCE(p.total_paid, 0) > 0
+        )
+        SELECT COUNT(*) FROM dirty
+    """)
+    return cur.fetchone()[0]
+
+
+def receivables_aging(cur):
+    """Outstanding amount per company split into age buckets (days since sale)."""
+    refresh_receivables(cur)
+    buckets = ',\n'.join(
+        f"COALESCE(SUM(outstanding) FILTER (WHERE CURRENT_DATE - sale_date >= {low}"
+        + (f" AND CURRENT_DATE - sale_date <= {high}" if high is not None else '')
+        + f"), 0) AS {name}"
+        for name, low, high in AGING_BUCKETS
+    )
+    cur.execute(f"""
+        SELECT company_name,
+               {buckets},
+               SUM(outstanding) AS total,
+               MIN(sale_date) AS oldest_invoice
+        FROM receivable_open_items
+        GROUP BY company_name
+        ORDER BY total DESC, company_name
+    """)
+    rows = []
+    for row in cur.fetchall():
+        item = {'company_name': row['company_name']}
+        for name, _, _ in AGING_BUCKETS:
+            item[name] = _money(row[name])
+        item['total'] = _money(row['total'])
+        item['oldest_invoice'] = row['oldest_invoice'].strftime('%Y-%m-%d')
+        rows.append(item)
+    return rows
+
+
+def unpaid_invoices(cur, company_name):
+    """Drill-down: a company's unpaid invoices, oldest first, with their age."""
+    refresh_receivables(cur)
+    cur.execute("""
+        SELECT sale_id, sale_date, invoice_number, sale_amount, outstanding,
+               CURRENT_DATE - sale_date AS age_days
+        FROM receivable_open_items
+        WHERE company_name = %s
+        ORDER BY sale_date, sale_id
+    """, (company_name,))
+    return [{
+        'sale_id': row['sale_id'],
+        'sale_date': row['sale_date'].strftime('%Y-%m-%d'),
+        'invoice_number': row['invoice_number'] or '',
+        'sale_amount': _money(row['sale_amount']),
+        'outstanding': _money(row['outstanding']),
+        'age_days': row['age_days'],
+    } for row in cur.fetchall()]
+
+
+# Employee statement
+# ----------------------------------------------------
+# Advances given to an employee (credit) and spendings they paid for
+# (spended_by, debit) merged chronologically, matching the employee_balance
+# view's balance = advances - expenses.
+
+STATEMENT_COLUMNS = ['date', 'kind', 'id', 'description', 'credit', 'debit', 'balance']
+
+
+def _opening_balance(cur, employee, date_from):
+    if date_from is None:
+        return 0
+    cur.execute("""
+        SELECT (SELECT COALESCE(SUM(amount), 0) FROM employee_advances
+                WHERE employee_name = %(employee)s AND date < %(date_from)s)
+             - (SELECT COALESCE(SUM(amount), 0) FROM spendings
+                WHERE spended_by = %(employee)s AND date < %(date_from)s) AS opening
+    """, {'employee': employee, 'date_from': date_from})
+    return cur.fetchone()[0]
+
+
+def _statement_query(employee, date_from, date_to, opening):
+    params = {
+        'employee': employee,
+        'date_from': date_from,
+        'date_to': date_to,
+        'opening': opening,
+    }
+    return """
+        WITH entries AS (
+            SELECT a.date, 'advance' AS kind, a.id, COALESCE(a.purpose, '') AS description,
+                   a.amount AS credit, 0::numeric AS debit
+            FROM employee_advances a
+            WHERE a.employee_name = %(employee)s
+              AND (%(date_from)s::date IS NULL OR a.date >= %(date_from)s)
+              AND (%(date_to)s::date IS NULL OR a.date <= %(date_to)s)
+            UNION ALL
+            SELECT s.date, 'expense', s.id, CONCAT_WS(' / ', v.vehicle_no, s.category, s.reason),
+                   0, s.amount
+            FROM spendings s
+            LEFT JOIN vehicles v ON s.vehicle_id = v.id
+            WHERE s.spended_by = %(employee)s
+              AND (%(date_from)s::date IS NULL OR s.date >= %(date_from)s)
+              AND (%(date_to)s::date IS NULL OR s.date <= %(date_to)s)
+        )
+        SELECT date, kind, id, description, credit, debit,
+               %(opening)s + SUM(credit - debit) OVER (ORDER BY date, kind, id
+                                                      ROWS UNBOUNDED PRECEDING) AS balance
+        FROM entries
+        ORDER BY date, kind, id
+    """, params
+
+
+def _statement_row(row):
+    return {
+        'date': row['date'].strftime('%Y-%m-%d'),
+        'kind': row['kind'],
+        'id': row['id'],
+        'description': row['description'],
+        'credit': _money(row['credit']),
+        'debit': _money(row['debit']),
+        'balance': _money(row['balance']),
+    }
+
+
+def employee_statement(cur, employee, date_from=None, date_to=None):
+    """Statement rows with a running balance, starting from the balance
+    carried over from before `date_from`."""
+    opening = _opening_balance(cur, employee, date_from)
+    sql, params = _statement_query(employee, date_from, date_to, opening)
+    cur.execute(sql, params)
+    entries = [_statement_row(row) for row in cur.fetchall()]
+    return {
+        'employee': employee,
+        'opening_balance': _money(opening),
+        'closing_balance': entries[-1]['balance'] if entries else _money(opening),
+        'entries': entries,
+    }
+
+
+def iter_employee_statement_csv(conn, employee, date_from=None, date_to=None, itersize=2000):
+    """Yield the statement as CSV text chunks, reading rows through a
+    server-side cursor so long statements are never held in memory.
+
+    Takes ownership of `conn` and closes it when the generator finishes.
+    """
+    try:
+        # Named cursors need a transaction
+        conn.autocommit = False
+        with conn.cursor(cursor_factory=extras.DictCursor) as cur:
+            opening = _opening_balance(cur, employee, date_from)
+        sql, params = _statement_query(employee, date_from, date_to, opening)
+
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=STATEMENT_COLUMNS)
+        writer.writeheader()
+        writer.writerow({'date': date_from.strftime('%Y-%m-%d') if date_from else '',
+                         'kind': 'opening', 'balance': _money(opening)})
+        with conn.cursor('employee_statement', cursor_factory=extras.DictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            for row in cur:
+                writer.writerow(_statement_row(row))
+                if output.tell() > 65536:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+        yield output.getvalue()
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+# Periods (months dimension)
+# ----------------------------------------------------
+
+PERIOD_COUNTERS = ('spendings_count', 'payments_count', 'advances_count',
+                   'hired_transactions_count', 'company_sales_count', 'company_payments_count')
+
+
+def available_months(cur, *counters):
+    """'YYYY-MM' months (newest first) with rows in any of the given counters."""
+    counters = counters or PERIOD_COUNTERS
+    unknown = [c for c in counters if c not in PERIOD_COUNTERS]
+    if unknown:
+        raise ValueError(f"Unknown period counter: {', '.join(unknown)}")
+    cur.execute(f"""
+        SELECT month FROM periods
+        WHERE {' OR '.join(f'{c} > 0' for c in counters)}
+        ORDER BY month DESC
+    """)
+    return [row['month'].strftime('%Y-%m') for row in cur.fetchall()]
+
+
+def list_periods(cur):
+    cur.execute("SELECT * FROM periods ORDER BY month DESC")
+    periods = []
+    for row in cur.fetchall():
+        item = {'month': row['month'].strftime('%Y-%m'), 'status': row['status'],
+                'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None}
+        for counter in PERIOD_COUNTERS:
+            item[counter] = row[counter]
+        periods.append(item)
+    return periods
+
+
+# Month-over-month comparison
+# ----------------------------------------------------
+
+def month_comparison(cur, month_from=None, month_to=None):
+    """Spending per vehicle and category for each month in the range, with the
+    change from the previous month, read from spending_category_monthly.
+
+    Defaults to the six most recent months that have spendings.
+    """
+    if month_to is None:
+        cur.execute("SELECT MAX(month) AS month FROM periods WHERE spendings_count > 0")
+        month_to = cur.fetchone()['month'] or datetime.now().date().replace(day=1)
+    month_from = month_from or add_months(month_to, -5)
+    if month_from > month_to:
+        raise ValueError('from month must not be after to month')
+
+    cur.execute("""
+        WITH months AS (
+            SELECT generate_series(%(prev_month)s::date, %(month_to)s::date, INTERVAL '1 month')::date AS month
+        ),
+        totals AS (
+            SELECT month, vehicle_id, category, amount
+            FROM spending_category_monthly
+            WHERE month BETWEEN %(prev_month)s AND %(month_to)s
+        ),
+        series AS (
+            SELECT k.vehicle_id, k.category, m.month, COALESCE(t.amount, 0) AS amount
+            FROM (SELECT DISTINCT vehicle_id, category FROM totals) k
+            CROSS JOIN months m
+            LEFT JOIN totals t
+              ON t.vehicle_id = k.vehicle_id AND t.category = k.category AND t.month = m.month
+        ),
+        compared AS (
+            SELECT s.*, LAG(s.amount) OVER (PARTITION BY s.vehicle_id, s.category ORDER BY s.month) AS previous
+            FROM series s
+        )
+        SELECT v.vehicle_no, c.*
+        FROM compared c
+        JOIN vehicles v ON v.id = c.vehicle_id
+        WHERE c.month >= %(month_from)s
+        ORDER BY v.vehicle_no, c.category, c.month
+    """, {
+        # One extra month so the first reported month has a delta
+        'prev_month': add_months(month_from, -1),
+        'month_from': month_from,
+        'month_to': month_to,
+    })
+    rows = []
+    for row in cur.fetchall():
+        amount, previous = _money(row['amount']), _money(row['previous'])
+        rows.append({
+            'vehicle_id': row['vehicle_id'],
+            'vehicle_no': row['vehicle_no'],
+            'category': row['category'],
+            'month': row['month'].strftime('%Y-%m'),
+            'amount': amount,
+            'previous': previous,
+            'delta': round(amount - previous, 2),
+            'delta_pct': round((amount - previous) * 100 / previous, 1) if previous else None,
+        })
+    return {
+        'month_from': month_from.strftime('%Y-%m'),
+        'month_to': month_to.strftime('%Y-%m'),
+        'rows': rows,
+    }
+
+
+# CSV exports
+# ----------------------------------------------------
+# SQL behind the /export/... routes, shared with background jobs (jobs.py),
+# which stream the same queries to a file instead of building the response
+# in the request thread.
+
+EXPORT_QUERIES = {
+    'paid_spendings': ("""
+        SELECT s.date, v.vehicle_no, s.category, s.reason, s.amount, s.spended_by, s.mode
+        FROM spendings s
+        JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
+        ORDER BY s.date DESC
+    """, 'paid_spendings.csv'),
+    'unpaid_spendings': ("""
+        SELECT s.date, v.vehicle_no, s.category, s.reason, s.amount
+        FROM spendings s
+        JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE s.spended_by IS NULL OR s.mode IS NULL
+        ORDER BY s.date DESC
+    """, 'unpaid_spendings.csv'),
+    'payments': ("""
+        SELECT p.date, p.received_from as company_name, p.amount, p.reason
+        FROM payments p
+        ORDER BY p.date DESC
+    """, 'payments.csv'),
+    'vehicles': ("SELECT vehicle_no, owner_name, contact_number, created_at FROM vehicles ORDER BY vehicle_no",
+                 'vehicles.csv'),
+    'monthly_expenses': ("""
+        SELECT
+            TO_CHAR(expense_month, 'YYYY-MM') as month,
+            v.vehicle_no,
+            SUM(s.amount) as total_expense
+        FROM spendings s
+        JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL
+        GROUP BY expense_month, v.vehicle_no
+        ORDER BY expense_month DESC, total_expense DESC
+    """, 'monthly_expenses.csv'),
+}
+
+
+def hired_vehicles_audit_export(cur, month, vehicle_id='all'):
+    """(sql, params, filename) for the hired vehicles audit of `month` ('YYYY-MM')."""
+    month_date = parse_month(month)
+    if vehicle_id == 'all':
+        return ("""
+            SELECT
+                hv.vehicle_no,
+                hv.owner_name,
+                COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) as total_sales,
+                COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as total_payments,
+                COALESCE(SUM(CASE WHEN t.transaction_type = 'sale' THEN t.amount ELSE 0 END), 0) -
+                COALESCE(SUM(CASE WHEN t.transaction_type = 'payment' THEN t.amount ELSE 0 END), 0) as net_balance
+            FROM hired_vehicles hv
+            LEFT JOIN hired_vehicle_transactions t ON hv.id = t.hired_vehicle_id AND t.month_year = %s
+            GROUP BY hv.id, hv.vehicle_no, hv.owner_name
+            ORDER BY hv.vehicle_no
+        """, (month_date,), f'hired_vehicles_audit_{month}.csv')
+
+    cur.execute("SELECT vehicle_no FROM hired_vehicles WHERE id = %s", (vehicle_id,))
+    row = cur.fetchone()
+    return ("""
+        SELECT
+            t.transaction_date,
+            t.transaction_type,
+            t.description,
+            t.reference_no,
+            t.amount,
+            hv.vehicle_no,
+            hv.owner_name
+        FROM hired_vehicle_transactions t
+        JOIN hired_vehicles hv ON t.hired_vehicle_id = hv.id
+        WHERE t.hired_vehicle_id = %s AND t.month_year = %s
+        ORDER BY t.transaction_date, t.created_at
+    """, (vehicle_id, month_date), f'hired_vehicle_audit_{row[0] if row else "unknown"}_{month}.csv')
+
+
+def company_audit_export(month, company='all'):
+    """(sql, params, filename) for the company audit of `month` ('YYYY-MM')."""
+    month_date = parse_month(month)
+    if company == 'all':
+        # One row per sale or payment; joining payments onto sales
+        # multiplied every sale by every payment of the month
+        return ("""
+            SELECT
+                company_name,
+                'sale' as transaction_type,
+                sale_date as date,
+                invoice_number as reference,
+                sale_amount as amount,
+                description,
+                NULL as payment_mode
+            FROM company_sales
+            WHERE month_year = %s
+
+            UNION ALL
+
+            SELECT
+                company_name,
+                'payment' as transaction_type,
+                payment_date as date,
+                reference_number as reference,
+                received_amount as amount,
+                description,
+                payment_mode
+            FROM company_payments
+            WHERE month_year = %s
+
+            ORDER BY company_name, date
+        """, (month_date, month_date), f'company_audit_{month}.csv')
+
+    return ("""
+        SELECT
+            'sale' as transaction_type,
+            sale_date as date,
+            invoice_number as reference,
+            sale_amount as amount,
+            description,
+            NULL as payment_mode
+        FROM company_sales
+        WHERE company_name = %s AND month_year = %s
+
+        UNION ALL
+
+        SELECT
+            'payment' as transaction_type,
+            payment_date as date,
+            reference_number as reference,
+            received_amount as amount,
+            description,
+            payment_mode
+        FROM company_payments
+        WHERE company_name = %s AND month_year = %s
+
+        ORDER BY date
+    """, (company, month_date, company, month_date), f'company_audit_{company}_{month}.csv')
+
+
+def rows_to_csv(rows):
+    """Whole CSV for already-fetched dict rows (header from the first row)."""
+    output = StringIO()
+    if rows:
+        writer = csv.DictWriter(output, fieldnames=rows[0].keys())
+        writer.writeheader()
+        writer.writerows(rows)
+    return output.getvalue()
+
+
+def write_query_csv(conn, sql, params, out, on_rows=None, itersize=2000):
+    """Stream a query's rows as CSV into the text file `out` through a
+    server-side cursor; `on_rows(count)` is called after every batch.
+    Returns the number of rows written.
+
+    Leaves `conn` in a transaction that the caller ends.
+    """
+    conn.autocommit = False
+    written = 0
+    with conn.cursor('export_csv', cursor_factory=extras.DictCursor) as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        writer = None
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=rows[0].keys())
+                writer.writeheader()
+            writer.writerows(rows)
+            written += len(rows)
+            if on_rows:
+                on_rows(written)
+    return written
@@ -0,0 +1,116 @@
+# search.py - Ranked full-text + trigram search across the ledger tables
+#
+# Each branch matches on the expressions indexed in create_search_indexes()
+# (to_tsvector('simple', COALESCE(col, '')) and gin_trgm_ops on the raw
+# column), so every entity is answered from a GIN index rather than a scan.
+
+MAX_PER_PAGE = 100
+
+# entity -> SQL branch. Every branch yields the same columns and uses the
+# %(q)s / %(like)s parameters.
+ENTITY_QUERIES = {
+    'spending': """
+        SELECT 'spending' AS entity, s.id, s.date, s.amount,
+               COALESCE(v.vehicle_no, '') || ' ' || s.category AS label,
+               s.reason AS snippet,
+               GREATEST(ts_rank(to_tsvector('simple', COALESCE(s.reason, '')), websearch_to_tsquery('simple', %(q)s)),
+                        word_similarity(%(q)s, COALESCE(s.reason, ''))) AS rank
+        FROM spendings s
+        LEFT JOIN vehicles v ON s.vehicle_id = v.id
+        WHERE to_tsvector('simple', COALESCE(s.reason, '')) @@ websearch_to_tsquery('simple', %(q)s)
+           OR %(q)s <%% s.reason
+    """,
+    'hired_vehicle_transaction': """
+        SELECT 'hired_vehicle_transaction' AS entity, t.id, t.transaction_date AS date, t.amount,
+               hv.vehicle_no || ' ' || t.transaction_type AS label,
+               CONCAT_WS(' / ', t.reference_no, t.description) AS snippet,
+               GREATEST(ts_rank(to_tsvector('simple', COALESCE(t.description, '')), websearch_to_tsquery('simple', %(q)s)),
+                        word_similarity(%(q)s, COALESCE(t.description, '')),
+                        similarity(%(q)s, COALESCE(t.reference_no, ''))) AS rank
+        FROM hired_vehicle_transactions t
+        JOIN hired_vehicles hv ON t.hired_vehicle_id = hv.id
+        WHERE to_tsvector('simple', COALESCE(t.description, '')) @@ websearch_to_tsquery('simple', %(q)s)
+           OR %(q)s <%% t.description
+           OR t.reference_no ILIKE %(like)s
+    """,
+    'company_sale': """
+        SELECT 'company_sale' AS entity, cs.id, cs.sale_date AS date, cs.sale_amount AS amount,
+               cs.company_name AS label,
+               CONCAT_WS(' / ', cs.invoice_number, cs.description) AS snippet,
+               GREATEST(ts_rank(to_tsvector('simple', COALESCE(cs.description, '')), websearch_to_tsquery('simple', %(q)s)),
+                        word_similarity(%(q)s, COALESCE(cs.description, '')),
+                        similarity(%(q)s, COALESCE(cs.invoice_number, ''))) AS rank
+        FROM company_sales cs
+        WHERE to_tsvector('simple', COALESCE(cs.description, '')) @@ websearch_to_tsquery('simple', %(q)s)
+           OR %(q)s <%% cs.description
+           OR cs.invoice_number ILIKE %(like)s
+    """,
+    'company_payment': """
+        SELECT 'company_payment' AS entity, cp.id, cp.payment_date AS date, cp.received_amount AS amount,
+               cp.company_name AS label,
+               cp.reference_number AS snippet,
+               similarity(%(q)s, COALESCE(cp.reference_number, '')) AS rank
+        FROM company_payments cp
+        WHERE cp.reference_number ILIKE %(like)s
+           OR %(q)s %% cp.reference_number
+    """,
+}
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_ledger(cur, q, page=1, per_page=25, entities=None):
+    """Run one ranked, paginated search over the selected entities.
+
+    `cur` is a DictCursor. Returns {'total', 'page', 'per_page', 'results'}.
+    """
+    q = (q or '').strip()
+    if len(q) < 2:
+        raise ValueError('Search query must be at least 2 characters')
+    entities = entities or list(ENTITY_QUERIES)
+    unknown = [e for e in entities if e not in ENTITY_QUERIES]
+    if unknown:
+        raise ValueError(f"Unknown entity: {', '.join(unknown)}")
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), MAX_PER_PAGE)
+
+    branches = '\nUNION ALL\n'.join(ENTITY_QUERIES[e] for e in entities)
+    params = {
+        'q': q,
+        'like': f"%{_escape_like(q)}%",
+        'limit': per_page,
+        'offset': (page - 1) * per_page,
+    }
+    cur.execute(f"""
+        WITH hits AS ({branches})
+        SELECT hits.*, COUNT(*) OVER () AS total_hits
+        FROM hits
+        ORDER BY rank DESC, date DESC, id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    """, params)
+    rows = cur.fetchall()
+    if rows:
+        total = rows[0]['total_hits']
+    elif page > 1:
+        # Past the last page there is no row to carry the window count
+        cur.execute(f"WITH hits AS ({branches}) SELECT COUNT(*) AS total_hits FROM hits", params)
+        total = cur.fetchone()['total_hits']
+    else:
+        total = 0
+    results = [{
+        'entity': row['entity'],
+        'id': row['id'],
+        'date': row['date'].strftime('%Y-%m-%d') if row['date'] else None,
+        'amount': float(row['amount']),
+        'label': row['label'],
+        'snippet': row['snippet'] or '',
+        'rank': round(float(row['rank'] or 0), 4),
+    } for row in rows]
+    return {
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'results': results,
+    }
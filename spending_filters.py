@@ -0,0 +1,188 @@
+# spending_filters.py - Whitelisted filter/sort grammar for spendings, compiled to parameterized SQL
+#
+# Query string grammar (all optional, combined with AND):
+#   vehicle_id=1,2      vehicle=TS09AB1234   category=diesel,salary
+#   spended_by=TSR,none mode=UPI,none        status=paid|unpaid   marked=true|false
+#   date_from / date_to=YYYY-MM-DD           month_from / month_to=YYYY-MM
+#   amount_min / amount_max=123.45
+#   sort=-date,amount   page=1   per_page=50
+# Lists are comma separated; "none" in spended_by/mode matches NULL.
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+MAX_PER_PAGE = 500
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _str_list(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _month(value):
+    return datetime.strptime(value, '%Y-%m').date().replace(day=1)
+
+
+def _amount(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount '{value}'")
+
+
+def _bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean '{value}'")
+
+
+def _in_list(column, allow_null=False):
+    def compile_(values):
+        wants_null = allow_null and 'none' in [v.lower() for v in values if isinstance(v, str)]
+        values = [v for v in values if not (isinstance(v, str) and v.lower() == 'none')]
+        parts = []
+        params = []
+        if values:
+            parts.append(f"{column} = ANY(%s)")
+            params.append(values)
+        if wants_null:
+            parts.append(f"{column} IS NULL")
+        if not parts:
+            return 'FALSE', []
+        return '(' + ' OR '.join(parts) + ')', params
+    return compile_
+
+
+def _compare(column, op):
+    return lambda value: (f"{column} {op} %s", [value])
+
+
+def _status(value):
+    if value == 'paid':
+        return "(s.spended_by IS NOT NULL AND s.mode IS NOT NULL)", []
+    if value == 'unpaid':
+        return "(s.spended_by IS NULL OR s.mode IS NULL)", []
+    raise ValueError("status must be 'paid' or 'unpaid'")
+
+
+# name -> (parser, compiler returning (sql, params))
+FILTERS = {
+    'vehicle_id': (_int_list, _in_list('s.vehicle_id')),
+    'vehicle': (_str_list, _in_list('v.vehicle_no')),
+    'category': (_str_list, _in_list('s.category')),
+    'spended_by': (_str_list, _in_list('s.spended_by', allow_null=True)),
+    'mode': (_str_list, _in_list('s.mode', allow_null=True)),
+    'status': (str, _status),
+    'marked': (_bool, lambda value: ("s.marked = %s", [value])),
+    'date_from': (_date, _compare('s.date', '>=')),
+    'date_to': (_date, _compare('s.date', '<=')),
+    'month_from': (_month, _compare('s.expense_month', '>=')),
+    'month_to': (_month, _compare('s.expense_month', '<=')),
+    'amount_min': (_amount, _compare('s.amount', '>=')),
+    'amount_max': (_amount, _compare('s.amount', '<=')),
+}
+
+SORT_COLUMNS = {
+    'date': 's.date',
+    'expense_month': 's.expense_month',
+    'amount': 's.amount',
+    'category': 's.category',
+    'vehicle': 'v.vehicle_no',
+    'spended_by': 's.spended_by',
+    'id': 's.id',
+}
+
+
+def compile_filters(args):
+    """Turn request args into (where_sql, params); unknown keys are ignored."""
+    clauses = []
+    params = []
+    for name, (parse, compile_) in FILTERS.items():
+        raw = args.get(name)
+        if raw is None or raw == '':
+            continue
+        try:
+            value = parse(raw)
+        except ValueError as e:
+            raise ValueError(f"Invalid value for '{name}': {e}")
+        if isinstance(value, list) and not value:
+            continue
+        sql, values = compile_(value)
+        clauses.append(sql)
+        params.extend(values)
+    return (' AND '.join(clauses) if clauses else 'TRUE'), params
+
+
+def compile_sort(value):
+    order = []
+    for field in _str_list(value or '-date'):
+        direction = 'DESC' if field.startswith('-') else 'ASC'
+        column = SORT_COLUMNS.get(field.lstrip('-+'))
+        if column is None:
+            raise ValueError(f"Cannot sort by '{field}'")
+        order.append(f"{column} {direction}")
+    # Stable pagination: always break ties on id
+    order.append('s.id DESC')
+    return ', '.join(order)
+
+
+def query_spendings(cur, args):
+    """Return one page of filtered spendings plus totals for the whole filtered set."""
+    where, params = compile_filters(args)
+    order_by = compile_sort(args.get('sort'))
+    page = max(int(args.get('page', 1)), 1)
+    per_page = min(max(int(args.get('per_page', 50)), 1), MAX_PER_PAGE)
+
+    base = f"FROM spendings s LEFT JOIN vehicles v ON s.vehicle_id = v.id WHERE {where}"
+    cur.execute(f"""
+        SELECT COUNT(*) AS count,
+               COALESCE(SUM(s.amount), 0) AS total,
+               COALESCE(SUM(s.amount) FILTER (WHERE s.spended_by IS NOT NULL AND s.mode IS NOT NULL), 0) AS paid_total,
+               COALESCE(SUM(s.amount) FILTER (WHERE s.spended_by IS NULL OR s.mode IS NULL), 0) AS unpaid_total
+        {base}
+    """, params)
+    totals = cur.fetchone()
+
+    cur.execute(f"""
+        SELECT s.id, s.date, s.expense_month, s.vehicle_id, v.vehicle_no, s.category, s.reason,
+               s.amount, s.spended_by, s.mode, s.marked
+        {base}
+        ORDER BY {order_by}
+        LIMIT %s OFFSET %s
+    """, params + [per_page, (page - 1) * per_page])
+    rows = []
+    for row in cur.fetchall():
+        rows.append({
+            'id': row['id'],
+            'date': row['date'].strftime('%Y-%m-%d'),
+            'expense_month': row['expense_month'].strftime('%Y-%m') if row['expense_month'] else '',
+            'vehicle_id': row['vehicle_id'],
+            'vehicle_no': row['vehicle_no'],
+            'category': row['category'],
+            'reason': row['reason'] or '',
+            'amount': float(row['amount']),
+            'spended_by': row['spended_by'] or '',
+            'mode': row['mode'] or '',
+            'marked': bool(row['marked']),
+        })
+
+    return {
+        'page': page,
+        'per_page': per_page,
+        'totals': {
+            'count': totals['count'],
+            'amount': float(totals['total']),
+            'paid': float(totals['paid_total']),
+            'unpaid': float(totals['unpaid_total']),
+        },
+        'rows': rows,
+    }
@@ -120,18 +120,23 @@ function markAsPaid(id) {
                 mode: 'Cash' // Default value
             })
         })
-        .then(r => r.json())
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
         .then(data => {
             if(data.success){
                 alert('Payment marked as paid successfully');
-                location.reload();
+                reloadUnlessLive();
             } else {
                 alert('Failed to mark payment as paid: ' + (data.message || 'Unknown error'));
             }
         })
         .catch(err => {
             console.error('Error:', err);
-            alert('An error occurred while marking payment as paid');
+            alert('An error occurred while marking payment as paid. Check console for details.');
         });
     }
 }
@@ -202,7 +207,7 @@ document.addEventListener('DOMContentLoaded', function(){
           method: 'DELETE'
         }).then(r => r.json()).then(data => {
           if(data.success){
-            location.reload();
+            reloadUnlessLive();
           } else {
             alert('Failed to delete spending');
           }
@@ -435,7 +440,7 @@ function processSettlement() {
         if (data.success) {
             alert(data.message);
             closeModal();
-            location.reload();
+            reloadUnlessLive();
         } else {
             alert('Error: ' + (data.message || 'Unknown error'));
         }
@@ -446,151 +451,6 @@ function processSettlement() {
     });
 }
 
-// static/js/app.js
-
-// Helper function to create hidden inputs
-function createHiddenInput(form, name, value) {
-    const input = document.createElement('input');
-    input.type = 'hidden';
-    input.name = name;
-    input.value = value;
-    form.appendChild(input);
-}
-
-// Toggle fields based on category selection
-function toggleCategoryFields() {
-    const categorySelect = document.getElementById('category');
-    const dieselFields = document.getElementById('dieselFields');
-    const salaryFields = document.getElementById('salaryFields');
-    const othersFields = document.getElementById('othersFields');
-    
-    // Hide all category sections first
-    dieselFields.classList.add('hidden');
-    salaryFields.classList.add('hidden');
-    othersFields.classList.add('hidden');
-    
-    // Show the selected category section
-    if (categorySelect.value === 'diesel') {
-        dieselFields.classList.remove('hidden');
-        toggleDieselFields();
-    } else if (categorySelect.value === 'salary') {
-        salaryFields.classList.remove('hidden');
-    } else if (categorySelect.value === 'others') {
-        othersFields.classList.remove('hidden');
-    }
-}
-
-// Toggle diesel fields based on payment status
-function toggleDieselFields() {
-    const dieselPayment = document.getElementById('diesel_payment_status');
-    const paidDieselFields = document.getElementById('paidDieselFields');
-    const unpaidDieselFields = document.getElementById('unpaidDieselFields');
-    
-    if (dieselPayment.value === 'Paid') {
-        paidDieselFields.classList.remove('hidden');
-        unpaidDieselFields.classList.add('hidden');
-    } else {
-        paidDieselFields.classList.add('hidden');
-        unpaidDieselFields.classList.remove('hidden');
-    }
-}
-
-// Switch between paid and unpaid tabs
-function switchTab(tabId) {
-    // Hide all tab contents
-    document.querySelectorAll('.tab-content').forEach(tab => {
-        tab.classList.remove('active');
-    });
-    
-    // Show the selected tab content
-    document.getElementById(tabId).classList.add('active');
-    
-    // Update tab buttons
-    document.querySelectorAll('.tab').forEach(tab => {
-        tab.classList.remove('active');
-    });
-    
-    // Find the clicked tab and activate it
-    const tabs = document.querySelectorAll('.tab');
-    for (let tab of tabs) {
-        if (tab.onclick && tab.onclick.toString().includes(tabId)) {
-            tab.classList.add('active');
-            break;
-        }
-    }
-}
-
-// Function to load vehicle spendings
-function loadVehicleSpendings(vehicleId, month){
-  fetch(`/vehicle_spendings/${vehicleId}?month=${month}`)
-    .then(r => r.json())
-    .then(rows => {
-      const area = document.getElementById('vehicleSpendingsList');
-      let html = '<h4>Spendings</h4>';
-      if(!rows || rows.length === 0){
-        html += '<p>No spendings found for selected month.</p>';
-      } else {
-        html += '<table class="spend-table"><thead><tr><th>Date</th><th>Category</th><th>Reason</th><th>Amount</th><th>Status</th><th>Marked</th></tr></thead><tbody>';
-        rows.forEach(r=>{
-          const status = (r.spended_by && r.mode) ? 'Paid' : 'Unpaid';
-          html += `<tr class="${r.marked ? 'marked' : ''}"><td>${r.date}</td><td>${r.category}</td><td>${r.reason || ''}</td><td>₹${parseFloat(r.amount).toFixed(2)}</td><td>${status}</td><td>${r.marked ? 'Yes':'No'}</td></tr>`;
-        });
-        html += '</tbody></table>';
-      }
-      area.innerHTML = html;
-    });
-}
-
-// Toggle mark function
-function toggleMark(id) {
-    const tr = document.querySelector(`tr[data-id="${id}"]`);
-    fetch('/toggle_mark', {
-        method: 'POST',
-        headers: {'Content-Type':'application/json'},
-        body: JSON.stringify({id: id})
-    }).then(r => r.json()).then(data => {
-        if(data.success){
-            tr.classList.toggle('marked');
-        } else {
-            alert('Failed to toggle mark');
-        }
-    });
-}
-
-// Mark unpaid payment as paid
-function markAsPaid(id) {
-    if(confirm('Are you sure you want to mark this payment as paid?')) {
-        fetch('/mark_paid/' + id, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                spended_by: 'TSR', // Default value
-                mode: 'Cash' // Default value
-            })
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-            return response.json();
-        })
-        .then(data => {
-            if(data.success){
-                alert('Payment marked as paid successfully');
-                location.reload();
-            } else {
-                alert('Failed to mark payment as paid: ' + (data.message || 'Unknown error'));
-            }
-        })
-        .catch(err => {
-            console.error('Error:', err);
-            alert('An error occurred while marking payment as paid. Check console for details.');
-        });
-    }
-}
-
 // Main DOM content loaded event
 document.addEventListener('DOMContentLoaded', function(){
   // mark/unmark checkboxes on spendings page
@@ -648,7 +508,7 @@ document.addEventListener('DOMContentLoaded', function(){
           method: 'DELETE'
         }).then(r => r.json()).then(data => {
           if(data.success){
-            location.reload();
+            reloadUnlessLive();
           } else {
             alert('Failed to delete spending');
           }
@@ -816,4 +676,215 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Other initialization code...
 });
-});
\ No newline at end of file
+});
+// Exports run as background jobs (POST /api/jobs); the button shows progress
+// while the job is polled and the file downloads once it is ready
+function runExportJob(kind, params, button) {
+    const label = button ? button.innerHTML : null;
+    const setLabel = text => { if (button) button.textContent = text; };
+    const restore = () => {
+        if (button) {
+            button.innerHTML = label;
+            button.disabled = false;
+        }
+    };
+    if (button) button.disabled = true;
+    setLabel('Preparing export...');
+
+    fetch('/api/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ kind: kind, params: params || {} })
+    })
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) throw new Error(data.error);
+            pollExportJob(data.job.id, setLabel, restore);
+        })
+        .catch(err => {
+            restore();
+            alert('Export failed: ' + err.message);
+        });
+}
+
+function pollExportJob(jobId, setLabel, restore) {
+    fetch('/api/jobs/' + jobId)
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) throw new Error(data.error);
+            const job = data.job;
+            if (job.status === 'done') {
+                restore();
+                window.location.href = job.download_url;
+            } else if (job.status === 'failed' || job.status === 'expired') {
+                throw new Error(job.error || 'the job ' + job.status);
+            } else {
+                setLabel(job.rows_done ? `Preparing export (${job.rows_done} rows)...` : 'Preparing export...');
+                setTimeout(() => pollExportJob(jobId, setLabel, restore), 1000);
+            }
+        })
+        .catch(err => {
+            restore();
+            alert('Export failed: ' + err.message);
+        });
+}
+
+// Live updates: listen for ledger changes over Server-Sent Events and patch
+// totals and spendings rows in place instead of reloading the page
+const liveState = { connected: false, everConnected: false, totalsTimer: null };
+
+function liveUpdatesConnected() {
+    return liveState.connected;
+}
+
+function reloadUnlessLive() {
+    if (!liveUpdatesConnected()) {
+        location.reload();
+    }
+}
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : String(value);
+    return div.innerHTML;
+}
+
+function refreshLiveTotals() {
+    // Coalesce bursts of notifications (e.g. a settlement) into one request
+    clearTimeout(liveState.totalsTimer);
+    liveState.totalsTimer = setTimeout(function() {
+        fetch('/api/live_totals')
+            .then(r => r.json())
+            .then(data => {
+                if (data.error) return;
+                document.querySelectorAll('[data-live]').forEach(el => {
+                    if (el.dataset.live in data) {
+                        el.textContent = Number(data[el.dataset.live]).toFixed(2);
+                    }
+                });
+                document.querySelectorAll('[data-live-vehicle]').forEach(el => {
+                    el.textContent = Number(data.vehicles[el.dataset.liveVehicle] || 0).toFixed(2);
+                });
+            })
+            .catch(err => console.error('Error refreshing totals:', err));
+    }, 250);
+}
+
+function spendingTableFor(spending) {
+    if (!spending.spended_by || !spending.mode) return 'unpaidTable';
+    const cutoff = new Date();
+    cutoff.setDate(cutoff.getDate() - 30);
+    return new Date(spending.date) >= cutoff ? 'paidTable' : 'settledTable';
+}
+
+function buildSpendingRow(s, tableId) {
+    const tr = document.createElement('tr');
+    tr.dataset.id = s.id;
+    const amount = '₹' + Number(s.amount).toFixed(2);
+    const common = `<td>${escapeHtml(s.date)}</td>
+        <td>${escapeHtml(s.vehicle_no)}</td>
+        <td>${escapeHtml(s.category)}</td>
+        <td>${escapeHtml(s.reason)}</td>
+        <td>${amount}</td>`;
+    const deleteBtn = `<button class="btn-delete" data-id="${s.id}" onclick="deleteSpendingLive(${s.id})"><i class="fas fa-trash"></i> Delete</button>`;
+    const editBtn = `<button class="btn-edit" onclick="openEditModal(${s.id})"><i class="fas fa-edit"></i> Edit</button>`;
+
+    if (tableId === 'paidTable') {
+        if (s.marked) tr.classList.add('marked');
+        tr.innerHTML = `<td><input type="checkbox" class="mark-checkbox" ${s.marked ? 'checked' : ''} onchange="toggleMark(${s.id})"></td>
+            ${common}
+            <td>${escapeHtml(s.spended_by)}</td>
+            <td>${escapeHtml(s.mode)}</td>
+            <td>${editBtn} ${deleteBtn}</td>`;
+    } else if (tableId === 'unpaidTable') {
+        tr.innerHTML = `<td><input type="checkbox" class="unpaid-checkbox" data-id="${s.id}" data-amount="${s.amount}"></td>
+            ${common}
+            <td>${editBtn} ${deleteBtn}
+                <button class="btn-mark-paid" data-id="${s.id}" onclick="markAsPaid(${s.id})"><i class="fas fa-check"></i> Mark as Paid</button>
+            </td>`;
+        if (typeof updateSettlementSummary === 'function') {
+            tr.querySelector('.unpaid-checkbox').addEventListener('change', updateSettlementSummary);
+        }
+    } else {
+        tr.innerHTML = `${common}
+            <td>${escapeHtml(s.spended_by)}</td>
+            <td>${escapeHtml(s.mode)}</td>`;
+    }
+    return tr;
+}
+
+function deleteSpendingLive(id) {
+    if (!confirm('Are you sure you want to delete this spending record?')) return;
+    fetch('/delete_spending/' + id, { method: 'POST' })
+        .then(() => reloadUnlessLive())
+        .catch(err => console.error('Error deleting spending:', err));
+}
+
+function applySpendingChange(event) {
+    document.querySelectorAll(`#paidTable tr[data-id="${event.id}"], #unpaidTable tr[data-id="${event.id}"], #settledTable tr[data-id="${event.id}"]`)
+        .forEach(row => row.remove());
+    if (event.op === 'DELETE') return;
+
+    fetch('/get_spending/' + event.id)
+        .then(r => r.json())
+        .then(data => {
+            if (!data.success) return;
+            const spending = data.spending;
+            const tableId = spendingTableFor(spending);
+            const tbody = document.querySelector('#' + tableId + ' tbody');
+            if (!tbody) {
+                // The table was empty when the page rendered; nothing to patch into
+                location.reload();
+                return;
+            }
+            document.querySelectorAll(`#${tableId} tr[data-id="${spending.id}"]`).forEach(row => row.remove());
+            const row = buildSpendingRow(spending, tableId);
+            // Keep the newest-first ordering used by the server
+            const before = Array.from(tbody.rows).find(r => r.cells[tableId === 'settledTable' ? 0 : 1].textContent < spending.date);
+            tbody.insertBefore(row, before || null);
+        })
+        .catch(err => console.error('Error applying live update:', err));
+}
+
+function initLiveUpdates() {
+    const hasTotals = document.querySelector('[data-live], [data-live-vehicle]');
+    const hasSpendingRows = document.getElementById('paidTab') !== null;
+    if (!(hasTotals || hasSpendingRows) || !window.EventSource) return;
+
+    const source = new EventSource('/events');
+    source.onopen = function() {
+        // Anything may have changed while we were disconnected, and those
+        // notifications are gone: resync as for a RESYNC event
+        if (liveState.everConnected) {
+            if (hasSpendingRows) {
+                location.reload();
+                return;
+            }
+            refreshLiveTotals();
+        }
+        liveState.connected = true;
+        liveState.everConnected = true;
+    };
+    source.onerror = function() {
+        liveState.connected = false;
+    };
+    source.addEventListener('change', function(e) {
+        const event = JSON.parse(e.data);
+        if (event.op === 'RESYNC') {
+            if (hasSpendingRows) {
+                location.reload();
+            } else {
+                refreshLiveTotals();
+            }
+            return;
+        }
+        if (event.table === 'spendings' || event.table === 'payments') {
+            refreshLiveTotals();
+        }
+        if (event.table === 'spendings' && hasSpendingRows) {
+            applySpendingChange(event);
+        }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', initLiveUpdates);
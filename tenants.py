@@ -0,0 +1,110 @@
+# tenants.py - Depots (tenants) sharing one application and database
+#
+# Every table created by app.py carries a tenant_id. A connection acts for one
+# tenant at a time: db.set_tenant() stores its id in the app.tenant_id
+# setting, which
+#   * the tenant_id column defaults read (current_tenant_id()), so inserts,
+#     including the rows written by the journal, period and rollup triggers,
+#     belong to the connection's tenant;
+#   * the row-level security policies filter on (see create_tenancy), so the
+#     existing queries only ever see that tenant's rows. A connection with no
+#     tenant set sees no rows at all.
+# Requests act for the logged-in user's tenant (users.tenant_id, kept in the
+# session); API keys may be prefixed with a tenant code ('depot2/...');
+# maintenance commands run once per tenant.
+#
+# Keys that were unique across the database (vehicle numbers, company names,
+# months, ledger accounts, change seqs, ...) are unique per tenant, and the
+# indexes behind per-tenant listings lead with tenant_id, so a tenant's
+# queries read only its own index entries however many tenants share them.
+#
+# Row-level security does not apply to superusers or to roles with
+# BYPASSRLS: the application must connect as an ordinary role before a
+# second tenant is added (add() refuses otherwise).
+
+import statistics
+import time
+
+DEFAULT_TENANT_ID = 1
+DEFAULT_TENANT_CODE = 'main'
+
+# Representative per-tenant reads timed by benchmark(): the spendings page,
+# monthly totals, unpaid list, ledger balances and the months dimension
+BENCHMARK_QUERIES = {
+    'recent_spendings': """
+        SELECT id, date, amount FROM spendings ORDER BY date DESC, id DESC LIMIT 100
+    """,
+    'month_by_vehicle': """
+        SELECT vehicle_id, SUM(amount) FROM spendings
+        WHERE expense_month = date_trunc('month', CURRENT_DATE)::date
+        GROUP BY vehicle_id
+    """,
+    'unpaid_spendings': """
+        SELECT id, date, amount FROM spendings
+        WHERE spended_by IS NULL OR mode IS NULL
+        ORDER BY date DESC LIMIT 100
+    """,
+    'ledger_balances': """
+        SELECT account, balance FROM account_balances
+        WHERE account IN ('cash', 'payable:unpaid')
+    """,
+    'periods': "SELECT month, spendings_count, status FROM periods ORDER BY month DESC",
+}
+
+
+def all_tenants(cur):
+    """[(id, code)] of every tenant, oldest first."""
+    cur.execute("SELECT id, code FROM tenants ORDER BY id")
+    return [(row[0], row[1]) for row in cur.fetchall()]
+
+
+def by_code(cur, code):
+    """Id of the tenant with `code`; raises ValueError if there is none."""
+    cur.execute("SELECT id FROM tenants WHERE code = %s", (code,))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"Unknown tenant '{code}'")
+    return row[0]
+
+
+def bypasses_rls(cur):
+    """Whether the connected role ignores row-level security policies."""
+    cur.execute("SELECT rolsuper OR rolbypassrls FROM pg_roles WHERE rolname = current_user")
+    return bool(cur.fetchone()[0])
+
+
+def add(cur, code, name):
+    """Create a tenant and return its id. Refuses while the application role
+    would bypass the policies that keep tenants apart."""
+    if bypasses_rls(cur):
+        raise ValueError("The database role bypasses row-level security (superuser or BYPASSRLS); "
+                         "connect as an ordinary role before adding tenants")
+    cur.execute("INSERT INTO tenants (code, name) VALUES (%s, %s) RETURNING id", (code, name))
+    return cur.fetchone()[0]
+
+
+def parse_scoped(entry):
+    """'[tenant/]value' -> (tenant code or None, value), for API keys that
+    belong to one tenant; no prefix means the default tenant."""
+    code, sep, value = entry.partition('/')
+    if not sep:
+        return None, entry
+    if not code.strip() or not value.strip():
+        raise ValueError(f"'{entry}' must look like 'tenant/value'")
+    return code.strip(), value
+
+
+def benchmark(cur, repeat=5, queries=BENCHMARK_QUERIES):
+    """Median wall-clock milliseconds of each query over `repeat` runs, as the
+    connection's tenant, plus its spendings row count for context."""
+    cur.execute("SELECT COUNT(*) FROM spendings")
+    timings = {'spendings': cur.fetchone()[0]}
+    for name, sql in queries.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cur.execute(sql)
+            cur.fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = round(statistics.median(samples), 2)
+    return timings
@@ -0,0 +1,81 @@
+import datetime
+
+import analytics
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = None
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if 'COUNT(*)' in sql:
+            self._result = [(len(self.rows), max(r[0] for r in self.rows))]
+        else:
+            self.description = [(name,) for name in
+                                ('id', 'vehicle', 'month_date', 'category', 'spended_by', 'mode', 'amount')]
+            self._result = [r for r in self.rows if r[0] > params[0]]
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+ROWS = [
+    (1, 'TS01', datetime.date(2024, 1, 1), 'diesel', 'A', 'cash', 100),
+    (2, 'TS01', datetime.date(2024, 2, 1), 'diesel', 'A', 'cash', 200),
+    (3, 'TS02', datetime.date(2024, 3, 1), 'salary', 'B', 'bank', 300),
+    (4, 'TS02', None, 'others', None, None, 400),
+]
+
+
+def frames():
+    return analytics.LedgerFrames(lambda: FakeConn(ROWS))
+
+
+def test_pivot_month_range():
+    result = frames().pivot('spendings', ['month'], month_from='2024-02', month_to='2024-03')
+    assert result['data'] == [{'month': '2024-02', 'value': 200.0}, {'month': '2024-03', 'value': 300.0}]
+
+
+def test_pivot_month_from_only():
+    result = frames().pivot('spendings', [], month_from='2024-02')
+    assert result['data'] == [{'value': 500.0}]
+
+
+def test_pivot_month_to_only_leaves_out_rows_without_a_month():
+    result = frames().pivot('spendings', [], month_to='2024-12')
+    assert result['data'] == [{'value': 600.0}]
+
+
+def test_pivot_mean_leaves_empty_cells_null():
+    result = frames().pivot('spendings', ['vehicle'], ['category'], agg='mean')
+    assert result['data'] == [
+        {'vehicle': 'TS01', 'diesel': 150.0, 'others': None, 'salary': None},
+        {'vehicle': 'TS02', 'diesel': None, 'others': 400.0, 'salary': 300.0},
+    ]
+
+
+def test_pivot_sum_fills_empty_cells_with_zero():
+    result = frames().pivot('spendings', ['vehicle'], ['category'])
+    assert result['data'][0] == {'vehicle': 'TS01', 'diesel': 300.0, 'others': 0.0, 'salary': 0.0}
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+anomalies = pytest.importorskip('anomalies')
+
+START = date(2024, 1, 1)
+
+
+def frame(*rows):
+    """rows are (id, day, amount) on one vehicle's diesel series."""
+    df = pd.DataFrame([(i, 1, 'diesel', START + timedelta(days=d), amount) for i, d, amount in rows],
+                      columns=['id', 'vehicle_id', 'category', 'date', 'amount'])
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def score(df, min_samples=8, duplicate_days=3):
+    flags, stats = anomalies.score_history(df, 3.5, min_samples, 0.1, duplicate_days)
+    return {row.spending_id: row for row in flags.itertuples(index=False)}, stats
+
+
+def test_duplicate_is_the_higher_id_even_when_dated_earlier():
+    flags, _ = score(frame((1, 5, 500), (2, 4, 500)))
+    assert list(flags) == [2]
+    assert flags[2].reason == 'duplicate'
+
+
+def test_duplicate_window_is_inclusive_on_both_sides():
+    flags, _ = score(frame((1, 10, 500), (2, 7, 500), (3, 14, 500), (4, 20, 500)))
+    assert sorted(flags) == [2]
+    flags, _ = score(frame((1, 10, 500), (2, 13, 500), (3, 6, 500)))
+    assert sorted(flags) == [2]
+
+
+def test_duplicate_found_past_a_nearer_higher_id():
+    # Row 3's nearest neighbour in date is row 4, but row 1 is also in range
+    flags, _ = score(frame((1, 0, 500), (4, 2, 500), (3, 3, 500), (2, 9, 500)))
+    assert sorted(flags) == [3, 4]
+
+
+def test_other_amounts_and_series_are_not_duplicates():
+    df = pd.concat([frame((1, 0, 500), (2, 0, 501)),
+                    frame((3, 0, 500)).assign(vehicle_id=2),
+                    frame((4, 0, 500)).assign(category='others')])
+    flags, _ = score(df)
+    assert flags == {}
+
+
+def test_outlier_is_scored_against_lower_ids():
+    # The spike has the highest id, so it is scored even though it is dated first
+    rows = [(i, 7 * i, 1000 + 10 * (i % 3)) for i in range(1, 9)] + [(9, 0, 10000)]
+    flags, stats = score(frame(*rows))
+    assert list(flags) == [9]
+    assert flags[9].reason == 'high'
+    assert 1000 < flags[9].expected_amount < 1020
+    assert stats['n'].tolist() == [9]
+
+
+def test_too_few_samples_are_not_scored():
+    rows = [(i, 7 * i, 1000) for i in range(1, 5)] + [(5, 60, 10000)]
+    flags, _ = score(frame(*rows))
+    assert flags == {}
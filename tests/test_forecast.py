@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+forecast = pytest.importorskip('forecast')
+
+
+def forecasts(*series):
+    result, history = forecast.forecast_matrix(np.array(series, dtype=float))
+    return result.round(1), history
+
+
+def months(values, total=24):
+    return [0.0] * (total - len(values)) + list(values)
+
+
+def test_young_series_is_not_diluted_by_months_before_it_started():
+    result, history = forecasts(months([900, 900]))
+    assert history.tolist() == [2]
+    assert result.tolist() == [[900.0, 900.0, 900.0]]
+
+
+def test_young_flat_series_has_no_trend():
+    result, _ = forecasts(months([1000] * 6), months([1000] * 9))
+    assert result.tolist() == [[1000.0] * 3, [1000.0] * 3]
+
+
+def test_steady_ramp_is_trend_not_seasonality():
+    result, _ = forecasts(np.linspace(100, 2400, 24))
+    # Next month would continue the ramp at 2500; the moving average lags
+    assert 2350 <= result[0][0] <= 2550
+    assert result[0][0] < result[0][1] < result[0][2]
+
+
+def test_seasonal_peak_is_kept_out_of_the_other_months():
+    result, _ = forecasts(np.tile([1000.0] * 11 + [3000.0], 2))
+    # Next month is an ordinary month, not the peak
+    assert 900 <= result[0][0] <= 1300
+
+
+def test_empty_series_forecasts_zero():
+    result, history = forecasts([0.0] * 24)
+    assert history.tolist() == [0]
+    assert result.tolist() == [[0.0, 0.0, 0.0]]
@@ -0,0 +1,48 @@
+import fragments
+
+
+class FakeCursor:
+    def __init__(self, rows, log):
+        self.rows = rows
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+        limit = int(sql.rsplit('LIMIT', 1)[1]) if 'LIMIT' in sql else len(self.rows)
+        self._result = list(self.rows[:limit])
+
+    def fetchmany(self, size):
+        batch, self._result = self._result[:size], self._result[size:]
+        return batch
+
+
+def lazy(rows, **kwargs):
+    log = []
+    return fragments.lazy_rows(lambda: FakeCursor(rows, log), "SELECT n FROM t", batch_size=2, **kwargs), log
+
+
+def test_lazy_rows_runs_on_first_use():
+    result, log = lazy([1, 2, 3])
+    assert log == []
+    assert list(result) == [1, 2, 3]
+    assert not result.truncated
+
+
+def test_lazy_rows_stops_at_max_rows_and_says_so():
+    result, log = lazy([1, 2, 3, 4, 5], max_rows=3, transform=lambda n: n * 10)
+    assert result
+    assert list(result) == [10, 20, 30]
+    assert result.truncated
+    assert log == ["SELECT n FROM t\nLIMIT 4"]
+
+
+def test_lazy_rows_exactly_at_max_rows_is_not_truncated():
+    result, _ = lazy([1, 2, 3], max_rows=3)
+    assert list(result) == [1, 2, 3]
+    assert not result.truncated
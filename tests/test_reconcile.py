@@ -0,0 +1,86 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+reconcile = pytest.importorskip('reconcile')
+
+START = date(2024, 1, 1)
+
+
+def day(n):
+    return START + timedelta(days=n)
+
+
+def spending(spending_id, n, paise, mode=None, unpaid=False):
+    return (spending_id, day(n), paise, mode, unpaid)
+
+
+def sweep_run(candidates, target, used):
+    """Reference for _find_run: the latest run of 2..MAX_RUN consecutive
+    unused positive candidates adding up to `target`, by a plain sweep."""
+    best, run, total = None, [], 0
+    for candidate in candidates:
+        if candidate[0] in used or candidate[2] <= 0:
+            run, total = [], 0
+            continue
+        run.append(candidate)
+        total += candidate[2]
+        while total > target or len(run) > reconcile.MAX_RUN:
+            total -= run.pop(0)[2]
+        if total == target and len(run) >= 2:
+            best = list(run)
+    return best
+
+
+def test_one_to_one_prefers_closest_date_and_matching_mode():
+    spendings = [spending(1, 0, 5000, 'cash'), spending(2, 2, 5000, 'card'), spending(3, 2, 7000)]
+    proposals = reconcile.propose_matches([(10, day(2), 5000)], spendings, mode='card')
+    assert proposals == [(10, [2], 1.0, 'one_to_one')]
+
+
+def test_one_to_one_outside_window_is_not_matched():
+    proposals = reconcile.propose_matches([(10, day(10), 5000)], [spending(1, 0, 5000)])
+    assert proposals == []
+
+
+def test_many_to_one_settles_consecutive_unpaid_spendings():
+    spendings = [spending(1, 0, 1000, unpaid=True), spending(2, 1, 2000, unpaid=True),
+                 spending(3, 2, 3000, unpaid=True), spending(4, 3, 9999)]
+    proposals = reconcile.propose_matches([(10, day(5), 5000)], spendings)
+    assert [(p[0], p[1], p[3]) for p in proposals] == [(10, [2, 3], 'many_to_one')]
+
+
+def test_many_to_one_skips_spendings_used_one_to_one():
+    spendings = [spending(1, 0, 1000, unpaid=True), spending(2, 1, 2000, unpaid=True),
+                 spending(3, 2, 1000, unpaid=True)]
+    proposals = reconcile.propose_matches([(10, day(2), 1000), (11, day(3), 3000)], spendings)
+    assert proposals == [(10, [3], 0.95, 'one_to_one'), (11, [1, 2], 0.55, 'many_to_one')]
+
+
+def test_non_positive_amount_breaks_a_run():
+    spendings = [spending(1, 0, 1000, unpaid=True), spending(2, 1, 0, unpaid=True),
+                 spending(3, 2, 2000, unpaid=True)]
+    assert reconcile.propose_matches([(10, day(3), 3000)], spendings) == []
+
+
+def test_runs_by_total_indexes_every_run_in_end_order():
+    candidates = [spending(1, 0, 1), spending(2, 0, 2), spending(3, 0, -1), spending(4, 0, 3), spending(5, 0, 1)]
+    runs = reconcile._runs_by_total(candidates, 4)
+    assert dict(runs) == {3: [(1, 0)], 4: [(4, 3)]}
+    assert reconcile._runs_by_total(candidates, 0) == {}
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_find_run_matches_a_plain_sweep(seed):
+    rng = random.Random(seed)
+    candidates = [spending(i, i // 3, rng.choice([0, -5] + list(range(1, 40))), unpaid=True)
+                  for i in range(300)]
+    runs = reconcile._runs_by_total(candidates, 150)
+    used = set(rng.sample(range(300), 30))
+    for _ in range(50):
+        target = rng.randrange(1, 150)
+        lo = rng.randrange(300)
+        hi = rng.randrange(lo, 301)
+        expected = sweep_run(candidates[lo:hi], target, used)
+        assert reconcile._find_run(candidates, runs.get(target), lo, hi, used) == expected
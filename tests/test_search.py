@@ -0,0 +1,41 @@
+import datetime
+
+import search
+
+HITS = [{'entity': 'spending', 'id': i, 'date': datetime.date(2024, 1, i), 'amount': 100,
+         'label': 'TS01 diesel', 'snippet': 'fuel', 'rank': 1.0} for i in range(1, 4)]
+
+
+class FakeCursor:
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, sql, params):
+        self.queries.append(sql)
+        if 'OFFSET' in sql:
+            page = HITS[params['offset']:params['offset'] + params['limit']]
+            self._result = [dict(row, total_hits=len(HITS)) for row in page]
+        else:
+            self._result = [{'total_hits': len(HITS)}]
+
+    def fetchall(self):
+        return self._result
+
+    def fetchone(self):
+        return self._result[0]
+
+
+def test_total_comes_with_the_page():
+    cur = FakeCursor()
+    result = search.search_ledger(cur, 'fuel', page=2, per_page=2)
+    assert result['total'] == 3
+    assert [r['id'] for r in result['results']] == [3]
+    assert len(cur.queries) == 1
+
+
+def test_total_past_the_last_page_is_counted_separately():
+    cur = FakeCursor()
+    result = search.search_ledger(cur, 'fuel', page=5, per_page=2)
+    assert result['total'] == 3
+    assert result['results'] == []
+    assert len(cur.queries) == 2
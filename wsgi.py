@@ -0,0 +1,19 @@
+# wsgi.py - Production entry point
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# With preload_app the master imports this module once: schema setup and
+# template compilation happen here, before workers are forked, and each worker
+# then runs app.warm_worker() from the post_fork hook.
+
+import os
+
+os.environ.setdefault('INIT_DB_ON_IMPORT', '0')
+
+import app as application  # noqa: E402
+
+app = application.create_app()
+
+# Connections opened while initializing belong to the master; close them so
+# no worker inherits (and shares) their sockets
+application.db_router.dispose()